@@ -0,0 +1,142 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+from collections import OrderedDict
+from Prefix import Prefix
+
+#--- match fields holding an address or prefix rather than a number
+ADDRESS_FIELDS = ["nw_src", "nw_dst"]
+#--- OF 1.3 names of the fields SciPass headers use, the flow builders rename them in place
+FIELD_ALIASES = {"in_port": "phys_port",
+                 "ipv4_src": "nw_src", "ipv6_src": "nw_src",
+                 "ipv4_dst": "nw_dst", "ipv6_dst": "nw_dst"}
+
+
+def matchKey(match):
+  """returns a hashable, canonical form of a match or header dict
+
+  addresses compare as prefixes whether they come as ipaddr networks,
+  strings or the (address, mask) tuples of an OF 1.3 match, and numeric
+  fields compare as ints whether they come as ints or strings.
+  """
+  key = []
+  for field, value in match.items():
+    field = FIELD_ALIASES.get(field, field)
+    if(field in ADDRESS_FIELDS):
+      if(isinstance(value, tuple)):
+        value = "%s/%s" % value
+      try:
+        value = Prefix.fromNetwork(value)
+      except (AttributeError, ValueError):
+        value = str(value)
+    elif(not isinstance(value, (int, long))):
+      try:
+        value = int(value)
+      except (TypeError, ValueError):
+        pass
+    key.append((field, value))
+  return tuple(sorted(key))
+
+def flowKey(dpid, domain, match, priority):
+  """returns the key a FlowRegistry stores a flow under"""
+  return (dpid, domain, matchKey(match), int(priority))
+
+
+class FlowRegistry:
+  """Installed flows indexed by (dpid, domain, match, priority)
+
+  Add, lookup and remove are O(1) and listing follows insertion order. A
+  second index by (match, priority) finds the flows of a flow removed
+  message, which names neither the switch nor the domain.
+  """
+  def __init__(self):
+    self.flows   = OrderedDict()
+    self.byMatch = {}
+
+  def add(self, dpid, domain, match, priority, flow):
+    """stores flow, replacing any flow with the same key; returns the key"""
+    key = flowKey(dpid, domain, match, priority)
+    self.flows[key] = flow
+    self.byMatch.setdefault(key[2:], set()).add(key)
+    return key
+
+  def get(self, dpid, domain, match, priority):
+    """returns the flow stored under the key or None"""
+    return self.flows.get(flowKey(dpid, domain, match, priority))
+
+  def hasKey(self, key):
+    """true if a flow is stored under a key made by flowKey"""
+    return key in self.flows
+
+  def removeKey(self, key):
+    """removes and returns the flow stored under a key made by flowKey, None if there is none"""
+    flow = self.flows.pop(key, None)
+    if(flow is not None):
+      keys = self.byMatch[key[2:]]
+      keys.discard(key)
+      if(not keys):
+        del self.byMatch[key[2:]]
+    return flow
+
+  def remove(self, match, priority, dpid=None, domain=None):
+    """removes and returns the flows with match and priority
+
+    a dpid or domain of None matches any switch or domain
+    """
+    fields = (matchKey(match), int(priority))
+    keys = self.byMatch.get(fields)
+    if(not keys):
+      return []
+    removed = []
+    for key in list(keys):
+      if(dpid is not None and key[0] != dpid):
+        continue
+      if(domain is not None and key[1] != domain):
+        continue
+      removed.append(self.flows.pop(key))
+      keys.remove(key)
+    if(not keys):
+      del self.byMatch[fields]
+    return removed
+
+  def removeNewest(self, count):
+    """removes and returns the count flows added last, newest first
+
+    a flow replaced in place keeps its place, so this undoes the adds made
+    since len() was count lower
+    """
+    removed = []
+    for key in list(itertools.islice(reversed(self.flows), count)):
+      removed.append(self.removeKey(key))
+    return removed
+
+  def clear(self):
+    self.flows.clear()
+    self.byMatch.clear()
+
+  def values(self):
+    """returns the flows in the order they were added"""
+    return self.flows.values()
+
+  def __contains__(self, key):
+    dpid, domain, match, priority = key
+    return self.get(dpid, domain, match, priority) is not None
+
+  def __iter__(self):
+    return iter(self.flows.values())
+
+  def __len__(self):
+    return len(self.flows)
@@ -0,0 +1,67 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+
+class OrderedSet(object):
+  """A set that remembers insertion order
+
+  Membership, add and remove are O(1); iteration follows insertion order so
+  the saved state and REST output list prefixes the way they were added.
+  """
+  def __init__(self, items=None):
+    self.items = OrderedDict()
+    if(items is not None):
+      for item in items:
+        self.add(item)
+
+  def add(self, item):
+    """adds item at the end, does nothing if it is already present"""
+    if(item not in self.items):
+      self.items[item] = None
+
+  def remove(self, item):
+    """removes item, raises KeyError if it is not present"""
+    del self.items[item]
+
+  def discard(self, item):
+    """removes item if it is present"""
+    if(item in self.items):
+      del self.items[item]
+
+  def __contains__(self, item):
+    return item in self.items
+
+  def __iter__(self):
+    return iter(self.items)
+
+  def __reversed__(self):
+    return reversed(self.items)
+
+  def __len__(self):
+    return len(self.items)
+
+  def __eq__(self, other):
+    try:
+      return list(self) == list(other)
+    except TypeError:
+      return False
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __repr__(self):
+    return "OrderedSet(%s)" % repr(list(self))
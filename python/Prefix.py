@@ -0,0 +1,177 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ipaddr
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+
+class Prefix(object):
+  """A compact IPv4/IPv6 prefix held as (version, network int, prefixlen)
+
+  Used inside the balancer instead of ipaddr networks. It hashes the same
+  as the equivalent ipaddr network and compares equal to it, so dicts keyed
+  by Prefix can still be looked up with ipaddr objects. Convert with
+  fromNetwork/toNetwork at the SciPass/Ryu boundary.
+  """
+  __slots__ = ('version', 'network', 'prefixlen', '_hash')
+
+  def __init__(self, version, network, prefixlen):
+    bits = ADDRESS_BITS[version]
+    if(prefixlen < 0 or prefixlen > bits):
+      raise ValueError("invalid prefixlen %s for IPv%d" % (str(prefixlen), version))
+    self.version   = version
+    self.prefixlen = prefixlen
+    mask           = _netmask(bits, prefixlen)
+    self.network   = network & mask
+    #--- same value ipaddr uses, so either object finds the other in a dict
+    self._hash     = hash(self.network ^ mask)
+
+  @classmethod
+  def fromNetwork(cls, net):
+    """returns a Prefix for a Prefix, an ipaddr network or a prefix string"""
+    if(isinstance(net, Prefix)):
+      return net
+    if(isinstance(net, basestring)):
+      net = ipaddr.IPNetwork(net)
+    #--- int() of an ipaddr network is its address, the constructor masks off the host bits
+    return cls(net.version, int(net), net.prefixlen)
+
+  def toNetwork(self):
+    """returns the equivalent ipaddr network"""
+    if(self.version == 4):
+      return ipaddr.IPv4Network(str(self))
+    return ipaddr.IPv6Network(str(self))
+
+  @property
+  def numhosts(self):
+    return 1 << (ADDRESS_BITS[self.version] - self.prefixlen)
+
+  @property
+  def netmask(self):
+    return _netmask(ADDRESS_BITS[self.version], self.prefixlen)
+
+  @property
+  def broadcast(self):
+    return self.network | (self.numhosts - 1)
+
+  def Contains(self, other):
+    """true if other (a Prefix or ipaddr network) is inside this prefix"""
+    other = Prefix.fromNetwork(other)
+    if(other.version != self.version or other.prefixlen < self.prefixlen):
+      return False
+    return (other.network & self.netmask) == self.network
+
+  __contains__ = Contains
+
+  def overlaps(self, other):
+    other = Prefix.fromNetwork(other)
+    return self.Contains(other) or other.Contains(self)
+
+  def supernet(self, prefixlen_diff=1):
+    if(self.prefixlen - prefixlen_diff < 0):
+      raise ValueError("cannot set prefixlen_diff to %d for %s" % (prefixlen_diff, str(self)))
+    return Prefix(self.version, self.network, self.prefixlen - prefixlen_diff)
+
+  def subnet(self, prefixlen_diff=1, new_prefix=None):
+    """returns the list of subnets prefixlen_diff bits more specific"""
+    if(new_prefix is not None):
+      prefixlen_diff = new_prefix - self.prefixlen
+    bits = ADDRESS_BITS[self.version]
+    new_prefixlen = self.prefixlen + prefixlen_diff
+    if(prefixlen_diff < 0 or new_prefixlen > bits):
+      raise ValueError("cannot set prefixlen_diff to %d for %s" % (prefixlen_diff, str(self)))
+    step = 1 << (bits - new_prefixlen)
+    return [Prefix(self.version, self.network + (i * step), new_prefixlen)
+            for i in xrange(1 << prefixlen_diff)]
+
+  #--- ipaddr spellings used throughout the balancer
+  Supernet = supernet
+  Subnet = subnet
+
+  def _tuple(self):
+    return (self.version, self.network, self.prefixlen)
+
+  def __hash__(self):
+    return self._hash
+
+  def __eq__(self, other):
+    if(isinstance(other, Prefix)):
+      return (self.network == other.network and self.prefixlen == other.prefixlen
+              and self.version == other.version)
+    try:
+      return (self.version == other.version and self.prefixlen == other.prefixlen
+              and self.network == int(other.network))
+    except (AttributeError, TypeError, ValueError):
+      return False
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __lt__(self, other):
+    return self._tuple() < Prefix.fromNetwork(other)._tuple()
+
+  def __le__(self, other):
+    return self._tuple() <= Prefix.fromNetwork(other)._tuple()
+
+  def __gt__(self, other):
+    return self._tuple() > Prefix.fromNetwork(other)._tuple()
+
+  def __ge__(self, other):
+    return self._tuple() >= Prefix.fromNetwork(other)._tuple()
+
+  #--- prefixes are never modified in place so copies can share them
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+  def __reduce__(self):
+    return (Prefix, self._tuple())
+
+  def __str__(self):
+    if(self.version == 4):
+      addr = "%d.%d.%d.%d" % ((self.network >> 24) & 0xff, (self.network >> 16) & 0xff,
+                              (self.network >> 8) & 0xff, self.network & 0xff)
+    else:
+      addr = _compress([(self.network >> shift) & 0xffff for shift in xrange(112, -16, -16)])
+    return "%s/%d" % (addr, self.prefixlen)
+
+  def __repr__(self):
+    return "Prefix('%s')" % str(self)
+
+
+def _netmask(bits, prefixlen):
+  return ((1 << bits) - 1) ^ ((1 << (bits - prefixlen)) - 1)
+
+def _compress(hextets):
+  """formats IPv6 hextets, replacing the longest run of zeros with ::"""
+  best_start = -1
+  best_len = 0
+  start = -1
+  for index in xrange(len(hextets) + 1):
+    if(index < len(hextets) and hextets[index] == 0):
+      if(start == -1):
+        start = index
+    elif(start != -1):
+      if(index - start > best_len):
+        best_start = start
+        best_len = index - start
+      start = -1
+  words = ["%x" % word for word in hextets]
+  if(best_len > 1):
+    return ":".join(words[:best_start]) + "::" + ":".join(words[best_start + best_len:])
+  return ":".join(words)
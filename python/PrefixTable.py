@@ -0,0 +1,196 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+from Prefix import Prefix
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+#--- group column value for prefixes not assigned to any group
+NO_GROUP = -1
+
+
+class PrefixTable:
+  """Per prefix bandwidth, packet rate, host count and group kept in parallel arrays
+
+  Reads and writes like the prefix -> bandwidth defaultdict the balancer used
+  before, so prefixBW[prefix], has_key, del and iteration keep working. Each
+  prefix owns a slot in the arrays; freed slots are reused. Whole table
+  questions (group totals, a group's prefixes by bandwidth) are answered with
+  NumPy when it is installed and with plain loops over the arrays when not.
+  """
+  def __init__(self, size=1024):
+    self.slots     = {}
+    self.prefixes  = []
+    self.free      = []
+    self.groupIds  = {}
+    self.groupList = []
+    self._allocate(size)
+
+  def _allocate(self, size):
+    if(numpy is not None):
+      self.bw      = numpy.zeros(size)
+      self.pps     = numpy.zeros(size)
+      self.hosts   = numpy.zeros(size)
+      self.group   = numpy.empty(size, dtype=numpy.int64)
+      self.group.fill(NO_GROUP)
+    else:
+      self.bw      = array('d', [0.0] * size)
+      self.pps     = array('d', [0.0] * size)
+      self.hosts   = array('d', [0.0] * size)
+      self.group   = array('l', [NO_GROUP] * size)
+
+  def _grow(self):
+    """doubles the arrays once every slot is taken"""
+    size = len(self.bw)
+    if(numpy is not None):
+      self.bw    = numpy.concatenate((self.bw, numpy.zeros(size)))
+      self.pps   = numpy.concatenate((self.pps, numpy.zeros(size)))
+      self.hosts = numpy.concatenate((self.hosts, numpy.zeros(size)))
+      group      = numpy.empty(size, dtype=numpy.int64)
+      group.fill(NO_GROUP)
+      self.group = numpy.concatenate((self.group, group))
+    else:
+      self.bw.extend([0.0] * size)
+      self.pps.extend([0.0] * size)
+      self.hosts.extend([0.0] * size)
+      self.group.extend([NO_GROUP] * size)
+
+  def _slot(self, prefix):
+    """returns the slot of prefix, adding it if it is new"""
+    slot = self.slots.get(prefix)
+    if(slot is not None):
+      return slot
+    prefix = Prefix.fromNetwork(prefix)
+    if(self.free):
+      slot = self.free.pop()
+      self.prefixes[slot] = prefix
+    else:
+      slot = len(self.prefixes)
+      if(slot >= len(self.bw)):
+        self._grow()
+      self.prefixes.append(prefix)
+    self.slots[prefix] = slot
+    self.bw[slot]    = 0.0
+    self.pps[slot]   = 0.0
+    self.hosts[slot] = prefix.numhosts
+    self.group[slot] = NO_GROUP
+    return slot
+
+  def _groupId(self, group):
+    if(not self.groupIds.has_key(group)):
+      self.groupIds[group] = len(self.groupList)
+      self.groupList.append(group)
+    return self.groupIds[group]
+
+  #--- the dict view
+  def __getitem__(self, prefix):
+    #--- like the defaultdict this replaces, reading a missing prefix adds it at 0
+    return float(self.bw[self._slot(prefix)])
+
+  def __setitem__(self, prefix, bw):
+    self.bw[self._slot(prefix)] = bw
+
+  def __delitem__(self, prefix):
+    slot = self.slots.pop(prefix)
+    self.prefixes[slot] = None
+    self.bw[slot] = 0.0
+    self.pps[slot] = 0.0
+    self.group[slot] = NO_GROUP
+    self.free.append(slot)
+
+  def __contains__(self, prefix):
+    return prefix in self.slots
+
+  has_key = __contains__
+
+  def __len__(self):
+    return len(self.slots)
+
+  def __iter__(self):
+    return iter(self.slots)
+
+  def keys(self):
+    return self.slots.keys()
+
+  def items(self):
+    return [(prefix, float(self.bw[slot])) for prefix, slot in self.slots.items()]
+
+  def get(self, prefix, default=None):
+    slot = self.slots.get(prefix)
+    if(slot is None):
+      return default
+    return float(self.bw[slot])
+
+  #--- the other columns
+  def setGroup(self, prefix, group):
+    """records the group prefix is assigned to, None for no group"""
+    slot = self.slots.get(prefix)
+    if(slot is None):
+      return
+    if(group is None):
+      self.group[slot] = NO_GROUP
+    else:
+      self.group[slot] = self._groupId(group)
+
+  def setPacketRate(self, prefix, pps):
+    self.pps[self._slot(prefix)] = pps
+
+  def getPacketRate(self, prefix):
+    slot = self.slots.get(prefix)
+    if(slot is None):
+      return 0.0
+    return float(self.pps[slot])
+
+  #--- whole table computations
+  def groupTotals(self, column='bw'):
+    """returns {group: sum of column over the group's prefixes} for every group seen"""
+    values = getattr(self, column)
+    used = len(self.prefixes)
+    totals = {}
+    if(numpy is not None):
+      groups = self.group[:used]
+      assigned = groups >= 0
+      sums = numpy.bincount(groups[assigned], weights=values[:used][assigned], minlength=len(self.groupList))
+      for index, group in enumerate(self.groupList):
+        totals[group] = float(sums[index])
+      return totals
+    sums = [0.0] * len(self.groupList)
+    group = self.group
+    for slot in xrange(used):
+      if(group[slot] >= 0):
+        sums[group[slot]] += values[slot]
+    for index, group in enumerate(self.groupList):
+      totals[group] = sums[index]
+    return totals
+
+  def groupPrefixes(self, group, column='bw'):
+    """returns the prefixes of group ordered by column, largest first"""
+    if(not self.groupIds.has_key(group)):
+      return []
+    groupId = self.groupIds[group]
+    values = getattr(self, column)
+    used = len(self.prefixes)
+    if(numpy is not None):
+      slots = numpy.flatnonzero(self.group[:used] == groupId)
+      #--- stable sort on the negated values keeps equal values in slot order
+      slots = slots[numpy.argsort(-values[slots], kind='mergesort')]
+      return [self.prefixes[slot] for slot in slots]
+    slots = [slot for slot in xrange(used) if self.group[slot] == groupId]
+    slots.sort(key=lambda slot: values[slot], reverse=True)
+    return [self.prefixes[slot] for slot in slots]
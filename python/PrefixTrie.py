@@ -0,0 +1,232 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from Prefix import ADDRESS_BITS
+
+
+class _TrieNode(object):
+  """a node in the path compressed trie, glue nodes have prefix None"""
+  __slots__ = ('network', 'prefixlen', 'prefix', 'value', 'children')
+
+  def __init__(self, network, prefixlen, prefix=None, value=None):
+    self.network   = network
+    self.prefixlen = prefixlen
+    self.prefix    = prefix
+    self.value     = value
+    self.children  = [None, None]
+
+
+class PrefixTrie:
+  """A binary radix (path compressed) trie keyed by IPv4/IPv6 prefixes
+
+  Any object with version, network and prefixlen attributes can be used
+  as a key (ipaddr networks included). Lookups, containment and overlap
+  checks walk at most prefixlen bits.
+  """
+  def __init__(self):
+    self.roots = {}
+    for version in ADDRESS_BITS:
+      self.roots[version] = _TrieNode(0, 0)
+    self.count = 0
+
+  def __len__(self):
+    return self.count
+
+  def __contains__(self, prefix):
+    return self._find(prefix) is not None
+
+  def _key(self, prefix):
+    version = prefix.version
+    return version, ADDRESS_BITS[version], int(prefix.network), prefix.prefixlen
+
+  def _bit(self, network, pos, bits):
+    return (network >> (bits - 1 - pos)) & 1
+
+  def _common(self, net_a, len_a, net_b, len_b, bits):
+    """number of leading bits two prefixes have in common"""
+    common = bits - (net_a ^ net_b).bit_length()
+    return min(common, len_a, len_b)
+
+  def _mask(self, network, prefixlen, bits):
+    return network & ~((1 << (bits - prefixlen)) - 1)
+
+  def _find(self, prefix):
+    """returns the node holding exactly prefix or None"""
+    version, bits, network, prefixlen = self._key(prefix)
+    node = self.roots[version]
+    while node is not None:
+      nlen = node.prefixlen
+      #--- the node has to be a prefix of what we are looking for
+      if nlen > prefixlen or (network ^ node.network) >> (bits - nlen):
+        return None
+      if nlen == prefixlen:
+        if node.prefix is None:
+          return None
+        return node
+      node = node.children[(network >> (bits - 1 - nlen)) & 1]
+    return None
+
+  def insert(self, prefix, value=None):
+    """adds or replaces the value stored for prefix"""
+    version, bits, network, prefixlen = self._key(prefix)
+    network = self._mask(network, prefixlen, bits)
+    parent = None
+    side = 0
+    node = self.roots[version]
+    while True:
+      nlen = node.prefixlen
+      if nlen > prefixlen or (network ^ node.network) >> (bits - nlen):
+        #--- prefix diverges inside this node, a new node has to go above it
+        common = self._common(node.network, nlen, network, prefixlen, bits)
+        if common == prefixlen:
+          new = _TrieNode(network, prefixlen, prefix, value)
+          new.children[self._bit(node.network, prefixlen, bits)] = node
+        else:
+          new = _TrieNode(self._mask(network, common, bits), common)
+          new.children[self._bit(node.network, common, bits)] = node
+          new.children[self._bit(network, common, bits)] = _TrieNode(network, prefixlen, prefix, value)
+        parent.children[side] = new
+        self.count += 1
+        return
+      if nlen == prefixlen:
+        if node.prefix is None:
+          self.count += 1
+        node.prefix = prefix
+        node.value = value
+        return
+      side = (network >> (bits - 1 - nlen)) & 1
+      child = node.children[side]
+      if child is None:
+        node.children[side] = _TrieNode(network, prefixlen, prefix, value)
+        self.count += 1
+        return
+      parent = node
+      node = child
+
+  def delete(self, prefix):
+    """removes prefix, returns 1 if it was present and 0 otherwise"""
+    version, bits, network, prefixlen = self._key(prefix)
+    path = []
+    node = self.roots[version]
+    while node is not None:
+      nlen = node.prefixlen
+      if nlen > prefixlen or (network ^ node.network) >> (bits - nlen):
+        return 0
+      if nlen == prefixlen:
+        break
+      side = (network >> (bits - 1 - nlen)) & 1
+      path.append((node, side))
+      node = node.children[side]
+    if node is None or node.prefix is None:
+      return 0
+
+    node.prefix = None
+    node.value = None
+    self.count -= 1
+    #--- collapse glue nodes that no longer branch, the root always stays
+    while path:
+      children = [c for c in node.children if c is not None]
+      if node.prefix is not None or len(children) == 2:
+        break
+      parent, side = path.pop()
+      if children:
+        parent.children[side] = children[0]
+        break
+      parent.children[side] = None
+      node = parent
+    return 1
+
+  def get(self, prefix, default=None):
+    """returns the value stored for exactly prefix"""
+    node = self._find(prefix)
+    if node is None:
+      return default
+    return node.value
+
+  def matches(self, prefix):
+    """returns (prefix, value) for every entry containing prefix, least specific first"""
+    version, bits, network, prefixlen = self._key(prefix)
+    found = []
+    node = self.roots[version]
+    while node is not None:
+      nlen = node.prefixlen
+      if nlen > prefixlen or (network ^ node.network) >> (bits - nlen):
+        break
+      if node.prefix is not None:
+        found.append((node.prefix, node.value))
+      if nlen == prefixlen:
+        break
+      node = node.children[(network >> (bits - 1 - nlen)) & 1]
+    return found
+
+  def longestMatch(self, prefix):
+    """returns (prefix, value) of the most specific entry containing prefix or None"""
+    found = self.matches(prefix)
+    if found:
+      return found[-1]
+    return None
+
+  def _subtree(self, prefix):
+    """returns the top node whose prefixes are all contained by prefix"""
+    version, bits, network, prefixlen = self._key(prefix)
+    node = self.roots[version]
+    while node is not None:
+      common = self._common(node.network, node.prefixlen, network, prefixlen, bits)
+      if common >= prefixlen:
+        return node
+      if common < node.prefixlen:
+        return None
+      node = node.children[self._bit(network, node.prefixlen, bits)]
+    return None
+
+  def _walk(self, node):
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      if node.prefix is not None:
+        yield node.prefix, node.value
+      for child in (node.children[1], node.children[0]):
+        if child is not None:
+          stack.append(child)
+
+  def covered(self, prefix):
+    """returns (prefix, value) for every entry contained by prefix (itself included)"""
+    node = self._subtree(prefix)
+    if node is None:
+      return []
+    return list(self._walk(node))
+
+  def hasCovered(self, prefix):
+    """true if any entry is contained by prefix (itself included)"""
+    node = self._subtree(prefix)
+    if node is None:
+      return False
+    #--- glue nodes always have two children so only an empty root can hold nothing
+    return node.prefix is not None or node.children[0] is not None or node.children[1] is not None
+
+  def overlaps(self, prefix):
+    """true if any entry contains or is contained by prefix"""
+    if self.longestMatch(prefix) is not None:
+      return True
+    return self.hasCovered(prefix)
+
+  def items(self):
+    res = []
+    for version in sorted(self.roots):
+      res.extend(self._walk(self.roots[version]))
+    return res
+
+  def keys(self):
+    return [prefix for prefix, value in self.items()]
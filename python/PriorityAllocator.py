@@ -0,0 +1,149 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+
+
+class PriorityAllocator:
+  """Hands out blocks of OpenFlow priorities from [base, limit)
+
+  Allocated blocks are kept by start, released blocks go on a sorted free
+  list of [start, size] holes that are merged with their neighbours, and
+  everything from top up to limit has never been handed out. Allocation is
+  first fit, so released ranges are reused before the space grows.
+  """
+  def __init__(self, base=500, limit=65535, blockSize=100):
+    self.base      = int(base)
+    self.limit     = int(limit)
+    self.blockSize = int(blockSize)
+    self.blocks    = {}
+    self.starts    = []
+    self.free      = []
+    self.top       = self.base
+
+  def allocate(self, size=None):
+    """returns the start of a free block of size priorities, None if there is no room"""
+    if(size is None):
+      size = self.blockSize
+    for hole in self.free:
+      if(hole[1] >= size):
+        start = hole[0]
+        self._take(start, size)
+        return start
+    if(self.top + size > self.limit):
+      return None
+    start = self.top
+    self.top += size
+    self._add(start, size)
+    return start
+
+  def release(self, start):
+    """returns the block at start to the free list"""
+    size = self.blocks.pop(start)
+    self.starts.remove(start)
+    index = bisect.bisect(self.free, [start, size])
+    self.free.insert(index, [start, size])
+    #--- merge with the holes either side
+    if(index + 1 < len(self.free) and start + size == self.free[index + 1][0]):
+      self.free[index][1] += self.free[index + 1][1]
+      del self.free[index + 1]
+    if(index > 0 and self.free[index - 1][0] + self.free[index - 1][1] == start):
+      self.free[index - 1][1] += self.free[index][1]
+      del self.free[index]
+      index -= 1
+    #--- a hole reaching top is just unused space again
+    if(self.free and self.free[-1][0] + self.free[-1][1] == self.top):
+      self.top = self.free.pop()[0]
+
+  def _add(self, start, size):
+    self.blocks[start] = size
+    bisect.insort(self.starts, start)
+
+  def _take(self, start, size):
+    """allocates [start, start + size) out of a hole that holds it"""
+    for index, hole in enumerate(self.free):
+      if(hole[0] <= start and start + size <= hole[0] + hole[1]):
+        del self.free[index]
+        if(start + size < hole[0] + hole[1]):
+          self.free.insert(index, [start + size, hole[0] + hole[1] - start - size])
+        if(hole[0] < start):
+          self.free.insert(index, [hole[0], start - hole[0]])
+        self._add(start, size)
+        return
+    raise ValueError("priorities %d-%d are not free" % (start, start + size - 1))
+
+  def move(self, old, new):
+    """moves the block at old to the free range at new"""
+    size = self.blocks[old]
+    self.release(old)
+    if(new >= self.top):
+      #--- the release gave the space back to top
+      if(new > self.top):
+        self.free.append([self.top, new - self.top])
+      self.top = new + size
+      self._add(new, size)
+      return
+    self._take(new, size)
+
+  def blockOf(self, priority):
+    """returns the start of the block holding priority, or None"""
+    index = bisect.bisect(self.starts, priority) - 1
+    if(index >= 0 and priority < self.starts[index] + self.blocks[self.starts[index]]):
+      return self.starts[index]
+    return None
+
+  def blocksIn(self, priority, size):
+    """returns the starts of the blocks overlapping [priority, priority + size)"""
+    res = []
+    index = max(bisect.bisect(self.starts, priority) - 1, 0)
+    while(index < len(self.starts) and self.starts[index] < priority + size):
+      start = self.starts[index]
+      if(start + self.blocks[start] > priority):
+        res.append(start)
+      index += 1
+    return res
+
+  def compactionPlan(self, pinned=()):
+    """returns [(old start, new start)] moving the highest blocks down into the lowest holes
+
+    only blocks that can go lower move, so the flows rewritten are the ones
+    sitting above the holes. pinned blocks stay where they are and nothing
+    below one moves, since that could no longer lower the high water mark.
+    """
+    holes = [list(hole) for hole in self.free]
+    moves = []
+    for start in reversed(self.starts):
+      if(start in pinned):
+        break
+      size = self.blocks[start]
+      for hole in holes:
+        if(hole[0] >= start):
+          break
+        if(hole[1] >= size):
+          moves.append((start, hole[0]))
+          hole[0] += size
+          hole[1] -= size
+          break
+    return moves
+
+  def utilisation(self):
+    capacity = self.limit - self.base
+    allocated = sum(self.blocks.values())
+    return {'capacity': capacity,
+            'allocated': allocated,
+            'blocks': len(self.blocks),
+            'high_water': self.top,
+            'fragments': len(self.free),
+            'utilisation': allocated / float(capacity) if capacity > 0 else 0.0}
@@ -0,0 +1,149 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from array import array
+
+
+class RateHistory:
+  """A fixed size ring buffer of the last stats intervals seen for one prefix
+
+  Each sample is the time the interval ended, its length in seconds and the
+  bytes and packets counted during it. The samples live in flat arrays so a
+  history costs the same handful of bytes per interval for every prefix.
+  """
+  def __init__(self, size=16):
+    self.size       = int(size)
+    self.timestamps = array('d', [0.0] * self.size)
+    self.durations  = array('d', [0.0] * self.size)
+    self.bytes      = array('d', [0.0] * self.size)
+    self.packets    = array('d', [0.0] * self.size)
+    #--- next slot to write and how many slots hold samples
+    self.next       = 0
+    self.count      = 0
+
+  def __len__(self):
+    return self.count
+
+  def add(self, timestamp, duration, bytes, packets=0):
+    """records an interval, overwriting the oldest once the buffer is full"""
+    self.timestamps[self.next] = timestamp
+    self.durations[self.next]  = duration
+    self.bytes[self.next]      = bytes
+    self.packets[self.next]    = packets
+    self.next = (self.next + 1) % self.size
+    if(self.count < self.size):
+      self.count += 1
+
+  def _slots(self):
+    """slot indexes from oldest to newest"""
+    start = (self.next - self.count) % self.size
+    return [(start + i) % self.size for i in xrange(self.count)]
+
+  def rates(self):
+    """bits per second of each interval, oldest first"""
+    res = []
+    for i in self._slots():
+      if(self.durations[i] > 0):
+        res.append(self.bytes[i] * 8 / self.durations[i])
+      else:
+        res.append(0.0)
+    return res
+
+  def packetRates(self):
+    """packets per second of each interval, oldest first"""
+    res = []
+    for i in self._slots():
+      if(self.durations[i] > 0):
+        res.append(self.packets[i] / self.durations[i])
+      else:
+        res.append(0.0)
+    return res
+
+  def latest(self):
+    """bits per second of the newest interval"""
+    if(self.count == 0):
+      return 0.0
+    return self.rates()[-1]
+
+  def ewma(self, alpha, values=None):
+    """exponentially weighted moving average of the rates, alpha weighs the newest"""
+    if(values is None):
+      values = self.rates()
+    if(not values):
+      return 0.0
+    avg = values[0]
+    for value in values[1:]:
+      avg = alpha * value + (1 - alpha) * avg
+    return avg
+
+  def percentile(self, pct, values=None):
+    """nearest rank percentile of the rates"""
+    if(values is None):
+      values = self.rates()
+    if(not values):
+      return 0.0
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+  def forecast(self, alpha, beta, gamma, season=0, values=None):
+    """additive Holt-Winters forecast of the next interval's rate
+
+    alpha, beta and gamma smooth the level, trend and seasonal terms and
+    season is the number of intervals in one cycle. Until two full seasons
+    are held (or with no season) only the level and trend are fitted.
+    """
+    if(values is None):
+      values = self.rates()
+    count = len(values)
+    if(count == 0):
+      return 0.0
+    if(count == 1):
+      return values[0]
+    if(season >= 2 and count >= 2 * season):
+      level = sum(values[:season]) / float(season)
+      trend = (sum(values[season:2 * season]) / float(season) - level) / season
+      seasonals = [value - level for value in values[:season]]
+      start = season
+    else:
+      season = 0
+      level = values[0]
+      trend = values[1] - values[0]
+      start = 1
+    for t in xrange(start, count):
+      lastLevel = level
+      if(season):
+        index = t % season
+        level = alpha * (values[t] - seasonals[index]) + (1 - alpha) * (level + trend)
+        trend = beta * (level - lastLevel) + (1 - beta) * trend
+        seasonals[index] = gamma * (values[t] - level) + (1 - gamma) * seasonals[index]
+      else:
+        level = alpha * values[t] + (1 - alpha) * (level + trend)
+        trend = beta * (level - lastLevel) + (1 - beta) * trend
+    res = level + trend
+    if(season):
+      res += seasonals[count % season]
+    return max(res, 0.0)
+
+  def getSamples(self):
+    """returns the samples oldest first as a list of dicts, for REST"""
+    samples = []
+    for i in self._slots():
+      samples.append({'timestamp': self.timestamps[i],
+                      'duration': self.durations[i],
+                      'bytes': self.bytes[i],
+                      'packets': self.packets[i]})
+    return samples
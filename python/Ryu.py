@@ -81,6 +81,37 @@ class SciPassRest(ControllerBase):
             return Response(body=json.dumps(result),status=500)
         return Response(content_type='application/json',body=json.dumps(result))
 
+    #PUT /scipass/flows/good_flows
+    #a list of good_flow objects, the flow-mods go out grouped per switch
+    @route('scipass', '/scipass/flows/good_flows', methods=['PUT'])
+    def good_flows(self, req):
+        try:
+            obj = eval(req.body)
+        except SyntaxError:
+            self.logger.error("Syntax Error processing good_flows signal %s", req.body)
+            return Response(status=400)
+        if(isinstance(obj, dict)):
+            obj = [obj]
+        result = self.api.good_flows(obj)
+        if result['success'] == 0:
+            return Response(body=json.dumps(result),status=500)
+        return Response(content_type='application/json',body=json.dumps(result))
+
+    #PUT /scipass/flows/bad_flows
+    @route('scipass', '/scipass/flows/bad_flows', methods=['PUT'])
+    def bad_flows(self, req):
+        try:
+            obj = eval(req.body)
+        except SyntaxError:
+            self.logger.error("Syntax Error processing bad_flows signal %s", req.body)
+            return Response(status=400)
+        if(isinstance(obj, dict)):
+            obj = [obj]
+        result = self.api.bad_flows(obj)
+        if result['success'] == 0:
+            return Response(body=json.dumps(result),status=500)
+        return Response(content_type='application/json',body=json.dumps(result))
+
     #GET /scipass/flows/get_good_flows
     @route('scipass', '/scipass/flows/get_good_flows', methods=['GET'])
     def get_good_flows(self, req):
@@ -93,19 +124,37 @@ class SciPassRest(ControllerBase):
         result = self.api.get_bad_flows()
         return Response(content_type='application/json',body=json.dumps(result))
 
+    #GET /scipass/flows/signal_counters
+    @route('scipass', '/scipass/flows/signal_counters', methods=['GET'])
+    def get_signal_counters(self, req):
+        result = self.api.getSignalCounters()
+        return Response(content_type='application/json',body=json.dumps(result))
+
+    #GET /scipass/flows/aggregates
+    @route('scipass', '/scipass/flows/aggregates', methods=['GET'])
+    def get_whitelist_aggregates(self, req):
+        result = self.api.getWhitelistAggregates()
+        return Response(content_type='application/json',body=json.dumps(result))
+
     @route('scipass', '/scipass/switch/{dpid}/flows', methods=['GET'], requirements= {'dpid': dpid_lib.DPID_PATTERN})
     def get_switch_flows(self, req, **kwargs):
         result = self.api.getSwitchFlows(dpid=kwargs['dpid'])
         return Response(content_type='application/json', body=json.dumps(result))
 
+    #PUT /scipass/sensor/load
+    #one {"sensor_id": .., "load": .., "timestamp": ..} or a list of them
     @route('scipass', '/scipass/sensor/load', methods=['PUT'])
     def update_sensor_load(self, req):
         try:
             obj = eval(req.body)
         except SyntaxError:
-            self.logger.error("Syntax Error processing update_sensor_status signal %s", req.body)
+            self.logger.error("Syntax Error processing update_sensor_load signal %s", req.body)
             return Response(status=400)
-        result = self.api.setSensorStatus(obj['sensor_id'],obj['load'])
+        if(isinstance(obj, dict)):
+            obj = [obj]
+        result = self.api.setSensorLoads(obj)
+        if result['success'] == 0:
+            return Response(body=json.dumps(result),status=500)
         return Response(content_type='application/json',body=json.dumps(result))
 
     @route('scipass', '/scipass/switch/{dpid}/domain/{domain}/sensor/{sensor_id}', methods=['GET'], requirements= {'dpid': dpid_lib.DPID_PATTERN})
@@ -148,6 +197,21 @@ class SciPassRest(ControllerBase):
         result = self.api.getDomainFlows(dpid = kwargs['dpid'], domain = kwargs['domain'])
         return Response(content_type='application/json', body=json.dumps(result))
 
+    #GET /scipass/switch/{dpid}/domain/{domain}/prefix_history?prefix=10.0.0.0/24
+    @route('scipass', '/scipass/switch/{dpid}/domain/{domain}/prefix_history',methods=['GET'],requirements = {'dpid': dpid_lib.DPID_PATTERN})
+    def get_prefix_history(self,req, **kwargs):
+        try:
+            result = self.api.getPrefixHistory(dpid = kwargs['dpid'], domain = kwargs['domain'], prefix = req.GET.get('prefix'))
+        except ValueError:
+            self.logger.error("Bad prefix in prefix_history request %s", req.GET.get('prefix'))
+            return Response(status=400)
+        return Response(content_type='application/json', body=json.dumps(result))
+
+    @route('scipass', '/scipass/switch/{dpid}/domain/{domain}/utilisation',methods=['GET'],requirements = {'dpid': dpid_lib.DPID_PATTERN})
+    def get_domain_utilisation(self,req, **kwargs):
+        result = self.api.getDomainUtilisation(dpid = kwargs['dpid'], domain = kwargs['domain'])
+        return Response(content_type='application/json', body=json.dumps(result))
+
 
 class Ryu(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_0.OFP_VERSION, ofproto_v1_3.OFP_VERSION]
@@ -833,6 +897,16 @@ class Ryu(app_manager.RyuApp):
         self.api.remove_flow(header=obj, priority=priority)
         
 
+    def _packetDelta(self, dpid, prefix, packets):
+        #--- packets counted for prefix since the last stats reply, 0 after a re-balance reset the counters
+        old_packets = 0
+        if(self.prefix_bytes[dpid][prefix].has_key("packets")):
+            old_packets = self.prefix_bytes[dpid][prefix]["packets"]
+        self.prefix_bytes[dpid][prefix]["packets"] = packets
+        if(packets < old_packets):
+            return 0
+        return packets - old_packets
+
     def process_flow_stats(self, stats, dp):
         ofp = dp.ofproto
         if(ofp.OFP_VERSION == ofproto_v1_3.OFP_VERSION):
@@ -1005,8 +1079,10 @@ class Ryu(app_manager.RyuApp):
                 prefix_bytes[prefix] = {}
                 prefix_bytes[prefix]["tx"] = 0
                 prefix_bytes[prefix]["rx"] = 0
-                if d:
-                    prefix_bytes[prefix][d] += stat.byte_count
+                prefix_bytes[prefix]["packets"] = 0
+            if d:
+                prefix_bytes[prefix][d] += stat.byte_count
+                prefix_bytes[prefix]["packets"] += stat.packet_count
 
         for prefix in prefix_bytes:
             for d in ("rx","tx"):
@@ -1036,11 +1112,13 @@ class Ryu(app_manager.RyuApp):
                 prefix_bps[prefix][d] = rate
                 self.prefix_bytes[dpid][prefix][d] = prefix_bytes[prefix][d]
 
+            prefix_bps[prefix]["packets"] = self._packetDelta(dpid, prefix, prefix_bytes[prefix]["packets"])
+
         #--- update the balancer
         for prefix in prefix_bps.keys():
           rx = prefix_bps[prefix]["rx"]
           tx = prefix_bps[prefix]["tx"]
-          self.api.updatePrefixBW("%016x" % dpid, prefix, tx, rx)
+          self.api.updatePrefixBW("%016x" % dpid, prefix, tx, rx, interval=stats_et, packets=prefix_bps[prefix]["packets"])
         
         self.api.TimeoutFlows("%016x" % dpid, flows)
 
@@ -1093,8 +1171,10 @@ class Ryu(app_manager.RyuApp):
                 prefix_bytes[prefix] = {}
                 prefix_bytes[prefix]["tx"] = 0
                 prefix_bytes[prefix]["rx"] = 0
+                prefix_bytes[prefix]["packets"] = 0
 
             prefix_bytes[prefix][dir] += stat.byte_count
+            prefix_bytes[prefix]["packets"] += stat.packet_count
 
             match = stat.match.__dict__
             wildcards = stat.match.wildcards
@@ -1183,13 +1263,15 @@ class Ryu(app_manager.RyuApp):
             
                 prefix_bps[prefix][dir] = rate
                 self.prefix_bytes[dpid][prefix][dir] = prefix_bytes[prefix][dir]
+
+            prefix_bps[prefix]["packets"] = self._packetDelta(dpid, prefix, prefix_bytes[prefix]["packets"])
         
 
         #--- update the balancer
         for prefix in prefix_bps.keys():
 	  rx = prefix_bps[prefix]["rx"]
           tx = prefix_bps[prefix]["tx"]
-          self.api.updatePrefixBW("%016x" % dpid, prefix, tx, rx)
+          self.api.updatePrefixBW("%016x" % dpid, prefix, tx, rx, interval=stats_et, packets=prefix_bps[prefix]["packets"])
 
         self.api.TimeoutFlows("%016x" % dpid, flows)
           
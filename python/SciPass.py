@@ -23,9 +23,18 @@ import libxml2
 import json
 import lxml
 import sys                                                                     
+from collections import OrderedDict
 from lxml import etree
 from SimpleBalancer import SimpleBalancer
 from SimpleBalancer import MaxFlowCountError
+from Prefix import Prefix
+from FlowRegistry import FlowRegistry
+from FlowRegistry import flowKey
+from FlowRegistry import matchKey
+from PrefixTrie import PrefixTrie
+
+#--- the fields of a good or bad flow message that decide which flows it installs
+SIGNAL_FIELDS = ["nw_src", "nw_dst", "tp_src", "tp_dst", "tcp_src", "tcp_dst", "udp_src", "udp_dst", "priority"]
 
 class SciPass:
   """SciPass API for signaling when a flow is known good or bad"""
@@ -55,12 +64,26 @@ class SciPass:
     else:
       self.schemaFile = "/etc/SciPass/SciPass.xsd"
 
-    self.whiteList    = []
-    self.blackList    = []
-    self.idleTimeouts = []
+    self.whiteList    = FlowRegistry()
+    self.blackList    = FlowRegistry()
+    #--- idle timeouts by flowKey, so a repeated signal can refresh them and a removed flow drop its own
+    self.idleTimeouts = OrderedDict()
     self.hardTimeouts = []
+    #--- signal key -> flowKeys of the flows it installed, oldest first
+    self.signalFlows  = OrderedDict()
+    self.signalCounters = {'good_flow': {'new': 0, 'coalesced': 0},
+                           'bad_flow': {'new': 0, 'coalesced': 0}}
+    #--- whitelist flows of a host pair by (dpid, domain, priority, nw_src, nw_dst), see _checkAggregates
+    self.aggregates   = {}
+    self.aggregateCounters = {'aggregated': 0, 'deaggregated': 0}
     self.switches     = []
     self.flowCount = 0
+    #--- seconds between saves of the prefix bandwidth by run_balancers
+    self.stateSaveInterval = 300
+    #--- (dpid, domain) -> time its state was last saved
+    self.stateSaved   = {}
+    #--- flow-mods held back while a batch of signals is processed, None otherwise
+    self.pendingFlowMods = None
     self.switchForwardingChangeHandlers = []
     self._validateConfig(self.configFile, self.schemaFile)
     self._processConfig(self.configFile)
@@ -81,160 +104,185 @@ class SciPass:
     #build our prefixes
     src_prefix = ipaddr.IPv4Network(obj['nw_src'])
     dst_prefix = ipaddr.IPv4Network(obj['nw_dst'])
+    results = {}
+
+    #a repeat of a signal whose flows are all still there only refreshes their timeouts
+    signal = self._signalKey("good_flow", obj, src_prefix, dst_prefix)
+    if(self._coalesceSignal(signal)):
+      results['success'] = 1
+      results['coalesced'] = 1
+      return results
+    installed = []
     
     #find the switch, domain, lan, wan ports
-    for dpid in self.config:
-      for name in self.config[dpid]:
-        
-        used_wan_ports = []
-        wan_action = []
-        lan_action = []
-        flows = []
-        results = {}
-        #set these now they are cheap and it makes the rest of it cleaner
-        idle_timeout = 0
-        priority = 0
-        if(not obj.has_key('idle_timeout')):
-          idle_timeout  = self.config[dpid][name]['idle_timeout']
+    #only the domains with a lan prefix holding either address install anything
+    for dpid, name, lan_matches in self._lanMatches(src_prefix, dst_prefix):
+      group = None
+      if(self.config[dpid][name]['whitelist_aggregate_threshold'] > 0):
+        group = self._aggregateKey(dpid, name, obj, src_prefix, dst_prefix, lan_matches)
+        if(self._joinAggregate(group, signal, obj)):
+          #the wildcard rule of the host pair already passes this flow
+          continue
+
+      domain_flows = self._whitelistDomain(dpid, name, lan_matches, obj, src_prefix, dst_prefix)
+      if(domain_flows is None):
+        results['success'] = 0
+        return results
+      keys = domain_flows[1]
+      installed.extend(keys)
+      if(group is not None):
+        self._addAggregateMember(group, signal, obj, keys)
+    self._recordSignal(signal, installed)
+    results['success'] = 1
+    return results
+
+  def _whitelistDomain(self, dpid, name, lan_matches, obj, src_prefix, dst_prefix):
+    """installs the whitelist flows of a good flow message on one domain
+
+    returns the flows and their whitelist keys, or None when the switch
+    could not take them
+    """
+    used_wan_ports = []
+    wan_action = []
+    lan_action = []
+    flows = []
+    keys = []
+    #set these now they are cheap and it makes the rest of it cleaner
+    idle_timeout = 0
+    priority = 0
+    if(not obj.has_key('idle_timeout')):
+      idle_timeout  = self.config[dpid][name]['idle_timeout']
+    else:
+      idle_timeout = obj['idle_timeout']
+      
+    if(not obj.has_key('priority')):
+      priority = self.config[dpid][name]['default_whitelist_priority']
+    else:
+      priority = obj['priority']
+
+    #step one figure out the actions :)
+    #lets just calculate the wan ports involved here
+    if len(self.config[dpid][name]['ports']['wan']) > 1:
+      for entry in self._portsContaining(src_prefix, 'wan', dpid, name):
+        port = entry[4]
+        used_wan_ports.append(port['port_id'])
+        wan_action.append({"type": "output",
+                           "port": port['port_id']})
+        if entry[5]['prefix'].Contains( dst_prefix ):
+          used_wan_ports.append(port['port_id'])
+          wan_action.append({"type": "output",
+                             "port": port['port_id']})
+    #if you only have 1 wan we don't require prefixes
+    elif len(self.config[dpid][name]['ports']['wan']) == 1:
+      used_wan_ports.append(self.config[dpid][name]['ports']['wan'][0]['port_id'])
+      wan_action.append({"type": "output",
+                         "port": self.config[dpid][name]['ports']['wan'][0]['port_id']})
+
+    #lets just calculate the lan ports involved here
+    for port, prefix, src_match, dst_match in lan_matches:
+      if src_match:
+        lan_action.append({"type": "output",
+                           "port": port['port_id']})
+      if dst_match:
+        lan_action.append({"type": "output",
+                           "port": port['port_id']})
+
+
+
+    #first lets process the LAN ports
+    for port, prefix, src_match, dst_match in lan_matches:
+      #ok we'll see if the src matches
+      if(src_match):
+        header = self._build_header(obj,False)    
+        header['phys_port'] = int(port['port_id'])
+        match = self.stringify(header)
+        status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                                         domain       = name,
+                                                         header       = header,
+                                                         actions      = wan_action,
+                                                         command      = "ADD",
+                                                         idle_timeout = idle_timeout,
+                                                         hard_timeout = 0,
+                                                         priority     = priority )
+        if status != 1:
+          self.logger.error("Max flow limit reached.Could not add flow")
+          return None
         else:
-          idle_timeout = obj['idle_timeout']
+          flow = { 'dpid' : dpid, 'domain' : name, 'header' : match,
+                  'actions' : wan_action,'priority' : priority }
+          flows.append(flow)
+          keys.append(self.whiteList.add(dpid, name, header, priority, flow))
+
+        #now do the wan side (there might be multiple)
+        for wan in used_wan_ports:
+          header = self._build_header(obj,True)
+          header['phys_port'] = int(wan)
+          match = self.stringify(header)
+          status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                                           domain       = name,
+                                                           header       = header,
+                                                           actions      = lan_action,
+                                                           command      = "ADD",
+                                                           idle_timeout = idle_timeout,
+                                                           hard_timeout = 0,
+                                                           priority     = priority )
+          if status != 1:
+            self.logger.error("Max flow limit reached.Could not add flow")
+            #Delete the prev installed flows for this good flow.
+            self.delete_flows(flows)
+            return None
+          else:
+            flow = { 'dpid' : dpid, 'domain' : name,'header': match,
+                     'actions' : lan_action,'priority' : priority }
+            flows.append(flow)
+            keys.append(self.whiteList.add(dpid, name, header, priority, flow))
           
-        if(not obj.has_key('priority')):
-          priority = self.config[dpid][name]['default_whitelist_priority']
+      #check the other dir          
+      if(dst_match):
+        header = self._build_header(obj,True)
+        header['phys_port'] = int(port['port_id'])
+        match = self.stringify(header)
+        status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                                         domain       = name,
+                                                         header       = header,
+                                                         actions      = wan_action,
+                                                         command      = "ADD",
+                                                         idle_timeout = idle_timeout,
+                                                         hard_timeout = 0,
+                                                         priority     = priority)
+        if status != 1:
+          self.logger.error("Max flow limit reached.Could not add flow")
+          self.delete_flows(flows)
+          return None
         else:
-          priority = obj['priority']
-
-        #step one figure out the actions :)
-        #lets just calculate the wan ports involved here
-        if len(self.config[dpid][name]['ports']['wan']) > 1:
-          for port in self.config[dpid][name]['ports']['wan']:
-            for prefix in port['prefixes']:
-              if prefix['prefix'].Contains( src_prefix ):
-                used_wan_ports.append(port['port_id'])
-                wan_action.append({"type": "output",
-                                   "port": port['port_id']})
-                if prefix['prefix'].Contains( dst_prefix ):
-                  used_wan_ports.append(port['port_id'])
-                  wan_action.append({"type": "output",
-                                     "port": port['port_id']})
-        #if you only have 1 wan we don't require prefixes
-        elif len(self.config[dpid][name]['ports']['wan']) == 1:
-          used_wan_ports.append(self.config[dpid][name]['ports']['wan'][0]['port_id'])
-          wan_action.append({"type": "output",
-                             "port": self.config[dpid][name]['ports']['wan'][0]['port_id']})
-
-        #lets just calculate the wan ports involved here
-        for port in self.config[dpid][name]['ports']['lan']:
-          for prefix in port['prefixes']:
-            if prefix['prefix'].Contains( src_prefix ):
-              lan_action.append({"type": "output",
-                                 "port": port['port_id']})
-            if prefix['prefix'].Contains( dst_prefix ):
-              lan_action.append({"type": "output",
-                                 "port": port['port_id']})
-
-
-
-        #first lets process the LAN ports
-        for port in self.config[dpid][name]['ports']['lan']:
-          for prefix in port['prefixes']:
-            #ok we'll see if the src matches
-            if(prefix['prefix'].Contains( src_prefix )):
-              header = self._build_header(obj,False)    
-              header['phys_port'] = int(port['port_id'])
-              match = self.stringify(header)
-              status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                               domain       = name,
-                                                               header       = header,
-                                                               actions      = wan_action,
-                                                               command      = "ADD",
-                                                               idle_timeout = idle_timeout,
-                                                               hard_timeout = 0,
-                                                               priority     = priority )
-              if status != 1:
-                self.logger.error("Max flow limit reached.Could not add flow")
-                results['success'] = 0
-                return results
-              else:
-                flow = { 'dpid' : dpid, 'domain' : name, 'header' : match,
-                        'actions' : wan_action,'priority' : priority }
-                flows.append(flow)
-                self.whiteList.append(flow)
-
-              #now do the wan side (there might be multiple)
-              for wan in used_wan_ports:
-                header = self._build_header(obj,True)
-                header['phys_port'] = int(wan)
-                match = self.stringify(header)
-                status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                                 domain       = name,
-                                                                 header       = header,
-                                                                 actions      = lan_action,
-                                                                 command      = "ADD",
-                                                                 idle_timeout = idle_timeout,
-                                                                 hard_timeout = 0,
-                                                                 priority     = priority )
-                if status != 1:
-                  self.logger.error("Max flow limit reached.Could not add flow")
-                  #Delete the prev installed flows for this good flow.
-                  self.delete_flows(flows)
-                  results['success'] = 0
-                  return results
-                else:
-                  flow = { 'dpid' : dpid, 'domain' : name,'header': match,
-                           'actions' : lan_action,'priority' : priority }
-                  flows.append(flow)
-                  self.whiteList.append(flow)
-                
-            #check the other dir          
-            if(prefix['prefix'].Contains( dst_prefix )):
-              header = self._build_header(obj,True)
-              header['phys_port'] = int(port['port_id'])
-              match = self.stringify(header)
-              status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                               domain       = name,
-                                                               header       = header,
-                                                               actions      = wan_action,
-                                                               command      = "ADD",
-                                                               idle_timeout = idle_timeout,
-                                                               hard_timeout = 0,
-                                                               priority     = priority)
-              if status != 1:
-                self.logger.error("Max flow limit reached.Could not add flow")
-                self.delete_flows(flows)
-                results['success'] = 0
-                return results
-              else:
-                flow = { 'dpid' : dpid, 'domain' : name,'header' : match,
-                         'actions' : wan_action,'priority' : priority }
-                flows.append(flow)
-                self.whiteList.append(flow)
-
-              #now do the wan side (there might be multiple)
-              for wan in used_wan_ports:
-                header = self._build_header(obj,False)
-                header['phys_port'] = int(wan)
-                match = self.stringify(header)
-                status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                                 domain       = name,
-                                                                 header       = header,
-                                                                 actions      = lan_action,
-                                                                 command      = "ADD",
-                                                                 idle_timeout = idle_timeout,
-                                                                 hard_timeout = 0,
-                                                                 priority     = priority )
-                if status != 1:
-                  self.logger.error("Max flow limit reached.Could not add  flow")
-                  self.delete_flows(flows)
-                  results['success'] = 0
-                  return results
-                else:
-                  flow = { 'dpid' : dpid, 'domain' : name,'header' : match,
-                           'actions' : lan_action,'priority' : priority }
-                  flows.append(flow)
-                  self.whiteList.append(flow)
-    results['success'] = 1
-    return results
+          flow = { 'dpid' : dpid, 'domain' : name,'header' : match,
+                   'actions' : wan_action,'priority' : priority }
+          flows.append(flow)
+          keys.append(self.whiteList.add(dpid, name, header, priority, flow))
+
+        #now do the wan side (there might be multiple)
+        for wan in used_wan_ports:
+          header = self._build_header(obj,False)
+          header['phys_port'] = int(wan)
+          match = self.stringify(header)
+          status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                                           domain       = name,
+                                                           header       = header,
+                                                           actions      = lan_action,
+                                                           command      = "ADD",
+                                                           idle_timeout = idle_timeout,
+                                                           hard_timeout = 0,
+                                                           priority     = priority )
+          if status != 1:
+            self.logger.error("Max flow limit reached.Could not add  flow")
+            self.delete_flows(flows)
+            return None
+          else:
+            flow = { 'dpid' : dpid, 'domain' : name,'header' : match,
+                     'actions' : lan_action,'priority' : priority }
+            flows.append(flow)
+            keys.append(self.whiteList.add(dpid, name, header, priority, flow))
+    return flows, keys
 
   def _build_header(self, obj, reverse):
     header = {}
@@ -304,139 +352,447 @@ class SciPass:
     dst_prefix = ipaddr.IPv4Network(obj['nw_dst'])
     flows = []
     results = {}
+    signal = self._signalKey("bad_flow", obj, src_prefix, dst_prefix)
+    if(self._coalesceSignal(signal)):
+      results['success'] = 1
+      results['coalesced'] = 1
+      return results
+    installed = []
     #find all the lan ports
-    for datapath_id in self.config:
-      for name in self.config[datapath_id]:
-        #just so we don't have to do this constantly!
-        idle_timeout = 0
-        if(not obj.has_key('idle_timeout')):
-          idle_timeout  = self.config[datapath_id][name]['idle_timeout']
-        else:
-          idle_timeout = obj['idle_timeout']
-        priority = 65535
-        if(not obj.has_key('priority')):
-          priority = self.config[datapath_id][name]['default_blacklist_priority']
-        else:
-          priority = obj['priority']
+    for datapath_id, name, lan_matches in self._lanMatches(src_prefix, dst_prefix):
+      #just so we don't have to do this constantly!
+      idle_timeout = 0
+      if(not obj.has_key('idle_timeout')):
+        idle_timeout  = self.config[datapath_id][name]['idle_timeout']
+      else:
+        idle_timeout = obj['idle_timeout']
+      priority = 65535
+      if(not obj.has_key('priority')):
+        priority = self.config[datapath_id][name]['default_blacklist_priority']
+      else:
+        priority = obj['priority']
 
-        for port in self.config[datapath_id][name]['ports']['lan']:
-          for prefix in port['prefixes']:
+      for port, prefix, src_match, dst_match in lan_matches:
+        if(src_match):
+          #actions drop
+          actions = []
+
+          #build a header based on what was sent
+          header = self._build_header(obj,False) 
+          
+          if not self.config[datapath_id][name]['mode'] == "SimpleBalancer":
+            #set the port of the header
+            header['phys_port'] = int(port['port_id'])
+          match = self.stringify(header)
+          self.logger.debug("Header: " + str(header))
+
+          status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
+                                                           domain       = name,
+                                                           header       = header,
+                                                           actions      = actions,
+                                                           command      = "ADD",
+                                                           idle_timeout = idle_timeout,
+                                                           priority     = priority)
+          if status != 1:
+              self.logger.error("Max flow limit reached.Could not add flow")
+              results['success'] = 0
+              return results
+          else:
+            flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
+                    'actions' : actions,'priority' : priority }
+            flows.append(flow)
+            installed.append(self.blackList.add(datapath_id, name, header, priority, flow))
+
+          for wan in self.config[datapath_id][name]['ports']['wan']:
+            #build a header based on what was set
+            header = self._build_header(obj,True)
             
-            if(prefix['prefix'].Contains( src_prefix )):
-              #actions drop
-              actions = []
-
-              #build a header based on what was sent
-              header = self._build_header(obj,False) 
-              
-              if not self.config[datapath_id][name]['mode'] == "SimpleBalancer":
-                #set the port of the header
-                header['phys_port'] = int(port['port_id'])
-              match = self.stringify(header)
-              self.logger.debug("Header: " + str(header))
-
-              status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
-                                                               domain       = name,
-                                                               header       = header,
-                                                               actions      = actions,
-                                                               command      = "ADD",
-                                                               idle_timeout = idle_timeout,
-                                                               priority     = priority)
-              if status != 1:
-                  self.logger.error("Max flow limit reached.Could not add flow")
-                  results['success'] = 0
-                  return results
-              else:
-                flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
-                        'actions' : actions,'priority' : priority }
-                flows.append(flow)
-                self.blackList.append(flow)
-
-              for wan in self.config[datapath_id][name]['ports']['wan']:
-                #build a header based on what was set
-                header = self._build_header(obj,True)
-                
-                #set the port
-                header['phys_port'] = int(wan['port_id'])
-                match = self.stringify(header)
-                self.logger.debug("Header: " + str(header))
-
-                status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
-                                                                 domain       = name,
-                                                                 header       = header,
-                                                                 actions      = actions,
-                                                                 command      = "ADD",
-                                                                 idle_timeout = idle_timeout,
-                                                                 priority     = priority)
-                
-                if status != 1:
-                  self.logger.error("Max flow limit reached.Could not add  flow")
-                  self.delete_flows(flows)
-                  results['success'] = 0
-                  return results
-                else:
-                  flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
-                          'actions' : actions,'priority' : priority }
-                  flows.append(flow)
-                  self.blackList.append(flow)
-
-            if(prefix['prefix'].Contains( dst_prefix )):
-              #actions drop
-              actions = []
-              #build a header based on what was setn
-              header = self._build_header(obj,True)
-              
-              if not self.config[datapath_id][name]['mode'] == "SimpleBalancer":
-                #set the port
-                header['phys_port'] = int(port['port_id'])
-                match = self.stringify(header)
-              self.logger.debug("Header: " + str(header))
-
-              status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
-                                                               domain       = name,
-                                                               header       = header,
-                                                               actions      = actions,
-                                                               command      = "ADD",
-                                                               idle_timeout = idle_timeout,
-                                                               priority     = priority)
-              if status != 1:
-                self.logger.error("Max flow limit reached.Could not add  flow")
-                self.delete_flows(flows)
-                results['success'] = 0
-                return results
-              else:
-                flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
-                        'actions' : actions,'priority' : priority }
-                flows.append(flow)
-                self.blackList.append(flow)
-
-              for wan in self.config[datapath_id][name]['ports']['wan']:
-                #build a header based on what was set
-                header = self._build_header(obj,False)
-                #set the port
-                header['phys_port'] = int(wan['port_id'])
-                match = self.stringify(header)
-                self.logger.debug("Header: " + str(header))
-                status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
-                                                                 domain       = name,
-                                                                 header       = header,
-                                                                 actions      = actions,
-                                                                 command      = "ADD",
-                                                                 idle_timeout = idle_timeout,
-                                                                 priority     = priority)
-                if status != 1:
-                  self.logger.error("Max flow limit reached.Could not add flow")
-                  self.delete_flows(flows)
-                  results['success'] = 0
-                  return results
-                else:
-                  flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
-                          'actions' : actions,'priority' : priority }
-                  flows.append(flow)
-                  self.blackList.append(flow)
+            #set the port
+            header['phys_port'] = int(wan['port_id'])
+            match = self.stringify(header)
+            self.logger.debug("Header: " + str(header))
+
+            status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
+                                                             domain       = name,
+                                                             header       = header,
+                                                             actions      = actions,
+                                                             command      = "ADD",
+                                                             idle_timeout = idle_timeout,
+                                                             priority     = priority)
+            
+            if status != 1:
+              self.logger.error("Max flow limit reached.Could not add  flow")
+              self.delete_flows(flows)
+              results['success'] = 0
+              return results
+            else:
+              flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
+                      'actions' : actions,'priority' : priority }
+              flows.append(flow)
+              installed.append(self.blackList.add(datapath_id, name, header, priority, flow))
+
+        if(dst_match):
+          #actions drop
+          actions = []
+          #build a header based on what was setn
+          header = self._build_header(obj,True)
+          
+          if not self.config[datapath_id][name]['mode'] == "SimpleBalancer":
+            #set the port
+            header['phys_port'] = int(port['port_id'])
+          match = self.stringify(header)
+          self.logger.debug("Header: " + str(header))
+
+          status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
+                                                           domain       = name,
+                                                           header       = header,
+                                                           actions      = actions,
+                                                           command      = "ADD",
+                                                           idle_timeout = idle_timeout,
+                                                           priority     = priority)
+          if status != 1:
+            self.logger.error("Max flow limit reached.Could not add  flow")
+            self.delete_flows(flows)
+            results['success'] = 0
+            return results
+          else:
+            flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
+                    'actions' : actions,'priority' : priority }
+            flows.append(flow)
+            installed.append(self.blackList.add(datapath_id, name, header, priority, flow))
+
+          for wan in self.config[datapath_id][name]['ports']['wan']:
+            #build a header based on what was set
+            header = self._build_header(obj,False)
+            #set the port
+            header['phys_port'] = int(wan['port_id'])
+            match = self.stringify(header)
+            self.logger.debug("Header: " + str(header))
+            status = self.fireForwardingStateChangeHandlers( dpid         = datapath_id,
+                                                             domain       = name,
+                                                             header       = header,
+                                                             actions      = actions,
+                                                             command      = "ADD",
+                                                             idle_timeout = idle_timeout,
+                                                             priority     = priority)
+            if status != 1:
+              self.logger.error("Max flow limit reached.Could not add flow")
+              self.delete_flows(flows)
+              results['success'] = 0
+              return results
+            else:
+              flow = { 'dpid' : datapath_id, 'domain' : name,'header' : match,
+                      'actions' : actions,'priority' : priority }
+              flows.append(flow)
+              installed.append(self.blackList.add(datapath_id, name, header, priority, flow))
+    self._recordSignal(signal, installed)
     results['success'] = 1
     return results
 
+  def _signalKey(self, kind, obj, src_prefix, dst_prefix):
+    """returns a hashable key for what a good or bad flow message asks for"""
+    fields = {}
+    for field in SIGNAL_FIELDS:
+      if(obj.has_key(field)):
+        fields[field] = obj[field]
+    #--- the addresses are already parsed
+    fields['nw_src'] = src_prefix
+    fields['nw_dst'] = dst_prefix
+    return (kind, matchKey(fields))
+
+  def _coalesceSignal(self, signal):
+    """refreshes the idle timeouts of a signal seen before, returns 1 if its flows are all still installed"""
+    flows = self.signalFlows.get(signal)
+    if(flows is None):
+      return 0
+    if(not self._signalInstalled(signal[0], flows)):
+      #--- part of it timed out or was removed, so it is installed again
+      del self.signalFlows[signal]
+      return 0
+    self._refreshIdleTimeouts(flows, time.time())
+    self.signalCounters[signal[0]]['coalesced'] += 1
+    self.logger.debug("coalesced %s signal into %d installed flows", signal[0], len(flows))
+    return 1
+
+  def _refreshIdleTimeouts(self, flows, now):
+    for key in flows:
+      idle = self.idleTimeouts.get(key)
+      if(idle is not None):
+        idle['timeout'] = now + idle['idle_timeout']
+
+  def _signalInstalled(self, kind, flows):
+    if(kind == "good_flow"):
+      registry = self.whiteList
+    else:
+      registry = self.blackList
+    for key in flows:
+      if(not registry.hasKey(key)):
+        return 0
+    return 1
+
+  def _recordSignal(self, signal, flows):
+    """remembers the flows a new signal installed"""
+    self.signalCounters[signal[0]]['new'] += 1
+    if(len(flows) == 0):
+      return
+    self.signalFlows[signal] = flows
+    #--- look at the two oldest signals each time so ones whose flows are gone do not pile up
+    for i in range(2):
+      oldest = next(iter(self.signalFlows))
+      if(oldest == signal):
+        break
+      flows = self.signalFlows.pop(oldest)
+      if(self._signalInstalled(oldest[0], flows)):
+        self.signalFlows[oldest] = flows
+
+  def getSignalCounters(self):
+    """returns the new and coalesced signal counts of good and bad flows"""
+    counters = copy.deepcopy(self.signalCounters)
+    counters['tracked'] = len(self.signalFlows)
+    return counters
+
+  def _aggregateKey(self, dpid, name, obj, src_prefix, dst_prefix, lan_matches):
+    """returns the key of the whitelist aggregate a good flow belongs to
+
+    flows between the same two hosts at the same priority share an
+    aggregate. with a whitelist_aggregate_prefix_len below 32 the side
+    outside the LAN is widened to that subnet, so the flows of one host
+    with a remote subnet share one too.
+    """
+    if(not obj.has_key('priority')):
+      priority = self.config[dpid][name]['default_whitelist_priority']
+    else:
+      priority = obj['priority']
+    prefix_len = self.config[dpid][name]['whitelist_aggregate_prefix_len']
+    src_lan = 0
+    for port, prefix, src_match, dst_match in lan_matches:
+      if(src_match):
+        src_lan = 1
+    if(src_lan):
+      dst_prefix = self._widenPrefix(dst_prefix, prefix_len)
+    else:
+      src_prefix = self._widenPrefix(src_prefix, prefix_len)
+    return (dpid, name, int(priority), str(src_prefix), str(dst_prefix))
+
+  def _widenPrefix(self, prefix, prefix_len):
+    if(prefix.prefixlen > prefix_len):
+      return prefix.supernet(new_prefix=prefix_len).masked()
+    return prefix
+
+  def _joinAggregate(self, group, signal, obj):
+    """adds a good flow to an aggregated host pair, returns 0 if the pair is not aggregated"""
+    aggregate = self.aggregates.get(group)
+    if(aggregate is None or aggregate['flows'] is None):
+      return 0
+    now = time.time()
+    member = aggregate['members'].get(signal)
+    if(member is None):
+      #--- what it would have taken without the wildcard rule
+      aggregate['members'][signal] = {'obj': obj, 'keys': [], 'cost': len(aggregate['flows']), 'seen': now}
+    else:
+      member['seen'] = now
+    self._refreshIdleTimeouts(aggregate['flows'], now)
+    return 1
+
+  def _addAggregateMember(self, group, signal, obj, keys):
+    """counts the flows a good flow installed towards its host pair"""
+    aggregate = self.aggregates.get(group)
+    if(aggregate is None):
+      dpid, name, priority, src, dst = group
+      if(not obj.has_key('idle_timeout')):
+        idle_timeout = self.config[dpid][name]['idle_timeout']
+      else:
+        idle_timeout = obj['idle_timeout']
+      aggregate = {'members': OrderedDict(),
+                   'obj': {'nw_src': src, 'nw_dst': dst, 'priority': priority,
+                           'idle_timeout': idle_timeout},
+                   'flows': None,
+                   'wildcard': []}
+      self.aggregates[group] = aggregate
+    aggregate['members'][signal] = {'obj': obj, 'keys': keys, 'cost': len(keys), 'seen': time.time()}
+
+  def _checkAggregates(self, dpid):
+    """replaces the flows of host pairs over their threshold with a wildcard rule and splits pairs that fell back
+
+    before a pair is aggregated a flow counts while its whitelist entries
+    are installed. under the wildcard rule the switch no longer sees the
+    flows apart, so one counts for an idle timeout after it was last
+    signaled. a pair is split again once half the threshold or fewer of its
+    flows are left, which keeps it from flapping around the threshold.
+    """
+    now = time.time()
+    for group in self.aggregates.keys():
+      if(group[0] != dpid):
+        continue
+      aggregate = self.aggregates[group]
+      threshold = self.config[dpid][group[1]]['whitelist_aggregate_threshold']
+      members = aggregate['members']
+      if(aggregate['flows'] is None):
+        for signal in members.keys():
+          if(not self._signalInstalled("good_flow", members[signal]['keys'])):
+            del members[signal]
+        if(len(members) > threshold):
+          self._aggregate(group, aggregate, now)
+      elif(not self._signalInstalled("good_flow", aggregate['flows'])):
+        #--- the wildcard rule idled out, so none of the flows are sending
+        self.logger.info("Wildcard rule of %s - %s timed out", group[3], group[4])
+        self._removeWhitelistFlows(aggregate['flows'])
+        members.clear()
+      else:
+        idle_timeout = int(aggregate['obj']['idle_timeout'])
+        if(idle_timeout > 0):
+          for signal in members.keys():
+            if(members[signal]['seen'] + idle_timeout <= now):
+              del members[signal]
+        if(len(members) <= threshold / 2):
+          self._deaggregate(group, aggregate)
+      if(len(members) == 0):
+        del self.aggregates[group]
+
+  def _aggregate(self, group, aggregate, now):
+    dpid, name, priority, src, dst = group
+    src_prefix = ipaddr.IPv4Network(src)
+    dst_prefix = ipaddr.IPv4Network(dst)
+    lan_matches = self._domainLanMatches(dpid, name, src_prefix, dst_prefix)
+    #--- the wildcard goes in before the flows it replaces come out so no packet misses both
+    domain_flows = self._whitelistDomain(dpid, name, lan_matches, aggregate['obj'], src_prefix, dst_prefix)
+    if(domain_flows is None or len(domain_flows[1]) == 0):
+      self.logger.error("Unable to aggregate the whitelist flows of %s - %s", src, dst)
+      return
+    aggregate['wildcard'], aggregate['flows'] = domain_flows
+    for member in aggregate['members'].values():
+      self._removeWhitelistFlows(member['keys'])
+      member['keys'] = []
+      member['seen'] = now
+    self.aggregateCounters['aggregated'] += 1
+    self.logger.info("Aggregated %d whitelisted flows of %s - %s", len(aggregate['members']), src, dst)
+
+  def _deaggregate(self, group, aggregate):
+    dpid, name, priority, src, dst = group
+    members = aggregate['members']
+    for signal in members.keys():
+      obj = members[signal]['obj']
+      src_prefix = ipaddr.IPv4Network(obj['nw_src'])
+      dst_prefix = ipaddr.IPv4Network(obj['nw_dst'])
+      lan_matches = self._domainLanMatches(dpid, name, src_prefix, dst_prefix)
+      domain_flows = self._whitelistDomain(dpid, name, lan_matches, obj, src_prefix, dst_prefix)
+      if(domain_flows is None):
+        #--- its traffic goes back through the IDS until it is signaled again
+        del members[signal]
+        continue
+      members[signal]['keys'] = domain_flows[1]
+      members[signal]['cost'] = len(domain_flows[1])
+    self._removeWhitelistFlows(aggregate['flows'])
+    aggregate['flows'] = None
+    aggregate['wildcard'] = []
+    self.aggregateCounters['deaggregated'] += 1
+    self.logger.info("Split the wildcard rule of %s - %s back into %d flows", src, dst, len(members))
+
+  def _domainLanMatches(self, dpid, name, src_prefix, dst_prefix):
+    for match_dpid, match_name, lan_matches in self._lanMatches(src_prefix, dst_prefix):
+      if(match_dpid == dpid and match_name == name):
+        return lan_matches
+    return []
+
+  def _removeWhitelistFlows(self, keys):
+    """deletes whitelist flows from the switch along with their idle timeouts"""
+    flows = []
+    for key in keys:
+      flow = self.whiteList.removeKey(key)
+      if(flow is not None):
+        flows.append(flow)
+      self.idleTimeouts.pop(key, None)
+    self.delete_flows(flows)
+
+  def getWhitelistAggregates(self):
+    """returns the aggregated host pairs and the flow table entries their wildcard rules save"""
+    groups = []
+    entries = 0
+    saved = 0
+    for group, aggregate in self.aggregates.items():
+      if(aggregate['flows'] is None):
+        continue
+      cost = 0
+      for member in aggregate['members'].values():
+        cost += member['cost']
+      group_saved = max(cost - len(aggregate['flows']), 0)
+      groups.append({'dpid': group[0], 'domain': group[1], 'priority': group[2],
+                     'nw_src': group[3], 'nw_dst': group[4],
+                     'flows': len(aggregate['members']),
+                     'entries': len(aggregate['flows']),
+                     'tcam_saved': group_saved})
+      entries += len(aggregate['flows'])
+      saved += group_saved
+    return {'aggregates': len(groups),
+            'entries': entries,
+            'tcam_saved': saved,
+            'aggregated': self.aggregateCounters['aggregated'],
+            'deaggregated': self.aggregateCounters['deaggregated'],
+            'groups': groups}
+
+  def good_flows(self, objs):
+    """processes a batch of good flow messages, see _flowBatch"""
+    return self._flowBatch(self.good_flow, objs)
+
+  def bad_flows(self, objs):
+    """processes a batch of bad flow messages, see _flowBatch"""
+    return self._flowBatch(self.bad_flow, objs)
+
+  def _flowBatch(self, handler, objs):
+    """runs handler over every flow message of a batch and sends the flow-mods grouped per switch
+
+    the flow-mods and the whitelist and blacklist entries a message made are
+    dropped again when it fails or raises, so every message is installed
+    completely or not at all whatever happens to the rest of the batch.
+    """
+    results = []
+    failed = []
+    self.pendingFlowMods = []
+    try:
+      for index, obj in enumerate(objs):
+        mark = (len(self.pendingFlowMods), len(self.whiteList), len(self.blackList))
+        try:
+          ipaddr.IPv4Network(obj['nw_src'])
+          ipaddr.IPv4Network(obj['nw_dst'])
+          self._build_header(obj, False)
+        except (KeyError, ValueError, TypeError, AttributeError):
+          self.logger.error("Bad flow message %s", str(obj))
+          result = {'success': 0, 'msg': "Invalid flow: " + str(obj)}
+        else:
+          try:
+            result = handler(obj)
+          except Exception as e:
+            self.logger.error("Unable to process flow message %s: %s", str(obj), str(e))
+            result = {'success': 0, 'msg': "Unable to process flow: " + str(obj)}
+        if(result['success'] == 0):
+          failed.append(index)
+          self._dropFlowMods(*mark)
+        results.append(result)
+    finally:
+      pending = self.pendingFlowMods
+      self.pendingFlowMods = None
+      self._firePendingFlowMods(pending)
+    self.logger.debug("processed %d flow messages, %d failed", len(results), len(failed))
+    if(len(failed) > 0):
+      return {'success': 0, 'results': results, 'failed': failed,
+              'msg': "Unable to process flows: " + ", ".join([str(index) for index in failed])}
+    return {'success': 1, 'results': results, 'failed': failed}
+
+  def _dropFlowMods(self, pending, whitelisted, blacklisted):
+    """drops the held back flow-mods and registry entries made since the lengths given"""
+    del self.pendingFlowMods[pending:]
+    self.whiteList.removeNewest(max(len(self.whiteList) - whitelisted, 0))
+    self.blackList.removeNewest(max(len(self.blackList) - blacklisted, 0))
+
+  def _firePendingFlowMods(self, pending):
+    """sends held back flow-mods one switch at a time, keeping their order per switch"""
+    byDpid = OrderedDict()
+    for mod in pending:
+      byDpid.setdefault(mod['dpid'], []).append(mod)
+    for dpid in byDpid:
+      for mod in byDpid[dpid]:
+        self.fireForwardingStateChangeHandlers(**mod)
+
   def delete_flows(self, flows):
     if flows: 
       for flow in flows:
@@ -450,12 +806,12 @@ class SciPass:
 
   def get_bad_flows(self):
     if self.blackList:
-      return self.blackList
+      return self.blackList.values()
     return None
 
   def get_good_flows(self):
     if self.whiteList:
-      return self.whiteList
+      return self.whiteList.values()
     return None
 
   # gets the config info for a sensor along with its dpid and domain
@@ -537,6 +893,28 @@ class SciPass:
         ignore_sensor_load = domain.prop("ignore_sensor_load")
         ignore_prefix_bw = domain.prop("ignore_prefix_bw")
         max_flow_count = domain.prop("max_flow_count")
+        balance_mode = domain.prop("balance_mode")
+        flow_mod_budget = domain.prop("flow_mod_budget")
+        merge_mode = domain.prop("merge_mode")
+        split_mode = domain.prop("split_mode")
+        measure_splits = domain.prop("measure_splits")
+        rate_history_size = domain.prop("rate_history_size")
+        rate_estimator = domain.prop("rate_estimator")
+        rate_alpha = domain.prop("rate_alpha")
+        rate_percentile = domain.prop("rate_percentile")
+        rate_beta = domain.prop("rate_beta")
+        rate_gamma = domain.prop("rate_gamma")
+        rate_season = domain.prop("rate_season")
+        vectorize_state = domain.prop("vectorize_state")
+        sensor_load_timeout = domain.prop("sensor_load_timeout")
+        bps_weight = domain.prop("bps_weight")
+        pps_weight = domain.prop("pps_weight")
+        action_cooldown = domain.prop("action_cooldown")
+        min_dwell_time = domain.prop("min_dwell_time")
+        load_hysteresis = domain.prop("load_hysteresis")
+        priority_limit = domain.prop("priority_limit")
+        whitelist_aggregate_threshold = domain.prop("whitelist_aggregate_threshold")
+        whitelist_aggregate_prefix_len = domain.prop("whitelist_aggregate_prefix_len")
         self.logger.debug("Adding Domain: name: %s, mode: %s, status: %s", name, mode, status)
 
         config[dpid][name] = {}
@@ -555,6 +933,79 @@ class SciPass:
         config[dpid][name]['sensor_load_delta_threshold'] = sensorLoadDeltaThreshhold
         config[dpid][name]['sensor_configurable_threshold'] = sensorConfigurableThreshold
         config[dpid][name]['max_flow_count'] = max_flow_count
+        if(balance_mode == "global"):
+          config[dpid][name]['balance_mode'] = "global"
+        else:
+          config[dpid][name]['balance_mode'] = "pairwise"
+        if(flow_mod_budget == None):
+          flow_mod_budget = 0
+        config[dpid][name]['flow_mod_budget'] = int(flow_mod_budget)
+        if(merge_mode == "subtree"):
+          config[dpid][name]['merge_mode'] = "subtree"
+        else:
+          config[dpid][name]['merge_mode'] = "pair"
+        if(split_mode == "ratio"):
+          config[dpid][name]['split_mode'] = "ratio"
+        else:
+          config[dpid][name]['split_mode'] = "bisect"
+        if(measure_splits == "true"):
+          config[dpid][name]['measure_splits'] = 1
+        else:
+          config[dpid][name]['measure_splits'] = 0
+        if(rate_history_size == None):
+          rate_history_size = 0
+        config[dpid][name]['rate_history_size'] = int(rate_history_size)
+        if(rate_estimator == None):
+          rate_estimator = "last"
+        config[dpid][name]['rate_estimator'] = rate_estimator
+        if(rate_alpha == None):
+          rate_alpha = .3
+        config[dpid][name]['rate_alpha'] = float(rate_alpha)
+        if(rate_percentile == None):
+          rate_percentile = 95
+        config[dpid][name]['rate_percentile'] = float(rate_percentile)
+        if(rate_beta == None):
+          rate_beta = .1
+        config[dpid][name]['rate_beta'] = float(rate_beta)
+        if(rate_gamma == None):
+          rate_gamma = .1
+        config[dpid][name]['rate_gamma'] = float(rate_gamma)
+        if(rate_season == None):
+          rate_season = 0
+        config[dpid][name]['rate_season'] = int(rate_season)
+        if(vectorize_state == "true"):
+          config[dpid][name]['vectorize_state'] = 1
+        else:
+          config[dpid][name]['vectorize_state'] = 0
+        if(sensor_load_timeout == None):
+          sensor_load_timeout = 0
+        config[dpid][name]['sensor_load_timeout'] = float(sensor_load_timeout)
+        if(bps_weight == None):
+          bps_weight = 1
+        config[dpid][name]['bps_weight'] = float(bps_weight)
+        if(pps_weight == None):
+          pps_weight = 0
+        config[dpid][name]['pps_weight'] = float(pps_weight)
+        if(action_cooldown == None):
+          action_cooldown = 0
+        config[dpid][name]['action_cooldown'] = float(action_cooldown)
+        if(min_dwell_time == None):
+          min_dwell_time = 0
+        config[dpid][name]['min_dwell_time'] = float(min_dwell_time)
+        if(load_hysteresis == None):
+          load_hysteresis = 0
+        config[dpid][name]['load_hysteresis'] = float(load_hysteresis)
+        #--- the balancer's priority blocks stay below this, OpenFlow priorities are 16 bits
+        if(priority_limit == None):
+          priority_limit = 65535
+        config[dpid][name]['priority_limit'] = min(int(priority_limit), 65535)
+        #--- 0 never aggregates whitelist flows
+        if(whitelist_aggregate_threshold == None):
+          whitelist_aggregate_threshold = 0
+        config[dpid][name]['whitelist_aggregate_threshold'] = int(whitelist_aggregate_threshold)
+        if(whitelist_aggregate_prefix_len == None):
+          whitelist_aggregate_prefix_len = 32
+        config[dpid][name]['whitelist_aggregate_prefix_len'] = int(whitelist_aggregate_prefix_len)
         if(ignore_prefix_bw == "true"):
           config[dpid][name]['ignore_prefix_bw'] = 1
         else:
@@ -582,20 +1033,8 @@ class SciPass:
           except IOError:
             state = None
         #create a simple balancer
-        config[dpid][name]['balancer'] = SimpleBalancer( logger = self.logger,
-                                                         maxPrefixes = max_prefixes,
-                                                         ignoreSensorLoad = config[dpid][name]['ignore_sensor_load'],
-                                                         ignorePrefixBW = config[dpid][name]['ignore_prefix_bw'],
-                                                         mostSpecificPrefixLen = most_specific_len,
-                                                         sensorLoadMinThresh = sensorLoadMinThreshold,
-                                                         sensorLoadDeltaThresh = sensorLoadDeltaThreshhold,
-                                                         sensorConfigurableThresh = sensorConfigurableThreshold,
-                                                         leastSpecificPrefixLen = least_specific_len,
-                                                         ipv6LeastSpecificPrefixLen = ipv6least_specific_len,
-                                                         ipv6MostSpecificPrefixLen = ipv6most_specific_len,
-                                                         state = state
-                                                         ) 
-        config[dpid][name]['flows'] = []
+        config[dpid][name]['balancer'] = self.createBalancer(config[dpid][name], state = state)
+        config[dpid][name]['flows'] = FlowRegistry()
         #register the methods
         config[dpid][name]['balancer'].registerAddPrefixHandler(lambda x, y, z, dpid=dpid, name=name: self.addPrefix(dpid = dpid,
                                                                                                                      domain_name = name,
@@ -616,13 +1055,19 @@ class SciPass:
                                                                                                                          prefix = z,
                                                                                                                          priority=a))
         
+        #handler to count the flow-mods a prefix change costs
+        config[dpid][name]['balancer'].registerFlowModCostHandler(lambda x, dpid=dpid, name=name: self.getPrefixFlowModCount(dpid = dpid,
+                                                                                                                            domain_name = name,
+                                                                                                                            prefix = x))
+
         #handler to save the state
-        config[dpid][name]['balancer'].registerStateChangeHandler(lambda x, y, z , dpid=dpid, name=name, mode=mode: self.saveState(dpid = dpid,
+        config[dpid][name]['balancer'].registerStateChangeHandler(lambda x, y, z, a, dpid=dpid, name=name, mode=mode: self.saveState(dpid = dpid,
                                                                                                                                    domain_name = name,
                                                                                                                                    mode = mode,
                                                                                                                                    groups = x,
                                                                                                                                    prefix_list = y,
-                                                                                                                                   prefix_priorities =z
+                                                                                                                                   prefix_priorities =z,
+                                                                                                                                   prefix_bw = a
                                                                                                                                    ))
 
         ports = ctxt.xpathEval("port")
@@ -674,10 +1119,92 @@ class SciPass:
           config[dpid][name]['balancer'].addSensorGroup(group_info)
     
     self.config = config      
+    self._compilePortIndex()
     doc.freeDoc()
     ctxt.xpathFreeContext()
+
+  def _compilePortIndex(self):
+    """compiles every configured port prefix into a trie of prefix -> [(order, dpid, domain, role, port, prefix)]
+
+    order numbers the entries the way the config loops visit them, so
+    lookups can hand back their matches in that same order.
+    """
+    self.portIndex = PrefixTrie()
+    order = 0
+    for dpid in self.config:
+      for name in self.config[dpid]:
+        for role in self.config[dpid][name]['ports']:
+          for port in self.config[dpid][name]['ports'][role]:
+            for prefix in port['prefixes']:
+              entries = self.portIndex.get(prefix['prefix'])
+              if(entries is None):
+                entries = []
+                self.portIndex.insert(prefix['prefix'], entries)
+              entries.append((order, dpid, name, role, port, prefix))
+              order += 1
+
+  def _portsContaining(self, address, role, dpid=None, domain=None):
+    """returns the port index entries of role whose prefix contains address, in config order"""
+    found = []
+    for prefix, entries in self.portIndex.matches(address):
+      for entry in entries:
+        if(entry[3] == role and (dpid is None or entry[1] == dpid) and (domain is None or entry[2] == domain)):
+          found.append(entry)
+    found.sort(key = lambda entry: entry[0])
+    return found
+
+  def _lanMatches(self, src_prefix, dst_prefix):
+    """returns [(dpid, domain, [(port, prefix, contains src, contains dst)])] for the domains with a lan prefix holding either address"""
+    matches = {}
+    for entry in self._portsContaining(src_prefix, 'lan'):
+      matches[entry[0]] = [entry, True, False]
+    for entry in self._portsContaining(dst_prefix, 'lan'):
+      matches.setdefault(entry[0], [entry, False, False])[2] = True
+    domains = []
+    for order in sorted(matches):
+      entry, src_match, dst_match = matches[order]
+      if(not domains or domains[-1][0] != entry[1] or domains[-1][1] != entry[2]):
+        domains.append((entry[1], entry[2], []))
+      domains[-1][2].append((entry[4], entry[5], src_match, dst_match))
+    return domains
     
 
+  def createBalancer(self, domain, state = None):
+    """builds the SimpleBalancer for a parsed domain config"""
+    return SimpleBalancer( logger = self.logger,
+                           maxPrefixes = domain['max_prefixes'],
+                           ignoreSensorLoad = domain['ignore_sensor_load'],
+                           ignorePrefixBW = domain['ignore_prefix_bw'],
+                           mostSpecificPrefixLen = domain['most_specific_prefix_len'],
+                           sensorLoadMinThresh = domain['sensor_load_min_threshold'],
+                           sensorLoadDeltaThresh = domain['sensor_load_delta_threshold'],
+                           sensorConfigurableThresh = domain['sensor_configurable_threshold'],
+                           leastSpecificPrefixLen = domain['least_specific_prefix_len'],
+                           ipv6LeastSpecificPrefixLen = domain['ipv6least_specific_prefix_len'],
+                           ipv6MostSpecificPrefixLen = domain['ipv6most_specific_prefix_len'],
+                           balanceMode = domain['balance_mode'],
+                           flowModBudget = domain['flow_mod_budget'],
+                           mergeMode = domain['merge_mode'],
+                           splitMode = domain['split_mode'],
+                           measureSplits = domain['measure_splits'],
+                           rateHistorySize = domain['rate_history_size'],
+                           rateEstimator = domain['rate_estimator'],
+                           rateAlpha = domain['rate_alpha'],
+                           ratePercentile = domain['rate_percentile'],
+                           rateBeta = domain['rate_beta'],
+                           rateGamma = domain['rate_gamma'],
+                           rateSeason = domain['rate_season'],
+                           vectorizeState = domain['vectorize_state'],
+                           sensorLoadTimeout = domain['sensor_load_timeout'],
+                           bpsWeight = domain['bps_weight'],
+                           ppsWeight = domain['pps_weight'],
+                           actionCooldown = domain['action_cooldown'],
+                           minDwellTime = domain['min_dwell_time'],
+                           loadHysteresis = domain['load_hysteresis'],
+                           priorityLimit = domain['priority_limit'],
+                           state = state
+                           )
+
   def switchLeave(self, datapath):
     if datapath in self.switches:
       self.switches.remove(datapath)
@@ -850,7 +1377,9 @@ class SciPass:
 
     #ok now that we have that done... start balancing!!!
     self.logger.info("Distributing Prefixes!")
-    self.config[dpid][domain_name]['balancer'].pushToSwitch()
+    self.config[dpid][domain_name]['balancer'].pushToSwitch(dpid = dpid,
+                                                            domain_name = domain_name,
+                                                            mode = self.config[dpid][domain_name]['mode'])
     
 
   def _setupInlineIDS(self, dpid = None, domain_name = None):
@@ -901,7 +1430,9 @@ class SciPass:
 
     #ok now that we have that done... start balancing!!!
     self.logger.info("Distributing Prefixes!")
-    self.config[dpid][domain_name]['balancer'].pushToSwitch()
+    self.config[dpid][domain_name]['balancer'].pushToSwitch(dpid = dpid,
+                                                            domain_name = domain_name,
+                                                            mode = self.config[dpid][domain_name]['mode'])
 
   def _setupBalancer(self, dpid = None, domain_name = None):
     self.logger.debug("balancer rule init")
@@ -915,7 +1446,9 @@ class SciPass:
         prefixes.append(prefix['prefix'])
 
     self.logger.info("Distributing Prefixes!")
-    self.config[dpid][domain_name]['balancer'].pushToSwitch()
+    self.config[dpid][domain_name]['balancer'].pushToSwitch(dpid = dpid,
+                                                            domain_name = domain_name,
+                                                            mode = self.config[dpid][domain_name]['mode'])
         
 
   def addPrefix(self, dpid=None, domain_name=None, group_id=None, prefix=None, priority=None):
@@ -967,90 +1500,89 @@ class SciPass:
 
     ports = self.config[dpid][domain_name]['ports']
 
-    for port in ports['lan']:
-      for prefix_obj in port['prefixes']:
-        if(prefix_obj['prefix'].Contains( prefix )):
-          self.logger.debug("Prefix: " + str(prefix_obj['prefix']) + " contains " + str(prefix)) 
-          in_port = port
+    for entry in self._portsContaining(prefix, 'lan', dpid, domain_name):
+      prefix_obj = entry[5]
+      self.logger.debug("Prefix: " + str(prefix_obj['prefix']) + " contains " + str(prefix)) 
+      in_port = entry[4]
          
-          header = {}
-          header = {"nw_src":      prefix,
-                    "phys_port":   int(in_port['port_id'])}
+      header = {}
+      header = {"nw_src":      prefix,
+                "phys_port":   int(in_port['port_id'])}
 
-          actions = []
-          #output to sensor (basically this is the IDS balance case)
-          sensors = self.config[dpid][domain_name]['sensor_groups'][group_id]['sensors']
-          for sensor in sensors:
-            self.logger.debug("output: " + str(sensors[sensor]));
-            actions.append({"type": "output",
-                            "port": int(sensors[sensor]['port_id'])})
+      actions = []
+      #output to sensor (basically this is the IDS balance case)
+      sensors = self.config[dpid][domain_name]['sensor_groups'][group_id]['sensors']
+      for sensor in sensors:
+        self.logger.debug("output: " + str(sensors[sensor]));
+        actions.append({"type": "output",
+                        "port": int(sensors[sensor]['port_id'])})
+      
+      if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
+      #append the FW or other destination
+        if(ports.has_key('fw_lan') and len(ports['fw_lan']) > 0):
+          actions.append({"type": "output",
+                          "port": int(ports['fw_lan'][0]['port_id'])})
+        else:
+          actions.append({"type": "output",
+                          "port": int(ports['wan'][0]['port_id'])})
+
+      status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                                       domain       = domain_name,
+                                                       header       = header,
+                                                       actions      = actions,
+                                                       command      = "ADD",
+                                                       idle_timeout = 0,
+                                                       hard_timeout = 0,
+                                                       priority     = priority)
+      if status!= 1:
+        self.logger.error("Max flow limit reached.Could not add flow")
+        self.delete_flows(flows)
+        raise MaxFlowCountError("Max Flow Count Reached")
+      else:
+        obj = { 'dpid' : dpid, 'domain' : domain_name, 'header' : header,
+                'actions' : actions, 'priority' : priority }
+        flows.append(obj)
           
-          if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
+      header = {}
+      if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
+        header = {"nw_dst": prefix,
+                  "phys_port": int(ports['wan'][0]['port_id'])}
+      else:
+        header = {"nw_dst": prefix,
+                  "phys_port": int(in_port['port_id'])}
+        
+      actions = []
+      #output to sensor (basically this is the IDS balance case)
+        
+      for sensor in sensors:
+        actions.append({"type": "output",
+                        "port": int(sensors[sensor]['port_id'])})
+      if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
           #append the FW or other destination
-            if(ports.has_key('fw_lan') and len(ports['fw_lan']) > 0):
-              actions.append({"type": "output",
-                              "port": int(ports['fw_lan'][0]['port_id'])})
-            else:
-              actions.append({"type": "output",
-                              "port": int(ports['wan'][0]['port_id'])})
-
-          status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                           domain       = domain_name,
-                                                           header       = header,
-                                                           actions      = actions,
-                                                           command      = "ADD",
-                                                           idle_timeout = 0,
-                                                           hard_timeout = 0,
-                                                           priority     = priority)
-          if status!= 1:
-            self.logger.error("Max flow limit reached.Could not add flow")
-            self.delete_flows(flows)
-            raise MaxFlowCountError("Max Flow Count Reached")
-          else:
-            obj = { 'dpid' : dpid, 'domain' : domain_name, 'header' : header,
-                    'actions' : actions, 'priority' : priority }
-            flows.append(obj)
-              
-          header = {}
-          if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
-            header = {"nw_dst": prefix,
-                      "phys_port": int(ports['wan'][0]['port_id'])}
-          else:
-            header = {"nw_dst": prefix,
-                      "phys_port": int(in_port['port_id'])}
-            
-          actions = []
-          #output to sensor (basically this is the IDS balance case)
+        if(ports.has_key('fw_wan') and len(ports['fw_wan']) > 0):
+          actions.append({"type": "output",
+                          "port": int(ports['fw_wan'][0]['port_id'])})
+        else:
+          actions.append({"type": "output",
+                          "port": int(ports['wan'][0]['port_id'])})
             
-          for sensor in sensors:
-            actions.append({"type": "output",
-                            "port": int(sensors[sensor]['port_id'])})
-          if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
-              #append the FW or other destination
-            if(ports.has_key('fw_wan') and len(ports['fw_wan']) > 0):
-              actions.append({"type": "output",
-                              "port": int(ports['fw_wan'][0]['port_id'])})
-            else:
-              actions.append({"type": "output",
-                              "port": int(ports['wan'][0]['port_id'])})
-                
-          self.logger.debug("Header: %s" % str(header))
-          status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                             domain       = domain_name,
-                                                             header       = header,
-                                                             actions      = actions,
-                                                             command      = "ADD",
-                                                             idle_timeout = 0,
-                                                             hard_timeout = 0,
-                                                             priority     = priority)
-          if status != 1:
-            self.logger.error("Max flow limit reached.Could not add flow")
-            self.delete_flows(flows)
-            raise MaxFlowCountError("Max Flow Count Reached")
-          else:
-            obj = { 'dpid' : dpid, 'domain' : domain_name, 'header' : header,
-                    'actions' : actions, 'priority' : priority }
-            flows.append(obj)
+      self.logger.debug("Header: %s" % str(header))
+      status = self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                                         domain       = domain_name,
+                                                         header       = header,
+                                                         actions      = actions,
+                                                         command      = "ADD",
+                                                         idle_timeout = 0,
+                                                         hard_timeout = 0,
+                                                         priority     = priority)
+      if status != 1:
+        self.logger.error("Max flow limit reached.Could not add flow")
+        self.delete_flows(flows)
+        raise MaxFlowCountError("Max Flow Count Reached")
+      else:
+        obj = { 'dpid' : dpid, 'domain' : domain_name, 'header' : header,
+                'actions' : actions, 'priority' : priority }
+        flows.append(obj)
 
 
   def delPrefix(self, dpid=None, domain_name=None, group_id=None, prefix=None, priority=None):
@@ -1088,50 +1620,56 @@ class SciPass:
 
     #need to figure out the lan and wan ports
     ports = self.config[dpid][domain_name]['ports']
-    for port in ports['lan']:
-      for prefix_obj in port['prefixes']:
-        if(prefix_obj['prefix'].Contains( prefix )):
-          in_port = port
+    for entry in self._portsContaining(prefix, 'lan', dpid, domain_name):
+      in_port = entry[4]
 
-          header = {}
-          header = {"nw_src":      prefix,
-                    "phys_port":   int(in_port['port_id'])}
+      header = {}
+      header = {"nw_src":      prefix,
+                "phys_port":   int(in_port['port_id'])}
     
-          actions = []
-          self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                  domain       = domain_name,
-                                                  header       = header,
-                                                  actions      = actions,
-                                                  command      = "DELETE_STRICT",
-                                                  idle_timeout = 0,
-                                                  hard_timeout = 0,
-                                                  priority     = priority)
-          header = {}
-          if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
-            header = {}
-            header = {"nw_dst":      prefix,
-                      "phys_port":   int(ports['wan'][0]['port_id'])}
-          else:
-            header = {"nw_dst":      prefix,
-                      "phys_port":   int(in_port['port_id'])}
-          
-          actions = []
-          self.fireForwardingStateChangeHandlers( dpid         = dpid,
-                                                  domain       = domain_name,
-                                                  header       = header,
-                                                  actions      = actions,
-                                                  command      = "DELETE_STRICT",
-                                                  idle_timeout = 0,
-                                                  hard_timeout = 0,
-                                                  priority     = priority)
+      actions = []
+      self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                              domain       = domain_name,
+                                              header       = header,
+                                              actions      = actions,
+                                              command      = "DELETE_STRICT",
+                                              idle_timeout = 0,
+                                              hard_timeout = 0,
+                                              priority     = priority)
+      header = {}
+      if(self.config[dpid][domain_name]['mode'] == "SciDMZ" or self.config[dpid][domain_name]['mode'] == "InlineIDS"):
+        header = {}
+        header = {"nw_dst":      prefix,
+                  "phys_port":   int(ports['wan'][0]['port_id'])}
+      else:
+        header = {"nw_dst":      prefix,
+                  "phys_port":   int(in_port['port_id'])}
+      
+      actions = []
+      self.fireForwardingStateChangeHandlers( dpid         = dpid,
+                                              domain       = domain_name,
+                                              header       = header,
+                                              actions      = actions,
+                                              command      = "DELETE_STRICT",
+                                              idle_timeout = 0,
+                                              hard_timeout = 0,
+                                              priority     = priority)
     
+  def getPrefixFlowModCount(self, dpid=None, domain_name=None, prefix=None):
+    """returns the number of flow-mods addPrefix or delPrefix sends for prefix"""
+    if self.config[dpid][domain_name]['mode'] == "SimpleBalancer":
+      return 2
+
+    #one src and one dst rule for every lan port that routes the prefix
+    return 2 * len(self._portsContaining(prefix, 'lan', dpid, domain_name))
+
   def movePrefix(self, dpid = None, domain_name=None, new_group_id=None, old_group_id=None, prefix=None, priority=None):
     self.logger.debug("move prefix")
     #delete and add the prefix
     self.delPrefix(dpid, domain_name, old_group_id, prefix, priority)
     self.addPrefix(dpid, domain_name, new_group_id, prefix, priority)
     
-  def saveState(self, dpid = None, domain_name = None, mode = None, groups = None, prefix_list = None, prefix_priorities = None):
+  def saveState(self, dpid = None, domain_name = None, mode = None, groups = None, prefix_list = None, prefix_priorities = None, prefix_bw = None):
     self.logger.info("Saving State")
     self.logger.debug(str(dpid))
     self.logger.debug(str(domain_name))
@@ -1147,12 +1685,17 @@ class SciPass:
     for k, v in group.iteritems():
       v['prefixes']= [str(i) for i in v["prefixes"]]
 
-    for prefix in prefix_list:
-      prefixes = [str(i) for i in prefix_list]
-     
+    prefixes = [str(i) for i in prefix_list]
+
     for k, v in prefix_priorities.iteritems():
       priorities[str(k)] = v
 
+    #--- bandwidth of each prefix, to place them close to balanced on the next start
+    bandwidth = {}
+    if(prefix_bw != None):
+      for k, v in prefix_bw.iteritems():
+        bandwidth[str(k)] = v
+
     curr_state = {}
     curr_state["switch"] = {}
     curr_state["switch"][dpid] = {}
@@ -1163,24 +1706,22 @@ class SciPass:
     curr_state["switch"][dpid]["domain"][domain_name]["mode"][mode]["groups"] = group
     curr_state["switch"][dpid]["domain"][domain_name]["mode"][mode]["prefixes"] = prefixes
     curr_state["switch"][dpid]["domain"][domain_name]["mode"][mode]["priorities"] = priorities
+    curr_state["switch"][dpid]["domain"][domain_name]["mode"][mode]["prefix_bw"] = bandwidth
     with open("/var/run/" +fileName, 'w') as fd:
       json.dump([curr_state], fd)
     fd.close()
+    self.stateSaved[(dpid, domain_name)] = time.time()
 
   def remove_flow(self, dpid=None, domain=None, header=None,priority=None):
     self.logger.debug("remove flow")
-    for white in self.whiteList:
-      if ((cmp(header, white['header']) == 0) and (cmp(priority, white['priority'])== 0)):
-        """ if a good flow times out, remove it"""
-        self.logger.error("Removing good flow due to timeout")
-        self.whiteList.remove(white)
-        
+    #--- flow removed messages carry no dpid or domain, so those match any switch
+    if(self.whiteList.remove(header, priority, dpid, domain)):
+      # if a good flow times out, remove it
+      self.logger.error("Removing good flow due to timeout")
         
-    for black in self.blackList:
-      if ((cmp(header, black['header']) == 0) and (cmp(priority, black['priority'])== 0)):
-        """ if a bad flow times out, remove it"""
-        self.logger.error("Removing bad flow due to timeout")
-        self.blackList.remove(black)
+    if(self.blackList.remove(header, priority, dpid, domain)):
+      # if a bad flow times out, remove it
+      self.logger.error("Removing bad flow due to timeout")
         
     if not dpid:
       return
@@ -1188,11 +1729,7 @@ class SciPass:
     if not domain:
       return
     
-    match = self.stringify(header)
-    for flow in self.config[dpid][domain]['flows']:
-      if(flow['header'] == match and flow['priority'] == priority):
-        self.config[dpid][domain]['flows'].remove(flow)
-        self.flowCount -= 1
+    self.flowCount -= len(self.config[dpid][domain]['flows'].remove(header, priority, dpid))
 
 
   def port_status(self, ev):
@@ -1211,6 +1748,12 @@ class SciPass:
                                          hard_timeout = 0,
                                          priority     = 1):
     
+    if(self.pendingFlowMods is not None):
+      self.pendingFlowMods.append({'dpid': dpid, 'domain': domain, 'header': header,
+                                   'actions': actions, 'command': command, 'idle_timeout': idle_timeout,
+                                   'hard_timeout': hard_timeout, 'priority': priority})
+      return 1
+
     self.logger.debug("fireing forwarding state change handlers")
     self.logger.debug("Header: " + str(header))
     self.logger.debug("Actions: " + str(actions))
@@ -1231,12 +1774,14 @@ class SciPass:
 
   def pushFlows(self, dpid=None, domain=None, header=None, actions=None, priority=None):
     match = self.stringify(header)
-    self.config[dpid][domain]['flows'].append({'dpid': dpid,
-                                               'header': match,
-                                               'actions': actions,
-                                               'priority': priority
-                                               })
-    self.flowCount+= 1
+    flow = {'dpid': dpid,
+            'header': match,
+            'actions': actions,
+            'priority': priority
+            }
+    count = len(self.config[dpid][domain]['flows'])
+    self.config[dpid][domain]['flows'].add(dpid, domain, header, priority, flow)
+    self.flowCount += len(self.config[dpid][domain]['flows']) - count
 
   def stringify(self,header=None):
     match = {}
@@ -1252,47 +1797,82 @@ class SciPass:
 
   def pushTimeouts(self,idle= None,hard= None):
     if idle:
-      self.idleTimeouts.append(idle)
+      self.idleTimeouts[flowKey(idle['dpid'], idle['domain'], idle['header'], idle['priority'])] = idle
     if hard:
       self.hardTimeouts.append(hard)
 
-  def updatePrefixBW(self,dpid, prefix, tx, rx):
+  def updatePrefixBW(self,dpid, prefix, tx, rx, interval=None, packets=0):
     self.logger.debug("updating prefix bw")
-    for domain_name in self.config[dpid]:
-      for port in self.config[dpid][domain_name]['ports']['lan']:
-        for pref in port['prefixes']:
-          if(pref['prefix'].Contains( prefix )):
-            self.logger.debug("Updating prefix " + str(prefix) + " bandwidth for %s %s", dpid, domain_name)
-            self.config[dpid][domain_name]['balancer'].setPrefixBW(prefix, tx, rx)
-            return
+    for entry in self._portsContaining(prefix, 'lan', dpid):
+      domain_name = entry[2]
+      self.logger.debug("Updating prefix " + str(prefix) + " bandwidth for %s %s", dpid, domain_name)
+      self.config[dpid][domain_name]['balancer'].setPrefixBW(prefix, tx, rx, interval=interval, packets=packets)
+      return
 
-  def getSensorLoad(self, sensor):
-    self.logger.debug("getting sensor load for sensor %s", sensor)
+  def _sensorBalancers(self):
+    """maps every configured sensor id to the balancer of its domain"""
+    balancers = {}
     for dpid in self.config:
-      for domain in self.config['dpid']:
-        if(self.config[dpid][domain]['balancer'].getSensorStatus(sensor) != -1):
-          return self.config[dpid][domain]['balancer'].getSensorStatus(sensor)
+      for domain in self.config[dpid]:
+        bal = self.config[dpid][domain]['balancer']
+        for group in bal.getSensorGroups().values():
+          for sensor in group['sensors']:
+            balancers[sensor] = bal
+    return balancers
 
-  def setSensorLoad(self, sensor, load):
-    self.logger.debug("updating sensor %s with load %d", sensor, load)
-    for dpid in self.config:
-      for domain in self.config['dpid']:
-        if(self.config[dpid][domain]['balancer'].getSensorStatus(sensor) != -1):
-          self.config[dpid][domain]['balancer'].setSensorStatus(sensor,load)
-          return {success: 1}
-    return {success: 0, msg: "Unable to find sensor with id: " + sensor}
+  def getSensorLoad(self, sensor):
+    self.logger.debug("getting sensor load for sensor %s", sensor)
+    balancers = self._sensorBalancers()
+    if(balancers.has_key(sensor)):
+      return balancers[sensor].getSensorLoadDetails(sensor)
+
+  def setSensorLoad(self, sensor, load, timestamp=None):
+    return self.setSensorLoads([{'sensor_id': sensor, 'load': load, 'timestamp': timestamp}])
+
+  def setSensorLoads(self, loads):
+    """updates many sensors at once, each sample a dict of sensor_id, load and an optional timestamp"""
+    balancers = self._sensorBalancers()
+    updated = 0
+    failed = []
+    for sample in loads:
+      sensor = sample.get('sensor_id')
+      #--- sensor ids in the config are strings, json clients may send numbers
+      if(not balancers.has_key(sensor) and balancers.has_key(str(sensor))):
+        sensor = str(sensor)
+      try:
+        load = float(sample.get('load'))
+        timestamp = sample.get('timestamp')
+        if(timestamp != None):
+          timestamp = float(timestamp)
+      except (TypeError, ValueError):
+        self.logger.error("Bad load sample %s", str(sample))
+        failed.append(sensor)
+        continue
+      if(not balancers.has_key(sensor)):
+        self.logger.error("Unable to find sensor with id: %s", str(sensor))
+        failed.append(sensor)
+        continue
+      if(balancers[sensor].setSensorLoad(sensor, load, timestamp)):
+        updated += 1
+      else:
+        failed.append(sensor)
+    self.logger.debug("updated load for %d sensors, %d failed", updated, len(failed))
+    if(len(failed) > 0):
+      return {'success': 0, 'updated': updated, 'failed': failed,
+              'msg': "Unable to update load for sensors: " + ", ".join([str(sensor) for sensor in failed])}
+    return {'success': 1, 'updated': updated, 'failed': failed}
 
   def getSwitchFlows(self, dpid=None):
     flows = []
     if(self.config.has_key(dpid)):
       for domain in self.config[dpid]:
-        flows.extend(self.config[dpid][domain]['flows'])
+        flows.extend(self.config[dpid][domain]['flows'].values())
     return flows
 
   def getDomainFlows(self, dpid=None, domain=None):
     if(self.config.has_key(dpid)):
       if(self.config[dpid].has_key(domain)):
-        return self.config[dpid][domain]['flows']
+        return self.config[dpid][domain]['flows'].values()
 
   def getDomainDetails(self, dpid=None, domain=None):
     if(self.config.has_key(dpid)):
@@ -1320,6 +1900,33 @@ class SciPass:
         return res
         
 
+  def getPrefixHistory(self, dpid=None, domain=None, prefix=None):
+    if(self.config.has_key(dpid)):
+      if(self.config[dpid].has_key(domain)):
+        bal = self.config[dpid][domain]['balancer']
+        if(prefix != None):
+          prefix = Prefix.fromNetwork(prefix)
+        res = {}
+        histories = bal.getPrefixHistories()
+        for pfx in histories:
+          if(prefix != None and not prefix == pfx):
+            continue
+          res[str(pfx)] = {'rate': bal.getPrefixBW(pfx),
+                           'samples': histories[pfx].getSamples()}
+        return res
+
+  def getDomainUtilisation(self, dpid=None, domain=None):
+    if(self.config.has_key(dpid)):
+      if(self.config[dpid].has_key(domain)):
+        bal = self.config[dpid][domain]['balancer']
+        res = {}
+        for group in bal.getSensorGroups():
+          res[group] = {'bandwidth': bal.getGroupBW(group),
+                        'packet_rate': bal.getGroupPacketRate(group),
+                        'capacity': bal.getSensorGroup(group)['capacity'],
+                        'utilisation': bal.getGroupUtilisation(group)}
+        return res
+
   def getSwitchDomains(self, dpid=None):
     domains = []
     if(self.config.has_key(dpid)):
@@ -1393,7 +2000,13 @@ class SciPass:
     for dpid in self.config:
       for domain_name in self.config[dpid]:
         self.logger.debug("Balancing: %s %s", dpid, domain_name)
-        self.config[dpid][domain_name]['balancer'].balance()
+        bal = self.config[dpid][domain_name]['balancer']
+        bal.balance()
+        #--- keep the saved prefix bandwidth current for the next start, prefix
+        #--- changes save the state themselves so a slow timer is enough here
+        last = self.stateSaved.get((dpid, domain_name), 0)
+        if(bal.initialized and time.time() - last >= self.stateSaveInterval):
+          bal.fireSaveState()
         
   def getBalancer(self, dpid, domain_name):
     return self.config[dpid][domain_name]['balancer']
@@ -1418,7 +2031,7 @@ class SciPass:
 
     #need to improve this! its a O(n^2)
     for flow in flows:
-      for idle in self.idleTimeouts:
+      for idle in self.idleTimeouts.values():
         if(dpid == idle['dpid']):
           #need to compare the flow match to the header
           #self.logger.error(str(flow['match']))
@@ -1438,7 +2051,7 @@ class SciPass:
           except TypeError:
             pass
 
-    for flow in self.idleTimeouts:
+    for key, flow in self.idleTimeouts.items():
       if(flow['dpid'] == dpid):
         self.logger.debug("Flows current timeout: " + str(flow['timeout']) + " now " + str(now))
         if(flow['timeout'] <= now):
@@ -1456,4 +2069,7 @@ class SciPass:
                                                   command      = "DELETE_STRICT",
                                                   priority     = flow['priority'])
           
-          self.idleTimeouts.remove(flow)
+          del self.idleTimeouts[key]
+
+    #--- the flows that timed out may take a host pair across its aggregation threshold
+    self._checkAggregates(dpid)
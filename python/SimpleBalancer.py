@@ -14,12 +14,22 @@
 # limitations under the License.
 
 
+import re
 import time
-import ipaddr
+import math
 import pprint
 import json
 import logging
 from collections import defaultdict
+from Prefix import Prefix, ADDRESS_BITS
+from OrderedSet import OrderedSet
+from PrefixTrie import PrefixTrie
+from RateHistory import RateHistory
+from PrefixTable import PrefixTable
+from PriorityAllocator import PriorityAllocator
+
+#--- multipliers for the unit of a sensor group's bw attribute, 10G, 40GE, 100Mbps
+CAPACITY_UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
 
 
 class PrefixlenInvalidError(Exception):
@@ -41,6 +51,12 @@ class MaxPrefixesError(Exception):
     def __init__(self, msg):
       self.msg = msg
 
+class PriorityExhaustedError(Exception):
+    """Raised when there is no priority block left for a new prefix"""
+
+    def __init__(self, msg):
+      self.msg = msg
+
 class DuplicatePrefixError(Exception):
     """Raised when attempt to add a prefix that has been already added"""
 
@@ -67,7 +83,28 @@ class SimpleBalancer:
 		 sensorLoadDeltaThresh	= .05,
                  sensorConfigurableThresh = 100,
                  state                  = None,
-                 logger                 = None):
+                 logger                 = None,
+                 debugAggregates        = 0,
+                 balanceMode            = "pairwise",
+                 flowModBudget          = 0,
+                 mergeMode              = "pair",
+                 splitMode              = "bisect",
+                 measureSplits          = 0,
+                 rateHistorySize        = 0,
+                 rateEstimator          = "last",
+                 rateAlpha              = .3,
+                 ratePercentile         = 95,
+                 rateBeta               = .1,
+                 rateGamma              = .1,
+                 rateSeason             = 0,
+                 vectorizeState         = 0,
+                 priorityLimit          = 65535,
+                 sensorLoadTimeout      = 0,
+                 bpsWeight              = 1,
+                 ppsWeight              = 0,
+                 actionCooldown         = 0,
+                 minDwellTime           = 0,
+                 loadHysteresis         = 0):
       
       if(logger == None):
           logging.basicConfig()
@@ -78,6 +115,10 @@ class SimpleBalancer:
       self.maxPrefixes		       = maxPrefixes;
       self.prefixCount		       = 0;
       self.prefixPriorities           = defaultdict(list)
+      #--- longest prefix match indexes, kept in sync with prefixPriorities and the groups
+      self.priorityIndex              = PrefixTrie()
+      self.prefixIndex                = PrefixTrie()
+      self.groupIndex                 = {}
       self.mostSpecificPrefixLen       = int(mostSpecificPrefixLen)
       self.leastSpecificPrefixLen      = int(leastSpecificPrefixLen)
       self.ipv6MostSpecificPrefixLen       = int(ipv6MostSpecificPrefixLen)
@@ -86,22 +127,83 @@ class SimpleBalancer:
       self.sensorLoadMinThreshold      = float(sensorLoadMinThresh)
       self.sensorLoadDeltaThreshold    = float(sensorLoadDeltaThresh)
       self.sensorConfigurableThreshold = float(sensorConfigurableThresh)
-      self.curr_priority               = 500
+      #--- seconds a sensor's reported load counts for, 0 keeps it until the next report
+      self.sensorLoadTimeout           = float(sensorLoadTimeout)
+      #--- each top level prefix gets a block of 100 priorities below the whitelist/blacklist
+      #--- priority, released blocks are reused and blockUsers counts the entries in each block
+      self.priorityAllocator           = PriorityAllocator(base = 500, limit = priorityLimit, blockSize = 100)
+      self.blockUsers                  = defaultdict(int)
+      #--- blocks whose count has dropped to 0, checked again when reclaiming
+      self.idleBlocks                  = set()
 
       self.ignorePrefixBW              = ignorePrefixBW
+      #--- cross check the running group totals against a full recompute each cycle
+      self.debugAggregates             = debugAggregates
+      #--- pairwise moves between the max and min group, or global to plan all groups at once
+      self.balanceMode                 = balanceMode
+      #--- max flow-mods a balance cycle may generate, 0 for no limit
+      self.flowModBudget               = int(flowModBudget)
+      self.flowModsUsed                = 0
+      #--- seconds before a prefix that was moved, split or merged can be acted on again,
+      #--- and before a prefix can leave the group it arrived on
+      self.actionCooldown              = float(actionCooldown)
+      self.minDwellTime                = float(minDwellTime)
+      #--- start balancing once the load delta reaches the delta threshold plus this and
+      #--- keep going until it drops below the threshold minus it
+      self.loadHysteresis              = float(loadHysteresis)
+      self.balancing                   = False
+      #--- prefix -> {'action', 'time', 'arrived'} of the last balancing action on it
+      self.actionHistory               = {}
+      #--- reason -> action -> number of actions held back
+      self.suppressedActions           = defaultdict(lambda: defaultdict(int))
+      #--- pair merges one sibling pair per cycle, subtree collapses everything it can in one pass
+      self.mergeMode                   = mergeMode
+      #--- bisect splits one bit at a time, ratio splits as deep as the prefix bandwidth calls for
+      self.splitMode                   = splitMode
+      #--- measure the halves of a prefix with counting rules before splitting it
+      self.measureSplits               = measureSplits
+      #--- prefixes being measured: parent -> {half: measured bw or None}, and half -> parent
+      self.measurements                = {}
+      self.measurementParents          = {}
+      #--- keep the last rateHistorySize intervals per prefix and balance on an estimate
+      #--- from them (last, ewma, percentile or forecast), 0 uses each new rate as is
+      self.rateHistorySize             = int(rateHistorySize)
+      self.rateEstimator               = rateEstimator
+      self.rateAlpha                   = float(rateAlpha)
+      self.ratePercentile              = float(ratePercentile)
+      #--- forecast balances on the Holt-Winters prediction of the next interval,
+      #--- rateSeason is the number of intervals in one traffic cycle, 0 for none
+      self.rateBeta                    = float(rateBeta)
+      self.rateGamma                   = float(rateGamma)
+      self.rateSeason                  = int(rateSeason)
+      self.rateHistory                 = {}
+      #--- prefixes are balanced on bpsWeight * bits/s + ppsWeight * packets/s, ppsWeight
+      #--- is the bits a packet is charged as, so small packet floods weigh in too
+      self.bpsWeight                   = float(bpsWeight)
+      self.ppsWeight                   = float(ppsWeight)
+      #--- packets per second of each prefix, the vectorized table keeps them itself
+      self.prefixPPS                   = {}
       self.sensorBandwidthMinThreshold = 1
       self.groups                     = defaultdict(list)
       
+      #--- keep prefix bandwidth, packet rate, hosts and group in flat arrays
+      #--- so whole table computations do not walk every prefix in python
+      self.vectorizeState              = vectorizeState
       #--- prefix bandwidth in GigaBits/sec
-      self.prefixBW		       = defaultdict(float)
+      if(self.vectorizeState):
+          self.prefixBW                = PrefixTable()
+      else:
+          self.prefixBW                = defaultdict(float)
       #--- previous State
       self.state = state
       self.addPrefixHandlers  = []
       self.delPrefixHandlers  = []
       self.movePrefixHandlers = []
       self.saveStateChangeHandlers = []
-      self.prefix_list = []
+      self.flowModCostHandler = None
+      self.prefix_list = OrderedSet()
       self.initialized = False
+      self.restoredState = False
       return
   
   def __str__(self):
@@ -114,23 +216,140 @@ class SimpleBalancer:
       return res 
 
   def addPrefix(self, prefix):
-      if(prefix not in self.prefix_list):
-          self.prefix_list.append(prefix)
+      self.prefix_list.add(Prefix.fromNetwork(prefix))
 
-  def pushToSwitch(self):
+  def pushToSwitch(self, dpid=None, domain_name=None, mode=None):
       """initialize a device"""
       if(self.initialized):
           self.pushAllPrefixes()
       else:
-          self.distributePrefixes(self.prefix_list)
+          if(self.distributeByHistory(self._savedPrefixBW(dpid, domain_name, mode))):
+              self.restoredState = True
+          else:
+              self.distributePrefixes(self.prefix_list)
           self.fireSaveState()
           self.initialized = True
       self.logger.info("Switch Initialized")
 
+  def _savedPrefixBW(self, dpid, domain_name, mode):
+      """returns {prefix: bw} from the previous state, empty if there is none"""
+      savedBW = {}
+      if(not self.state or dpid is None):
+          return savedBW
+      try:
+          saved = self.state["switch"][dpid]["domain"][domain_name]["mode"][mode]
+      except KeyError:
+          return savedBW
+      for prefix, bw in saved.get("prefix_bw", {}).items():
+          savedBW[Prefix.fromNetwork(prefix)] = float(bw)
+      return savedBW
+
+  def distributeByHistory(self, savedBW):
+      """places the configured prefixes using the bandwidth saved by the previous run
+
+      a configured prefix that the saved prefixes cover exactly comes back at
+      the saved granularity, any prefix over a fair share is split further and
+      the result is bin-packed largest first onto the group with the least
+      bandwidth for its capacity. the prefixes restored for one configured
+      prefix share its priority block, the way split subnets do. everything
+      else is distributed as usual. returns 0 without placing anything when
+      there is no saved bandwidth
+      """
+      placed = {}
+      #--- restored prefix -> the configured prefix it came from
+      parents = {}
+      covered = []
+      rest = []
+      for prefix in list(self.prefix_list):
+          children = [saved for saved in savedBW if prefix.Contains(saved)]
+          if(children and sum([child.numhosts for child in children]) == prefix.numhosts):
+              covered.append(prefix)
+              for child in children:
+                  placed[child] = savedBW[child]
+                  parents[child] = prefix
+          else:
+              rest.append(prefix)
+
+      groups = [group for group in self.groups.keys() if self.getGroupStatus(group)]
+      totalBW = sum(placed.values())
+      if(len(groups) == 0 or totalBW <= 0):
+          return 0
+
+      #--- pre-split the hot prefixes, guessing an even split of their bandwidth
+      fairShare = totalBW / len(groups)
+      hot = sorted([prefix for prefix in placed if placed[prefix] > fairShare], key=placed.get, reverse=True)
+      while(hot and len(placed) + len(rest) < self.maxPrefixes):
+          prefix = hot.pop(0)
+          if(prefix.version == 4):
+              mostSpecific = self.mostSpecificPrefixLen
+          else:
+              mostSpecific = self.ipv6MostSpecificPrefixLen
+          if(prefix.prefixlen >= mostSpecific):
+              continue
+          bw = placed.pop(prefix)
+          parent = parents.pop(prefix)
+          for subnet in self.splitPrefix(prefix):
+              placed[subnet] = bw / 2.0
+              parents[subnet] = parent
+              if(bw / 2.0 > fairShare):
+                  hot.append(subnet)
+          self.logger.debug("Pre-split %s with %s bps saved", str(prefix), str(bw))
+
+      #--- the saved prefixes take the place of the configured ones they cover
+      children = defaultdict(list)
+      for prefix in placed:
+          children[parents[prefix]].append(prefix)
+      for prefix in covered:
+          try:
+              self._carvePriorities(sorted(children[prefix]))
+          except PriorityExhaustedError:
+              self.logger.error("No priority block left for prefix: " + str(prefix))
+              for child in children[prefix]:
+                  del placed[child]
+              rest.append(prefix)
+              continue
+          self.prefix_list.discard(prefix)
+
+      weights = self._capacityWeights(groups)
+      assigned = dict((group, 0.0) for group in groups)
+      for prefix in sorted(placed, key=lambda p: (-placed[p], p)):
+          bw = placed[prefix]
+          group = min(groups, key=lambda g: (assigned[g] + bw) / weights[g])
+          try:
+              if(self.addGroupPrefix(group, prefix, bw)):
+                  assigned[group] += bw
+                  continue
+          except DuplicatePrefixError:
+              self.logger.debug("Already have prefix: " + str(prefix))
+          except MaxPrefixesError:
+              self.logger.error("Max prefixes reached, not placing: " + str(prefix))
+          if(self.getPrefixGroup(prefix) is None):
+              self._delPrefixPriority(prefix)
+      self.logger.info("Placed %d prefixes from the saved bandwidth", len(placed))
+      if(rest):
+          self.distributePrefixes(rest)
+      return 1
+
+  def _carvePriorities(self, prefixes):
+      """gives the prefixes a slice each of one new priority block, raises PriorityExhaustedError if there is none
+
+      the prefixes do not overlap, so when there are more of them than the
+      block has priorities several share one
+      """
+      start = self._allocatePriority()
+      size = self.priorityAllocator.blockSize
+      for index, prefix in enumerate(prefixes):
+          low = start + index * size / len(prefixes)
+          high = start + (index + 1) * size / len(prefixes)
+          self._setPrefixPriority(prefix, {'priority': low, 'total': max(high - low, 1)})
+
   def pushPrevState(self, dpid=None, domain_name=None, mode=None):
       #Assumes no change in configuration from previous configuration
       if not self.state:
           return
+      if(self.restoredState):
+          #--- pushToSwitch already placed the saved prefixes
+          return
       
       if  self.state["switch"][dpid]["domain"][domain_name]["mode"].has_key(mode):
           self.logger.info("Pushing Previous State") 
@@ -140,10 +359,7 @@ class SimpleBalancer:
           
           #calculate previous prefixes
           for prefix in self.state["switch"][dpid]["domain"][domain_name]["mode"][mode]["prefixes"]:
-              try:
-                  prevPrefixes.append(ipaddr.IPv4Network(prefix))
-              except:
-                  prevPrefixes.append(ipaddr.IPv6Network(prefix))
+              prevPrefixes.append(Prefix.fromNetwork(prefix))
                   
           
           previous = set(prevPrefixes)
@@ -176,6 +392,24 @@ class SimpleBalancer:
       obj['leastSpecificPrefixLen'] = self.leastSpecificPrefixLen
       obj['sensorLoadMinThreshold'] = self.sensorLoadMinThreshold
       obj['sensorLoadDeltaThreshold'] = self.sensorLoadDeltaThreshold
+      obj['balanceMode'] = self.balanceMode
+      obj['flowModBudget'] = self.flowModBudget
+      obj['flowModsUsed'] = self.flowModsUsed
+      obj['mergeMode'] = self.mergeMode
+      obj['splitMode'] = self.splitMode
+      obj['measureSplits'] = self.measureSplits
+      obj['rateHistorySize'] = self.rateHistorySize
+      obj['rateEstimator'] = self.rateEstimator
+      obj['rateSeason'] = self.rateSeason
+      obj['vectorizeState'] = self.vectorizeState
+      obj['sensorLoadTimeout'] = self.sensorLoadTimeout
+      obj['bpsWeight'] = self.bpsWeight
+      obj['ppsWeight'] = self.ppsWeight
+      obj['actionCooldown'] = self.actionCooldown
+      obj['minDwellTime'] = self.minDwellTime
+      obj['loadHysteresis'] = self.loadHysteresis
+      obj['suppressedActions'] = self.getSuppressedActions()
+      obj['priorityUtilisation'] = self.getPriorityUtilisation()
 
       return obj
 
@@ -188,17 +422,195 @@ class SimpleBalancer:
       return json.dumps(self,default=lambda o: o.__dict__, sort_keys=True, indent=4)
 
   def getPrefixPriority(self, prefix):
-      for pfix in self.prefixPriorities:
-          if(pfix.Contains(prefix)):
-              return self.prefixPriorities[pfix]
+      match = self.priorityIndex.longestMatch(prefix)
+      if(match is not None):
+          return match[1]
+
+  def _setPrefixPriority(self, prefix, priority):
+      """records the priority block for a prefix"""
+      if(self.prefixPriorities.has_key(prefix)):
+          self._countBlockUsers(self.prefixPriorities[prefix], -1)
+      self.prefixPriorities[prefix] = priority
+      self.priorityIndex.insert(prefix, priority)
+      self._countBlockUsers(priority, 1)
+
+  def _delPrefixPriority(self, prefix):
+      """forgets the priority block for a prefix"""
+      if(self.prefixPriorities.has_key(prefix)):
+          self._countBlockUsers(self.prefixPriorities[prefix], -1)
+          del self.prefixPriorities[prefix]
+      self.priorityIndex.delete(prefix)
+
+  def _countBlockUsers(self, priority, count):
+      for block in self.priorityAllocator.blocksIn(priority['priority'], priority['total']):
+          self.blockUsers[block] += count
+          if(self.blockUsers[block] <= 0):
+              self.idleBlocks.add(block)
+
+  def _reclaimPriorities(self):
+      """releases the priority blocks no prefix uses any more
+
+      splits and merges drop and re-add entries inside a block, so blocks
+      are only reclaimed here, when a new block is needed or reported on
+      """
+      for block in self.idleBlocks:
+          if(self.priorityAllocator.blocks.has_key(block) and self.blockUsers.get(block, 0) <= 0):
+              self.priorityAllocator.release(block)
+              self.blockUsers.pop(block, None)
+      self.idleBlocks.clear()
+
+  def _allocatePriority(self):
+      """returns the start of a free priority block, compacting the space if it is full"""
+      self._reclaimPriorities()
+      start = self.priorityAllocator.allocate()
+      if(start is None):
+          self.compactPriorities()
+          start = self.priorityAllocator.allocate()
+      if(start is None):
+          raise PriorityExhaustedError("no priority block left below " + str(self.priorityAllocator.limit))
+      #--- idle until the prefix it is for is counted in
+      self.idleBlocks.add(start)
+      return start
+
+  def compactPriorities(self):
+      """moves the highest priority blocks down into the free ones, returns the number of prefixes rewritten
+
+      each rule in a moved block is added at its new priority before the old
+      one is deleted so its traffic keeps matching. blocks shared by a merged
+      prefix are left where they are
+      """
+      self._reclaimPriorities()
+      allocator = self.priorityAllocator
+      pinned = set()
+      for priority in self.prefixPriorities.values():
+          blocks = allocator.blocksIn(priority['priority'], priority['total'])
+          if(len(blocks) > 1):
+              pinned.update(blocks)
+      moves = allocator.compactionPlan(pinned)
+      if(not moves):
+          return 0
+      #--- counting rules sit at priority + 1, measure again after the move
+      for parent in self.measurements.keys():
+          self._stopMeasurement(self.getPrefixGroup(parent), parent)
+      installed = []
+      for group in self.groups:
+          for prefix in self.groups[group]['prefixes']:
+              installed.append((group, prefix, self.getPrefixPriority(prefix)['priority']))
+      rewritten = 0
+      compacted = 0
+      for old, new in moves:
+          size = allocator.blocks[old]
+          inBlock = [entry for entry in installed if old <= entry[2] < old + size]
+          #--- the whole block goes in at its new priorities before anything is changed, so a
+          #--- switch that runs out of room leaves the block where it was
+          added = []
+          try:
+              for group, prefix, priority in inBlock:
+                  self.fireAddPrefix(group, prefix, priority + new - old)
+                  added.append((group, prefix, priority))
+          except MaxFlowCountError:
+              self.logger.error("Max Flow Count Reached, leaving priority block %d in place", old)
+              for group, prefix, priority in added:
+                  self.fireDelPrefix(group, prefix, priority + new - old)
+              continue
+          allocator.move(old, new)
+          self.blockUsers[new] = self.blockUsers.pop(old, 0)
+          self.idleBlocks.discard(old)
+          moved = set()
+          for priority in self.prefixPriorities.values():
+              #--- rollbacks can leave one entry under two prefixes, move it once
+              if(id(priority) not in moved and old <= priority['priority'] < old + size):
+                  priority['priority'] += new - old
+                  moved.add(id(priority))
+          for group, prefix, priority in inBlock:
+              self.fireDelPrefix(group, prefix, priority)
+              rewritten += 1
+          compacted += 1
+      self.logger.info("Compacted %d priority blocks, rewrote %d prefixes", compacted, rewritten)
+      if(self.initialized):
+          self.fireSaveState()
+      return rewritten
+
+  def getPriorityUtilisation(self):
+      """returns how much of the priority space is allocated and how fragmented it is"""
+      self._reclaimPriorities()
+      return self.priorityAllocator.utilisation()
+
+  def _indexGroupPrefix(self, group, prefix):
+      """adds a prefix assigned to group to the lookup indexes"""
+      self.prefixIndex.insert(prefix, group)
+      self.groupIndex[group].insert(prefix)
+      if(self.vectorizeState):
+          self.prefixBW.setGroup(prefix, group)
+
+  def _unindexGroupPrefix(self, group, prefix):
+      """removes a prefix assigned to group from the lookup indexes"""
+      self.prefixIndex.delete(prefix)
+      self.groupIndex[group].delete(prefix)
+      if(self.vectorizeState):
+          self.prefixBW.setGroup(prefix, None)
+
+  def _addGroupTotals(self, group, prefix):
+      """adds a prefix to the running bandwidth/host/prefix totals of group"""
+      self.groups[group]['bandwidth']   += self.prefixBW[prefix]
+      self.groups[group]['hosts']       += prefix.numhosts
+      self.groups[group]['prefixCount'] += 1
+
+  def _removeGroupTotals(self, group, prefix):
+      """removes a prefix from the running bandwidth/host/prefix totals of group"""
+      self.groups[group]['prefixCount'] -= 1
+      self.groups[group]['hosts']       -= prefix.numhosts
+      if(self.groups[group]['prefixCount'] == 0):
+          #--- reset so float error can not build up on an empty group
+          self.groups[group]['bandwidth'] = float(0)
+      else:
+          self.groups[group]['bandwidth'] -= self.prefixBW[prefix]
+
+  def _updatePrefixBW(self, prefix, bw):
+      """sets the bandwidth of a prefix and moves its group total by the difference"""
+      group = self.getPrefixGroup(prefix)
+      if(group is not None):
+          self.groups[group]['bandwidth'] += bw - self.prefixBW[prefix]
+      self.prefixBW[prefix] = bw
+
+  def _checkGroupAggregates(self):
+      """recomputes the group totals from scratch, logs and repairs any drift, returns the number of groups that were off"""
+      bad = 0
+      if(self.vectorizeState):
+          totals = self.prefixBW.groupTotals()
+      for group in self.groups:
+          groupBW = float(0)
+          hosts = 0
+          if(self.vectorizeState):
+              groupBW = totals.get(group, float(0))
+              for prefix in self.groups[group]['prefixes']:
+                  hosts += prefix.numhosts
+          else:
+              for prefix in self.groups[group]['prefixes']:
+                  groupBW += self.prefixBW[prefix]
+                  hosts += prefix.numhosts
+          count = len(self.groups[group]['prefixes'])
+          if(abs(groupBW - self.groups[group]['bandwidth']) > 1e-6 * max(1.0, groupBW) or
+             hosts != self.groups[group]['hosts'] or count != self.groups[group]['prefixCount']):
+              self.logger.error("Group %s totals out of sync: bw %s vs %s, hosts %s vs %s, prefixes %s vs %s",
+                                str(group), str(self.groups[group]['bandwidth']), str(groupBW),
+                                str(self.groups[group]['hosts']), str(hosts),
+                                str(self.groups[group]['prefixCount']), str(count))
+              self.groups[group]['bandwidth'] = groupBW
+              self.groups[group]['hosts'] = hosts
+              self.groups[group]['prefixCount'] = count
+              bad += 1
+      return bad
 
 
   #distributes prefixes through all groups
   #this is not going to be event but it is at least a start
   def distributePrefixes(self, prefix_array):
       self.logger.debug("Distributing prefixes: " + str(prefix_array))
-      prefix_array = list(prefix_array)
-      group_index = 0
+      prefix_array = [Prefix.fromNetwork(prefix) for prefix in prefix_array]
+      #--- bigger groups get proportionally more of the prefixes
+      weights = self._capacityWeights(self.groups.keys())
+      current = defaultdict(float)
       for prefix in prefix_array:
           
           self.logger.debug("prefix len: %d", prefix.prefixlen)
@@ -214,7 +626,7 @@ class SimpleBalancer:
                   except MaxPrefixlenError:
                       self.logger.error("Exceeded the most specific prefix len!\n");
               else:
-                  group = self.groups.keys()[group_index]
+                  group = self._nextGroup(weights, current)
                   self.logger.debug("Adding prefix %s to group: %s", str(prefix), str(self.groups[group]['group_id']))
                   try:
                       self.addGroupPrefix( self.groups[group]['group_id'], prefix, 0)
@@ -222,9 +634,8 @@ class SimpleBalancer:
                       self.logger.debug("Already have prefix: " + str(prefix))
                   except MaxFlowCountError:
                       self.logger.debug("Max Flow Count Error")
-                  group_index += 1
-                  if(group_index >= len(self.groups)):
-                      group_index = 0
+                  except PriorityExhaustedError:
+                      self.logger.error("No priority block left for prefix: " + str(prefix))
           else:
               #handle IPv6 differently
               if(prefix.prefixlen < self.ipv6LeastSpecificPrefixLen):
@@ -233,7 +644,7 @@ class SimpleBalancer:
                   except MaxPrefixlenError:
                       self.logger.error("Exceeded the most specific prefix len!\n");
               else:
-                  group = self.groups.keys()[group_index]
+                  group = self._nextGroup(weights, current)
                   self.logger.debug("Adding prefix %s to group: %s", str(prefix), str(self.groups[group]['group_id']))
                   try:
                       self.addGroupPrefix( self.groups[group]['group_id'], prefix, 0)
@@ -241,11 +652,13 @@ class SimpleBalancer:
                       self.logger.debug("Already have prefix: " + str(prefix))
                   except MaxFlowCountError:
                       self.logger.debug("Max Flow Count Error")
-                  group_index += 1
-                  if(group_index >= len(self.groups)):
-                      group_index = 0
+                  except PriorityExhaustedError:
+                      self.logger.error("No priority block left for prefix: " + str(prefix))
               
   def pushAllPrefixes(self):
+      #--- counting rules do not survive a reconnect, measure again from scratch
+      self.measurements = {}
+      self.measurementParents = {}
       for group in self.groups:
           for prefix in self.groups[group]['prefixes']:
               priority = self.getPrefixPriority(prefix)
@@ -264,35 +677,111 @@ class SimpleBalancer:
 
     group['load'] = 0
     group['status'] = 1
-    group['prefixes'] = []
+    group['prefixes'] = OrderedSet()
+    group['bandwidth'] = float(0)
+    group['hosts'] = 0
+    group['prefixCount'] = 0
+    group['capacity'] = self._parseCapacity(group.get('bw'))
+    if(group['capacity'] is None):
+        self.logger.warn("SensorGroup %s has no usable bw '%s', balancing it as an equal share", group['group_id'], group.get('bw'))
+    self.groupIndex[group['group_id']] = PrefixTrie()
 
     #create sensor status/load for each sensor in the group
     for sensor in group['sensors']:
         group['sensors'][sensor]['status'] = 1
         group['sensors'][sensor]['load'] = 0
+        group['sensors'][sensor]['loadTime'] = None
 
     self.groups[group['group_id']] = group
 
     return 1
  
   
-  def setSensorLoad(self,sensor,load):
-    """sets the load value for the sensor, 0-1 float is range"""
+  def _parseCapacity(self, bw):
+    """returns a sensor group bw like 10G, 40GE or 100Mbps in bits per second, None if it can't be read"""
+    if(bw is None):
+        return None
+    match = re.match(r'^\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)(E|B|BPS|B/S)?\s*$', str(bw).upper())
+    if(match is None):
+        return None
+    capacity = float(match.group(1)) * CAPACITY_UNITS[match.group(2)]
+    if(capacity <= 0):
+        return None
+    return capacity
+
+  def _capacityWeights(self, groups):
+    """returns each group's capacity over the mean capacity of groups
+
+    every weight is 1 unless all of the groups have a capacity, so groups
+    with equal or unknown capacities are balanced to equal shares as before
+    """
+    weights = {}
+    capacities = [self.groups[group].get('capacity') for group in groups]
+    if(len(capacities) == 0 or None in capacities):
+        for group in groups:
+            weights[group] = 1.0
+        return weights
+    mean = sum(capacities) / len(capacities)
+    for group, capacity in zip(groups, capacities):
+        weights[group] = capacity / mean
+    return weights
+
+  def _nextGroup(self, weights, current):
+    """smooth weighted round robin over the groups, in order when the weights are equal"""
+    best = None
+    for group in self.groups.keys():
+        current[group] += weights[group]
+        if(best is None or current[group] > current[best]):
+            best = group
+    current[best] -= sum(weights.values())
+    return best
+
+  def getGroupUtilisation(self, group):
+    """returns the group's bandwidth over its capacity, None when the capacity is unknown"""
+    if(not self.groups.has_key(group) or not self.groups[group].get('capacity')):
+        return None
+    return self.groups[group]['bandwidth'] / self.groups[group]['capacity']
+
+  def setSensorLoad(self,sensor,load,timestamp=None):
+    """sets the load value for the sensor, 0-1 float is range
+
+    timestamp is when the sensor measured it, now if not given. a sample
+    older than the one already held is ignored
+    """
     if(load >= 0 and load <= 1):
+        if(timestamp is None):
+            timestamp = time.time()
         for group in self.groups:
             if(self.groups[group]['sensors'].has_key(sensor)):
-                self.groups[group]['sensors'][sensor]['load'] = load
+                info = self.groups[group]['sensors'][sensor]
+                if(info.get('loadTime') is not None and timestamp < info['loadTime']):
+                    self.logger.debug("Ignoring out of order load for sensor %s", str(sensor))
+                    return 0
+                info['load'] = load
+                info['loadTime'] = timestamp
                 return 1
         return 0
     else:
         return 0
 
+  def _sensorLoadFresh(self, info, now):
+      """whether a sensor's load was reported within sensorLoadTimeout"""
+      if(self.sensorLoadTimeout <= 0):
+          return True
+      return info.get('loadTime') is not None and now - info['loadTime'] <= self.sensorLoadTimeout
+
   def getGroupLoad(self, group):
+      """returns the highest load reported by the group's sensors, None when every report is stale"""
       if(self.groups.has_key(group)):
           sensors = self.groups[group]['sensors']
           maxLoad = -1
           maxSensor = -1
+          now = time.time()
+          stale = 0
           for sensor in sensors:
+              if(not self._sensorLoadFresh(sensors[sensor], now)):
+                  stale += 1
+                  continue
               if(maxLoad == -1):
                   maxLoad = sensors[sensor]['load']
                   maxSensor = sensor
@@ -300,8 +789,34 @@ class SimpleBalancer:
                   if(sensors[sensor]['load'] > maxLoad):
                       maxSensor = sensor
                       maxLoad = sensors[sensor]['load']
+          if(stale > 0 and stale == len(sensors)):
+              return None
           return maxLoad
       return
+
+  def getGroupLoadEstimate(self, group):
+      """combines the sensors' reported load with the group's bandwidth utilisation
+
+      a sensor that is saturated at low bandwidth or a group near its
+      capacity with sensors under reporting both count as loaded. None when
+      there is neither a fresh report nor a known utilisation
+      """
+      load = self.getGroupLoad(group)
+      utilisation = None
+      if(self.ignorePrefixBW == 0):
+          utilisation = self.getGroupUtilisation(group)
+      if(load is None):
+          return utilisation
+      if(utilisation is None):
+          return load
+      return max(load, utilisation)
+
+  def _placementLoad(self, group):
+      """load to compare when choosing a group to put prefixes on, a group with no current load counts as full"""
+      load = self.getGroupLoadEstimate(group)
+      if(load is None):
+          return 1
+      return load
           
 
   def unloadGroupPrefixes(self, group):
@@ -315,9 +830,9 @@ class SimpleBalancer:
       # make sure it's not the sensor were moving prefixes off of
       if(other_group == group): continue
       # don't include disabled sensors
-      if(not self.getGroupStatus(group)): continue
+      if(not self.getGroupStatus(other_group)): continue
       
-      load = self.getGroupLoad(other_group)
+      load = self._placementLoad(other_group)
       
       if(load < minLoad):
           minLoad       = load
@@ -328,7 +843,7 @@ class SimpleBalancer:
     self.logger.info("prefixList: %s" % (prefixList))
     for prefix in prefixList:
         self.logger.info("moving prefix %s from %s to %s" % (prefix, group, minLoadGroup))
-        self.moveSensorPrefix(sensor, minLoadGroup, prefix)
+        self.moveGroupPrefix(group, minLoadGroup, prefix)
 
   def getGroupStatus(self,group):
       if(self.groups.has_key(group)):
@@ -379,15 +894,105 @@ class SimpleBalancer:
       self.logger.error("Sensor: " + str(sensor) + " does not exist")
       return -1
 
-  def setPrefixBW(self,prefix,bwTx,bwRx):
-    """updates balancers understanding trafic bandwidth associated with each prefix"""
+  def setPrefixBW(self,prefix,bwTx,bwRx,interval=None,packets=0,timestamp=None):
+    """updates balancers understanding trafic bandwidth associated with each prefix
+
+    bwTx and bwRx are in bytes per second, interval is the length of the stats
+    interval they were measured over and packets the packets counted during it
+    """
+    prefix = Prefix.fromNetwork(prefix)
     self.logger.debug("Updating prefix BW for " + str(prefix) + " to " + str((bwTx/1000/1000)*8) + "Mb/s " + str((bwRx/1000/1000)*8) + "Mb/s")
+    pps = 0.0
+    if(interval):
+        pps = packets / float(interval)
+    if(self.measurementParents.has_key(prefix)):
+        self._recordMeasurement(prefix, self._balanceRate((bwTx * 8) + (bwRx * 8), pps))
+        return 1
+    if(self.measurements.has_key(prefix)):
+        #--- the counting rules see all of this prefix's traffic while it is measured
+        return 1
     if(self.prefixBW.has_key(prefix)):
-        self.prefixBW[prefix] = (bwTx * 8) + (bwRx * 8)
+        bw = (bwTx * 8) + (bwRx * 8)
+        if(self.rateHistorySize > 0):
+            bw = self._recordRate(prefix, bwTx + bwRx, interval, packets, timestamp)
+            pps = self.getPrefixPacketRate(prefix)
+        self._setPrefixPacketRate(prefix, pps)
+        self._updatePrefixBW(prefix, self._balanceRate(bw, pps))
         return 1
     self.logger.debug( "Error updating prefixBW for " + str(prefix) + "... prefix does not exist")
     return 0
 
+  def _recordRate(self,prefix,byteRate,interval,packets,timestamp):
+    """adds an interval to the prefix's history and returns the rate to balance on"""
+    if(interval is None or interval <= 0):
+        interval = 1.0
+    if(timestamp is None):
+        timestamp = time.time()
+    history = self.rateHistory.get(prefix)
+    if(history is None):
+        history = RateHistory(self.rateHistorySize)
+        self.rateHistory[prefix] = history
+    history.add(timestamp, interval, byteRate * interval, packets)
+    return self.getPrefixRate(prefix)
+
+  def _estimate(self,history,values):
+    """applies the configured rate estimator to values from history"""
+    if(self.rateEstimator == "ewma"):
+        return history.ewma(self.rateAlpha, values)
+    if(self.rateEstimator == "percentile"):
+        return history.percentile(self.ratePercentile, values)
+    if(self.rateEstimator == "forecast"):
+        return history.forecast(self.rateAlpha, self.rateBeta, self.rateGamma, self.rateSeason, values)
+    if(not values):
+        return 0.0
+    return values[-1]
+
+  def getPrefixRate(self,prefix):
+    """returns the estimated rate of prefix in bits per second from its history"""
+    prefix = Prefix.fromNetwork(prefix)
+    history = self.rateHistory.get(prefix)
+    if(history is None):
+        return self.prefixBW[prefix]
+    return self._estimate(history, history.rates())
+
+  def getPrefixPacketRate(self,prefix):
+    """returns the estimated packets per second of prefix"""
+    prefix = Prefix.fromNetwork(prefix)
+    history = self.rateHistory.get(prefix)
+    if(history is not None):
+        return self._estimate(history, history.packetRates())
+    if(self.vectorizeState):
+        return self.prefixBW.getPacketRate(prefix)
+    return self.prefixPPS.get(prefix, 0.0)
+
+  def _setPrefixPacketRate(self,prefix,pps):
+    if(self.vectorizeState):
+        self.prefixBW.setPacketRate(prefix, pps)
+    else:
+        self.prefixPPS[prefix] = pps
+
+  def _balanceRate(self,bps,pps):
+    """the rate a prefix is balanced on, bits per second plus its packets charged at ppsWeight bits each"""
+    return self.bpsWeight * bps + self.ppsWeight * pps
+
+  def getGroupPacketRate(self,group):
+    """returns the packets per second of all of a group's prefixes"""
+    if(not self.groups.has_key(group)):
+        return None
+    if(self.vectorizeState):
+        return self.prefixBW.groupTotals('pps').get(group, 0.0)
+    total = 0.0
+    for prefix in self.groups[group]['prefixes']:
+        total += self.getPrefixPacketRate(prefix)
+    return total
+
+  def getPrefixHistory(self,prefix):
+    """returns the RateHistory of prefix or None"""
+    return self.rateHistory.get(Prefix.fromNetwork(prefix))
+
+  def getPrefixHistories(self):
+    return self.rateHistory
+
   def registerAddPrefixHandler(self,handler):
     """used to register a handler for add prefix events"""
     self.addPrefixHandlers.append(handler)
@@ -404,56 +1009,171 @@ class SimpleBalancer:
       """used to register a handler for save state events"""
       self.saveStateChangeHandlers.append(handler)
 
+  def registerFlowModCostHandler(self,handler):
+    """used to register the handler that counts the flow-mods needed to add or delete a prefix"""
+    self.flowModCostHandler = handler
+
+  def getPrefixFlowMods(self,prefix):
+    """returns the number of flow-mods adding or deleting prefix generates"""
+    if(self.flowModCostHandler is None):
+        #--- one rule for each direction
+        return 2
+    return self.flowModCostHandler(prefix)
+
+  def getActionCost(self,action,prefix,subnets=None):
+    """returns the number of flow-mods a move, split or merge of prefix generates
+
+    for a split subnets are the new prefixes, for a merge they are the prefixes
+    being merged into prefix
+    """
+    prefix = Prefix.fromNetwork(prefix)
+    if(action == "move"):
+        #--- a move is a delete and an add
+        return 2 * self.getPrefixFlowMods(prefix)
+    cost = self.getPrefixFlowMods(prefix)
+    for subnet in subnets:
+        cost += self.getPrefixFlowMods(subnet)
+    return cost
+
+  def _actionSuppressed(self,action,prefixes):
+    """returns True and counts it if one of prefixes is still in its cooldown or dwell time"""
+    now = time.time()
+    for prefix in prefixes:
+        history = self.actionHistory.get(prefix)
+        if(history is None):
+            continue
+        reason = None
+        if(now - history['time'] < self.actionCooldown):
+            reason = "cooldown"
+        elif(action != "split" and now - history['arrived'] < self.minDwellTime):
+            #--- moves and merges take prefixes off the group they are on
+            reason = "dwell"
+        if(reason is not None):
+            self.logger.debug("Holding back %s of %s, last %s %.1fs ago", action, str(prefix),
+                              history['action'], now - history['time'])
+            self.suppressedActions[reason][action] += 1
+            return True
+    return False
+
+  def _permitAction(self,action,prefix,subnets=None):
+    """true if a balancing move, split or merge of prefix may run now, records it if so
+
+    the prefix (or for a merge the prefixes merged) must be past its cooldown
+    and dwell time and the action must fit in the flow-mod budget
+    """
+    prefix = Prefix.fromNetwork(prefix)
+    if(action == "merge"):
+        checked = subnets
+    else:
+        checked = [prefix]
+    if(self._actionSuppressed(action, checked)):
+        return False
+    if(not self._withinBudget(self.getActionCost(action, prefix, subnets))):
+        return False
+    if(self.actionCooldown > 0 or self.minDwellTime > 0):
+        now = time.time()
+        if(action == "split"):
+            created = subnets
+        else:
+            created = [prefix]
+        for target in created:
+            self.actionHistory[target] = {'action': action, 'time': now, 'arrived': now}
+    return True
+
+  def _deltaExceeded(self,loadDelta):
+    """applies the hysteresis band around sensorLoadDeltaThreshold to loadDelta"""
+    if(self.balancing):
+        threshold = self.sensorLoadDeltaThreshold - self.loadHysteresis
+    else:
+        threshold = self.sensorLoadDeltaThreshold + self.loadHysteresis
+    self.balancing = loadDelta >= threshold
+    if(not self.balancing and loadDelta >= self.sensorLoadDeltaThreshold):
+        self.suppressedActions["hysteresis"]["balance"] += 1
+    return self.balancing
+
+  def getSuppressedActions(self):
+    """returns how many actions the cooldown, dwell time and hysteresis held back"""
+    res = {}
+    for reason in self.suppressedActions:
+        res[reason] = dict(self.suppressedActions[reason])
+    return res
+
+  def _withinBudget(self,cost):
+    """true if cost more flow-mods fit in what is left of this cycle's budget"""
+    if(self.flowModBudget <= 0):
+        return True
+    if(self.flowModsUsed + cost <= self.flowModBudget):
+        return True
+    self.logger.info("Flow-mod budget reached: used %d of %d, action needs %d",
+                     self.flowModsUsed, self.flowModBudget, cost)
+    return False
+
   def fireAddPrefix(self,group,prefix, priority):
     """When called will fire each of the registered add prefix handlers"""
+    if(self.flowModBudget > 0):
+      self.flowModsUsed += self.getPrefixFlowMods(prefix)
+    if(self.addPrefixHandlers):
+      prefix = prefix.toNetwork()
     for handler in self.addPrefixHandlers:
       handler(group,prefix, priority)
 
   def fireDelPrefix(self,group,prefix, priority):
     """When called will fire each of the registered del prefix handlers"""
+    if(self.flowModBudget > 0):
+      self.flowModsUsed += self.getPrefixFlowMods(prefix)
+    if(self.delPrefixHandlers):
+      prefix = prefix.toNetwork()
     for handler in self.delPrefixHandlers:
       handler(group,prefix, priority)
 
   def fireMovePrefix(self,oldGroup,newGroup,prefix, priority):
     """when called will fire each of the registered move prefix handlers"""
+    if(self.flowModBudget > 0):
+      self.flowModsUsed += 2 * self.getPrefixFlowMods(prefix)
+    if(self.movePrefixHandlers):
+      prefix = prefix.toNetwork()
     for handler in self.movePrefixHandlers:
       handler(oldGroup,newGroup,prefix, priority)
 
   def fireSaveState(self):
       """when called will fire each of the registered save state handlers"""
+      prefixBW = dict(self.prefixBW.items())
       for handler in self.saveStateChangeHandlers:
-          handler(self.groups, self.prefix_list, self.prefixPriorities)
+          handler(self.groups, self.prefix_list, self.prefixPriorities, prefixBW)
 
   def delGroupPrefix(self,group,targetPrefix):
     """looks for prefix and removes it if its associated with the sensor"""
     if(not self.groups.has_key(group)):
         return 0
+    targetPrefix = Prefix.fromNetwork(targetPrefix)
 
     prefixList = self.groups[group]['prefixes']
+    if(targetPrefix not in prefixList):
+        return 0
+
+    if(self.measurements.has_key(targetPrefix)):
+        self._stopMeasurement(group, targetPrefix)
 
     priority = self.getPrefixPriority(targetPrefix)
 
-    x = 0;
-    for prefix in prefixList:
-      if(targetPrefix == prefix):
-	    #--- call function to remove this from the switch
-        self.fireDelPrefix(group,targetPrefix, priority['priority'])
-        #--- remove from list
-        prefixList.pop(x)
-        self.prefixCount = self.prefixCount -1
-        if targetPrefix in self.prefix_list:
-            self.prefix_list.remove(targetPrefix)
-        if(self.prefixBW.has_key(targetPrefix)):
-            del self.prefixBW[targetPrefix]
-        if(targetPrefix in self.groups[group]['prefixes']):
-            self.groups[group]['prefixes'].remove(targetPrefix)
-        if(self.prefixPriorities.has_key(targetPrefix)):
-            del self.prefixPriorities[targetPrefix]
-        if(self.initialized):
-            self.fireSaveState()
-        return 1
-      x = x+1
-    return 0
+    #--- call function to remove this from the switch
+    self.fireDelPrefix(group,targetPrefix, priority['priority'])
+    #--- remove from list
+    prefixList.remove(targetPrefix)
+    self.prefixCount = self.prefixCount -1
+    self._removeGroupTotals(group, targetPrefix)
+    self.prefix_list.discard(targetPrefix)
+    if(self.prefixBW.has_key(targetPrefix)):
+        del self.prefixBW[targetPrefix]
+    self.prefixPPS.pop(targetPrefix, None)
+    self.actionHistory.pop(targetPrefix, None)
+    if(self.rateHistory.has_key(targetPrefix)):
+        del self.rateHistory[targetPrefix]
+    self._unindexGroupPrefix(group, targetPrefix)
+    self._delPrefixPriority(targetPrefix)
+    if(self.initialized):
+        self.fireSaveState()
+    return 1
 
   def addGroupPrefix(self,group,targetPrefix,bw=0):
     """adds a prefix to the sensor"""
@@ -464,43 +1184,38 @@ class SimpleBalancer:
 
     if(self.prefixCount >= self.maxPrefixes):
         raise MaxPrefixesError("prefix greater than max prefixes")
+    targetPrefix = Prefix.fromNetwork(targetPrefix)
     
     if targetPrefix in self.prefix_list:
         sensor = self.getPrefixGroup(targetPrefix)
         if sensor:
             self.logger.error(str(targetPrefix) + " already contained in " + str(sensor))
             return 0
-    prefixList = list(self.groups[group]['prefixes'])
     priority = self.getPrefixPriority(targetPrefix)
 
     if(priority == None):
-        self.prefixPriorities[targetPrefix] = {'priority': self.curr_priority, 'total': 100, 'bandwidth': 0}
+        self._setPrefixPriority(targetPrefix, {'priority': self._allocatePriority(),
+                                               'total': self.priorityAllocator.blockSize, 'bandwidth': 0})
         priority = self.prefixPriorities[targetPrefix]
-        self.curr_priority += 100
     
-    x = 0;
-    for prefix in prefixList:
-        if(targetPrefix == prefix):
+    groupIndex = self.groupIndex[group]
+    if(targetPrefix in groupIndex):
         #--- already in list
-            raise DuplicatePrefixError("Prefix already in list")
-            return 0;
-        elif(targetPrefix.Contains(prefix)):
-            raise DuplicatePrefixError("Prefix is already contained by something else")
-            return 0
-        elif(prefix.Contains(targetPrefix)):
-            raise DuplicatePrefixError("Prefix is already contained by something else")
-            return 0
+        raise DuplicatePrefixError("Prefix already in list")
+    elif(groupIndex.overlaps(targetPrefix)):
+        raise DuplicatePrefixError("Prefix is already contained by something else")
 
     #--- call function to add this to the switch
     try:
         self.fireAddPrefix(group,targetPrefix, priority['priority'])
     except MaxFlowCountError:
         return 0
-    self.groups[group]['prefixes'].append(targetPrefix)
+    self.groups[group]['prefixes'].add(targetPrefix)
     self.prefixCount = self.prefixCount + 1
     self.prefixBW[targetPrefix] = bw
-    if targetPrefix not in self.prefix_list:
-        self.prefix_list.append(targetPrefix)
+    self._indexGroupPrefix(group, targetPrefix)
+    self._addGroupTotals(group, targetPrefix)
+    self.prefix_list.add(targetPrefix)
     if(self.initialized):
         self.fireSaveState()
     return 1;
@@ -510,24 +1225,27 @@ class SimpleBalancer:
 
     if(not self.groups.has_key(oldGroup) or not self.groups.has_key(newGroup)):
         return 0
+    targetPrefix = Prefix.fromNetwork(targetPrefix)
     prefixList = self.groups[oldGroup]['prefixes']
-    x = 0;
-    
+    if(targetPrefix not in prefixList):
+        return 0
+
+    if(self.measurements.has_key(targetPrefix)):
+        #--- the counting rules still point at the old group
+        self._stopMeasurement(oldGroup, targetPrefix)
+
     priority = self.getPrefixPriority(targetPrefix)
-    
-    for prefix in prefixList:
-      if(targetPrefix == prefix):
-        #--- found
-        prefixList.pop(x)
-        self.groups[newGroup]['prefixes'].append(prefix)
-        if(prefix in self.groups[oldGroup]['prefixes']):
-            self.groups[oldGroup]['prefixes'].remove(targetPrefix)
-        self.fireMovePrefix(oldGroup,newGroup,targetPrefix, priority['priority'])
-        if(self.initialized):
-            self.fireSaveState()
-        return 1
-      x = x+1 
-    return 0
+
+    prefixList.remove(targetPrefix)
+    self.groups[newGroup]['prefixes'].add(targetPrefix)
+    self._unindexGroupPrefix(oldGroup, targetPrefix)
+    self._indexGroupPrefix(newGroup, targetPrefix)
+    self._removeGroupTotals(oldGroup, targetPrefix)
+    self._addGroupTotals(newGroup, targetPrefix)
+    self.fireMovePrefix(oldGroup,newGroup,targetPrefix, priority['priority'])
+    if(self.initialized):
+        self.fireSaveState()
+    return 1
 
 
   def splitSensorPrefix(self,group,candidatePrefix,check=False):
@@ -535,6 +1253,7 @@ class SimpleBalancer:
       # @param check : If set, checks that the bw on Candidate Prefix
       # is greater than configurable threshold, to prevent continous
       # split and merge
+      candidatePrefix = Prefix.fromNetwork(candidatePrefix)
       try:
           subnets = self.splitPrefix(candidatePrefix)
           bw = self.prefixBW[candidatePrefix]
@@ -544,9 +1263,25 @@ class SimpleBalancer:
                   self.logger.error("Configurable Threshold :" + str(self.sensorConfigurableThreshold))
                   self.logger.error("Preventing split of prefix " + str(candidatePrefix))
                   return 0
+          if(self.splitMode == "ratio"):
+              return self.splitSensorPrefixByRatio(group, candidatePrefix)
+          measured = None
+          if(self.measureSplits):
+              if(not self.measurements.has_key(candidatePrefix)):
+                  if(self._actionSuppressed("split", [candidatePrefix])):
+                      return 0
+                  self.startMeasurement(group, candidatePrefix)
+                  return 0
+              if(None in self.measurements[candidatePrefix].values()):
+                  self.logger.debug("Still measuring " + str(candidatePrefix))
+                  return 0
+          if(not self._permitAction("split", candidatePrefix, subnets)):
+              return 0
+          if(self.measurements.has_key(candidatePrefix)):
+              measured = self._stopMeasurement(group, candidatePrefix)
           self.logger.info( "split prefix "+str(candidatePrefix) +" bw "+str((bw / 1000 / 1000 )) + "Mbps")
           #--- update the bandwidth we are guessing is going to each prefix to smooth things, before real data is avail
-          self.prefixBW[candidatePrefix] = 0
+          self._updatePrefixBW(candidatePrefix, 0)
           priority = self.getPrefixPriority(candidatePrefix)
           
           incrementer = priority['total'] / len(subnets)
@@ -555,27 +1290,34 @@ class SimpleBalancer:
           #--- first, add the more specific rules
           for prefix in subnets:
               #--- set a guess that each of the 2 subnets gets half of the traffic
-              prefixes.append(prefix)
-              try:
+              if(measured is not None):
+                  prefixBw = measured[prefix]
+              else:
                   prefixBw = bw / 2.0
-              except ZeroDivisionError:
-                  prefixBW = 0
               
               self.logger.debug( "  -- "+str(prefix)+" bw "+str((prefixBw / 1000 / 1000)) + "Mbps" )
               self.delGroupPrefix(group, candidatePrefix)
-              self.prefixPriorities[prefix] = {'priority': cur_priority, 'total': incrementer}
+              self._setPrefixPriority(prefix, {'priority': cur_priority, 'total': incrementer})
               
               try:
-                  self.addGroupPrefix(group, prefix, prefixBw)
-              except MaxFlowCountError:
-                  self.logger.error("Max Flow Count Reached")
-                  self.addGroupPrefix(group, candidatePrefix)
-                  for prefix in prefixes:
-                      self.prefixPriorities.delete(prefix)
+                  res = self.addGroupPrefix(group, prefix, prefixBw)
+              except (MaxPrefixesError, PriorityExhaustedError):
+                  res = 0
+              if(not res):
+                  #--- the subnets share the parent's block, so putting it back needs no new one
+                  self.logger.error("Unable to add " + str(prefix) + ", restoring " + str(candidatePrefix))
+                  self._delPrefixPriority(prefix)
+                  for added in prefixes:
+                      self.delGroupPrefix(group, added)
+                  self._setPrefixPriority(candidatePrefix, priority)
+                  self.addGroupPrefix(group, candidatePrefix, bw)
                   return 0
+              prefixes.append(prefix)
               cur_priority += incrementer
 
               #--- now remove the less specific and now redundant rule
+          if(measured is not None):
+              self._placeMeasured(group, measured)
           return 1
 
       except MaxPrefixlenError as e:
@@ -584,16 +1326,158 @@ class SimpleBalancer:
 
 
 
+  def startMeasurement(self,group,prefix):
+      """installs counting rules for both halves of prefix so a split can use real numbers
+
+      the rules go just above the prefix's own priority with the same group, so
+      forwarding does not change while they count. returns 1 if measuring started
+      """
+      prefix = Prefix.fromNetwork(prefix)
+      priority = self.getPrefixPriority(prefix)
+      if(priority is None or priority['total'] < 2):
+          self.logger.debug("No priority room to measure " + str(prefix))
+          return 0
+      try:
+          subnets = self.splitPrefix(prefix)
+      except MaxPrefixlenError:
+          return 0
+      cost = 0
+      for subnet in subnets:
+          cost += self.getPrefixFlowMods(subnet)
+      if(not self._withinBudget(cost)):
+          return 0
+
+      self.logger.info("measuring " + str(prefix) + " before splitting it")
+      self.measurements[prefix] = {}
+      for subnet in subnets:
+          try:
+              self.fireAddPrefix(group, subnet, priority['priority'] + 1)
+          except MaxFlowCountError:
+              self.logger.error("Max Flow Count Reached, not measuring " + str(prefix))
+              self._stopMeasurement(group, prefix)
+              return 0
+          self.measurements[prefix][subnet] = None
+          self.measurementParents[subnet] = prefix
+      return 1
+
+  def _stopMeasurement(self,group,prefix):
+      """removes the counting rules for prefix, returns {half: measured bw}"""
+      priority = self.getPrefixPriority(prefix)
+      measured = self.measurements.pop(prefix)
+      for subnet in measured:
+          del self.measurementParents[subnet]
+          self.fireDelPrefix(group, subnet, priority['priority'] + 1)
+      return measured
+
+  def _recordMeasurement(self,subnet,bw):
+      """stores the bandwidth seen by a counting rule, the parent gets the sum once both halves reported"""
+      parent = self.measurementParents[subnet]
+      measured = self.measurements[parent]
+      measured[subnet] = bw
+      if(None not in measured.values()):
+          self._updatePrefixBW(parent, sum(measured.values()))
+
+  def _placeMeasured(self,group,measured):
+      """moves whichever freshly split half narrows the gap to the least loaded group the most"""
+      target = None
+      for other in sorted(self.groups):
+          if(other == group or not self.getGroupStatus(other)): continue
+          if(target is None or self.groups[other]['bandwidth'] < self.groups[target]['bandwidth']):
+              target = other
+      if(target is None):
+          return 0
+      groupBW = self.groups[group]['bandwidth']
+      targetBW = self.groups[target]['bandwidth']
+      best = max(sorted(measured), key=lambda p: self._moveGain(groupBW, targetBW, measured[p]))
+      if(self._moveGain(groupBW, targetBW, measured[best]) <= 0):
+          return 0
+      #--- part of the split that was just permitted, so only the budget applies
+      if(not self._withinBudget(self.getActionCost("move", best))):
+          return 0
+      self.logger.info("Placing measured prefix %s on group %s", str(best), str(target))
+      return self.moveGroupPrefix(group, target, best)
+
+  def splitSensorPrefixByRatio(self,group,candidatePrefix):
+      """splits a prefix in one step into enough subnets that each carries about a fair
+      share of the bandwidth and spreads them over the least loaded groups"""
+      candidatePrefix = Prefix.fromNetwork(candidatePrefix)
+      bw = self.prefixBW[candidatePrefix]
+      groups = sorted([g for g in self.groups if self.getGroupStatus(g)])
+      if(group not in groups):
+          groups.append(group)
+
+      totalBW = 0
+      for g in groups:
+          totalBW += self.groups[g]['bandwidth']
+      fairShare = totalBW / len(groups)
+
+      if(candidatePrefix.version == 4):
+          mostSpecific = int(self.mostSpecificPrefixLen)
+      else:
+          mostSpecific = int(self.ipv6MostSpecificPrefixLen)
+
+      #--- enough bits for every subnet to get at most a fair share
+      depth = 1
+      if(fairShare > 0):
+          while(2**depth < bw / fairShare):
+              depth = depth + 1
+      depth = min(depth, mostSpecific - candidatePrefix.prefixlen)
+      while(depth > 1 and 2**depth > self.maxPrefixes - self.prefixCount + 1):
+          depth = depth - 1
+      if(depth < 1):
+          self.logger.error( "max prefix len limit:  "+str(candidatePrefix) )
+          return 0
+
+      subnets = self.splitPrefixForSensors(candidatePrefix, 2**depth)
+      if(not self._permitAction("split", candidatePrefix, subnets)):
+          return 0
+
+      #--- place each subnet on whichever group has the least bandwidth so far, the current group wins ties
+      subnetBW = bw / float(len(subnets))
+      loads = {}
+      for g in groups:
+          loads[g] = self.groups[g]['bandwidth']
+      loads[group] -= bw
+      targets = {}
+      for prefix in subnets:
+          targets[prefix] = min(groups, key=lambda g: (loads[g], g != group))
+          loads[targets[prefix]] += subnetBW
+
+      self.logger.info( "split prefix "+str(candidatePrefix) +" bw "+str((bw / 1000 / 1000 )) + "Mbps into " + str(len(subnets)))
+      priority = self.getPrefixPriority(candidatePrefix)
+      self.delGroupPrefix(group, candidatePrefix)
+
+      incrementer = priority['total'] / len(subnets)
+      cur_priority = priority['priority']
+      added = []
+      for prefix in subnets:
+          self._setPrefixPriority(prefix, {'priority': cur_priority, 'total': incrementer})
+          try:
+              res = self.addGroupPrefix(targets[prefix], prefix, subnetBW)
+          except MaxPrefixesError:
+              res = 0
+          if(not res):
+              self.logger.error("Unable to add " + str(prefix) + ", restoring " + str(candidatePrefix))
+              self._delPrefixPriority(prefix)
+              for added_prefix in added:
+                  self.delGroupPrefix(targets[added_prefix], added_prefix)
+              self._setPrefixPriority(candidatePrefix, priority)
+              self.addGroupPrefix(group, candidatePrefix, bw)
+              return 0
+          added.append(prefix)
+          cur_priority += incrementer
+      return 1
+
   def mergeContiguousPrefixes(self,prefixList):
     """reviews a set of prefixes looking for 2 that are contiguous and merges them."""
     subnetDict = defaultdict(list)
     for prefix in prefixList:
         if prefix.version == 4:
-            if(prefix._prefixlen > self.leastSpecificPrefixLen):
+            if(prefix.prefixlen > self.leastSpecificPrefixLen):
                 supernet = prefix.Supernet()
                 subnetDict[supernet].append(prefix)
         elif prefix.version == 6:
-            if(prefix._prefixlen > self.ipv6LeastSpecificPrefixLen):
+            if(prefix.prefixlen > self.ipv6LeastSpecificPrefixLen):
                 supernet = prefix.Supernet()
                 subnetDict[supernet].append(prefix)
     return subnetDict
@@ -601,6 +1485,7 @@ class SimpleBalancer:
 
   def splitPrefix(self,prefix):
     """takes a prefix and splits it into 2 subnets that by increasing masklen by 1 bit"""
+    prefix = Prefix.fromNetwork(prefix)
     if(prefix.version == 4):
         self.logger.debug("Most Specific: " + str(self.mostSpecificPrefixLen))
         if(prefix.prefixlen <= int(self.mostSpecificPrefixLen) - 1):
@@ -617,6 +1502,7 @@ class SimpleBalancer:
 
   def splitPrefixForSensors(self,prefix,numSensors):
     """splits a prefix into subnets for balancing across, it will go up to the power of 2 value that contains numSensors"""
+    prefix = Prefix.fromNetwork(prefix)
     x = 0
     subnetCount = 2**x
     while(subnetCount < numSensors):
@@ -632,8 +1518,17 @@ class SimpleBalancer:
               sensors[sensor] = self.groups[group]['sensors'][sensor]['load']
       return sensors
 
+  def getSensorLoadDetails(self, sensor):
+      """returns the sensor's last load, when it was reported and if it is stale, None if unknown"""
+      for group in self.groups:
+          if(self.groups[group]['sensors'].has_key(sensor)):
+              info = self.groups[group]['sensors'][sensor]
+              return {'load': info['load'],
+                      'timestamp': info.get('loadTime'),
+                      'stale': not self._sensorLoadFresh(info, time.time())}
+
   def getPrefixBW(self, prefix):
-      return self.prefixBW[prefix]
+      return self.prefixBW[Prefix.fromNetwork(prefix)]
 
   def getPrefixes(self):
     """returns the set of prefixes and their current load"""
@@ -641,11 +1536,7 @@ class SimpleBalancer:
 
   def getPrefixGroup(self,targetPrefix):
     """returns the sensor the prefix is currently assigned to"""
-    for group in self.groups:
-        for prefix in self.groups[group]['prefixes']:
-            if(prefix == targetPrefix):
-                return group
-    return None
+    return self.prefixIndex.get(targetPrefix)
 
   def getLargestPrefix(self,group):
     """returns the largest prefix assigned to the sensor"""
@@ -653,29 +1544,24 @@ class SimpleBalancer:
         best_len = 128;
         largestPrefix = None;
         for prefix in self.groups[group]['prefixes']:
-            if (prefix._prefixlen < best_len):
+            if (prefix.prefixlen < best_len):
                 largestPrefix = prefix
                 
         return largestPrefix;
     return None
 
   def getGroupBW(self,group):
-      totalBW = 0
-      for prefix in list(self.groups[group]['prefixes']):
-          totalBW    = totalBW    +  self.prefixBW[prefix]
-      return totalBW
+      return self.groups[group]['bandwidth']
 
   def getEstLoad(self,group,targetPrefix):
     """returns the estimated load impact for the specified prefix on the specified sensor"""
     #--- calculate the total address space the sensor has 
-    totalHosts 		= 0;
-    totalBW		= 0; 
+    totalHosts 		= self.groups[group]['hosts'];
+    totalBW		= self.groups[group]['bandwidth']; 
     percentTotal	= 0;
 
+    targetPrefix = Prefix.fromNetwork(targetPrefix)
     self.logger.debug("getEstLoad: "+str(group)+" "+str(targetPrefix))
-    for prefix in self.groups[group]['prefixes']:
-      totalHosts = totalHosts +  prefix.numhosts
-      totalBW    = totalBW    +  self.prefixBW[prefix]
 
     self.logger.debug("Total BW for group = %s" % totalBW)
 
@@ -695,7 +1581,7 @@ class SimpleBalancer:
   
       if(self.ignoreSensorLoad == 0):
         #-- use sensor load to esitmate prefix laod
-        return self.getGroupLoad(group) * percentTotal
+        return (self.getGroupLoad(group) or 0) * percentTotal
       else:
         return percentTotal
 
@@ -703,6 +1589,8 @@ class SimpleBalancer:
   # when merged, bw is less than configurable threshold
   # deletes the two prefixes and adds the candidate prefix
   def merge(self):
+      if(self.mergeMode == "subtree"):
+          return self.mergeSubtrees()
       self.logger.debug("Balance By Merge")
       subnetDict = self.mergeContiguousPrefixes(self.prefix_list)
       
@@ -733,7 +1621,7 @@ class SimpleBalancer:
 
                   if(not self.getGroupStatus(group)): continue
 
-                  load = self.getGroupLoad(group)
+                  load = self._placementLoad(group)
 
                   if(load < minLoad):
                       minLoad = load
@@ -752,30 +1640,128 @@ class SimpleBalancer:
               else:
                   return
 
+              if(not self._permitAction("merge", candidatePrefix, prefix_list)):
+                  return
+
               #delete the prefixes
               self.logger.error("Merging Prefixes " + str(prefix_a) + ", " + str(prefix_b))
+              priority_a = self.getPrefixPriority(prefix_a)
+              priority_b = self.getPrefixPriority(prefix_b)
               
               self.delGroupPrefix(group_a,prefix_a)
               self.delGroupPrefix(group_b,prefix_b)
               
+              #--- the merged prefix takes back the priorities its halves were carved from
+              self._setPrefixPriority(candidatePrefix, {'priority': min(priority_a['priority'], priority_b['priority']),
+                                                        'total': priority_a['total'] + priority_b['total']})
               #add the candidate prefix to min sesnor with aggBW
               self.logger.info("Adding Prefix : " + str(candidatePrefix) + " to " + str(minSensor) + " with bw " + str(aggBW) + "Mbps")
               try:
                   aggBW = aggBW*1000*1000
-                  self.addGroupPrefix(minSensor, candidatePrefix, aggBW)
+                  if(self.addGroupPrefix(minSensor, candidatePrefix, aggBW)):
+                      return
               except DuplicatePrefixError:
                   self.logger.debug("Already have prefix: " + str(candidatePrefix))
-                  self.addGroupPrefix(group_a, prefix_a, bw1)
-                  self.addGroupPrefix(group_b, prefix_b, bw2)
-                  return
               except MaxFlowCountError:
                   self.logger.debug("Max Flow Count Error")
-                  self.addGroupPrefix(group_a, prefix_a, bw1)
-                  self.addGroupPrefix(group_b, prefix_b, bw2)
-                  return
+              self._delPrefixPriority(candidatePrefix)
+              self._setPrefixPriority(prefix_a, priority_a)
+              self._setPrefixPriority(prefix_b, priority_b)
+              self.addGroupPrefix(group_a, prefix_a, bw1)
+              self.addGroupPrefix(group_b, prefix_b, bw2)
               return
 
 
+  def _mergeTarget(self):
+      """returns the active group with the least load to place a merged prefix on"""
+      target = None
+      targetLoad = None
+      for group in sorted(self.groups):
+          if(not self.getGroupStatus(group)): continue
+          if(self.ignoreSensorLoad):
+              load = self.groups[group]['bandwidth']
+          else:
+              load = self._placementLoad(group)
+          if(target is None or load < targetLoad):
+              target = group
+              targetLoad = load
+      return target
+
+  def _mergeInto(self, candidatePrefix, prefixes):
+      """replaces prefixes with candidatePrefix on the best group, returns 1 on success"""
+      groups = {}
+      priorities = {}
+      bws = {}
+      aggBW = 0
+      for prefix in prefixes:
+          groups[prefix] = self.getPrefixGroup(prefix)
+          priorities[prefix] = self.getPrefixPriority(prefix)
+          bws[prefix] = self.prefixBW[prefix]
+          aggBW += bws[prefix]
+
+      for prefix in prefixes:
+          self.delGroupPrefix(groups[prefix], prefix)
+
+      #--- the merged prefix takes back the priority block its parts were carved from
+      self._setPrefixPriority(candidatePrefix, {'priority': min([priorities[p]['priority'] for p in prefixes]),
+                                                'total': sum([priorities[p]['total'] for p in prefixes])})
+      target = self._mergeTarget()
+      try:
+          if(self.addGroupPrefix(target, candidatePrefix, aggBW)):
+              self.logger.info("Merged %d prefixes into %s on group %s with bw %s Mbps",
+                               len(prefixes), str(candidatePrefix), str(target), str(aggBW / 1000 / 1000))
+              return 1
+      except DuplicatePrefixError:
+          self.logger.debug("Already have prefix: " + str(candidatePrefix))
+
+      #--- put everything back the way it was
+      self._delPrefixPriority(candidatePrefix)
+      for prefix in prefixes:
+          self._setPrefixPriority(prefix, priorities[prefix])
+          self.addGroupPrefix(groups[prefix], prefix, bws[prefix])
+      return 0
+
+  def mergeSubtrees(self):
+      """merges every subtree whose prefixes together carry less than the configurable threshold
+
+      works bottom up from the most specific prefixes so a subtree that was
+      split several times collapses in a single pass, stops at the least
+      specific prefix length. returns the number of merged prefixes added
+      """
+      self.logger.debug("Balance By Subtree Merge")
+      threshold = self.sensorConfigurableThreshold * 1000 * 1000
+
+      #--- every node covers its address space exactly with the prefixes in members
+      members = {}
+      nodeBW = {}
+      levels = defaultdict(list)
+      for prefix in self.prefix_list:
+          if(self.getPrefixGroup(prefix) is None): continue
+          members[prefix] = [prefix]
+          nodeBW[prefix] = self.prefixBW[prefix]
+          levels[(prefix.version, prefix.prefixlen)].append(prefix)
+
+      for version, leastSpecific in ((4, self.leastSpecificPrefixLen), (6, self.ipv6LeastSpecificPrefixLen)):
+          for prefixlen in xrange(ADDRESS_BITS[version], leastSpecific, -1):
+              for prefix in levels.get((version, prefixlen), []):
+                  if(prefix not in members): continue
+                  candidatePrefix = prefix.Supernet()
+                  low, high = candidatePrefix.Subnet()
+                  if(low not in members or high not in members): continue
+                  if(nodeBW[low] + nodeBW[high] >= threshold): continue
+                  members[candidatePrefix] = members.pop(low) + members.pop(high)
+                  nodeBW[candidatePrefix] = nodeBW.pop(low) + nodeBW.pop(high)
+                  levels[(version, prefixlen - 1)].append(candidatePrefix)
+
+      merged = 0
+      for candidatePrefix in sorted(members):
+          prefixes = members[candidatePrefix]
+          if(len(prefixes) < 2): continue
+          if(not self._permitAction("merge", candidatePrefix, prefixes)):
+              continue
+          merged += self._mergeInto(candidatePrefix, prefixes)
+      return merged
+
   def balanceByIP(self):
     """method to balance based soly on IP space"""
      #--- calc load based on routable address space
@@ -790,10 +1776,9 @@ class SimpleBalancer:
       # don't include disabled sensors
       if(not self.getGroupStatus(group)): continue
 
-      for prefix in self.groups[group]['prefixes']:
-          totalSpace = totalSpace + prefix.numhosts
-          self.logger.debug( "group "+str(group)+" prefix "+str(prefix)+" space = "+str(prefix.numhosts))
-          groupSpace[group] = groupSpace[group] + prefix.numhosts
+      totalSpace = totalSpace + self.groups[group]['hosts']
+      self.logger.debug( "group "+str(group)+" space = "+str(self.groups[group]['hosts']))
+      groupSpace[group] = groupSpace[group] + self.groups[group]['hosts']
 
     for group in self.groups:
       if(not self.getGroupStatus(group)): continue
@@ -841,19 +1826,19 @@ class SimpleBalancer:
               return
 
 
+  def _moveGain(self, maxLoad, minLoad, prefixLoad, maxWeight=1, minWeight=1):
+      """how much moving prefixLoad from the max to the min group narrows their load delta
+
+      the weights are the groups' relative capacities, the same traffic is
+      a bigger share of a smaller group
+      """
+      return (maxLoad - minLoad) - abs((maxLoad - prefixLoad / maxWeight) - (minLoad + prefixLoad / minWeight))
+
   def _calcGroupBW(self):
-      #figure out total BW and group BW
-      for group in self.groups:
-          self.logger.debug("Group: " + str(group))
-          self.logger.debug("Group Prefixes: {0}".format(self.groups[group]['prefixes']))
-          groupBW = float(0)
-          for prefix in self.groups[group]['prefixes']:
-              #--- figure out total amount of traffic going over each sensor
-              self.logger.debug("Prefix: " + str(prefix) + " BW: " + str((self.prefixBW[prefix]/1000/1000)) + "Mbps")
-              groupBW += self.prefixBW[prefix]
-          self.groups[group]['bandwidth'] =  groupBW
-          #self.logger.debug("Group %s has bandwidth: %d" % str(group),float(groupBW))
-      
+      #group bandwidth is kept up to date as prefixes change
+      #in debug mode verify it against a full recompute
+      if(self.debugAggregates):
+          self._checkGroupAggregates()
       return
 
   #so here is our algorithm
@@ -881,10 +1866,11 @@ class SimpleBalancer:
         self.logger.error("Total Bandwidth: 0bps, not balancing")
         return
 
-    for group in self.groups:
-        if group in ignored_groups: continue
-        if not self.getGroupStatus(group): continue
-        self.groups[group]['load'] = self.groups[group]['bandwidth'] / totalBW
+    #--- load is the group's share of the traffic over its share of the capacity
+    weights = self._capacityWeights([group for group in self.groups
+                                     if group not in ignored_groups and self.getGroupStatus(group)])
+    for group in weights:
+        self.groups[group]['load'] = self.groups[group]['bandwidth'] / totalBW / weights[group]
 
     #sort the groups by their bandwidth
     sortedLoadGroups = sorted(self.groups.items(),key=lambda (k,v): v['load'] ,reverse=True)
@@ -907,11 +1893,11 @@ class SimpleBalancer:
     self.logger.error("load delta = "+str(loadDelta)+" max " + str(maxGroup) + " min " + str(minGroup))
     
     if(  self.groups[maxGroup]['load'] >= self.sensorLoadMinThreshold ):
-        if(loadDelta >= self.sensorLoadDeltaThreshold):
+        if(self._deltaExceeded(loadDelta)):
             #base condition
             #if our biggest loaded sensor has 1 prefix at max-len do this again without that sensor
             #essentially say there is nothing we can do with it, and check on the rest of the sensors
-            if len(self.groups[maxGroup]['prefixes']) == 1 and self.groups[maxGroup]['prefixes'][0].prefixlen > int(self.mostSpecificPrefixLen) - 1:
+            if len(self.groups[maxGroup]['prefixes']) == 1 and next(iter(self.groups[maxGroup]['prefixes'])).prefixlen > int(self.mostSpecificPrefixLen) - 1:
                 ignored_groups.append(maxGroup)
                 #it is possible that besides this one host (or X hosts) that everything is as balanced as we can get it
                 self.balanceByNetBytes(ignored_groups)
@@ -919,23 +1905,35 @@ class SimpleBalancer:
   
             #move a prefix
             
-            tmpDict = defaultdict(float)
-            for prefix in self.groups[maxGroup]['prefixes']:
-                tmpDict[prefix] = self.prefixBW[prefix]
-            
-            sortedPrefixes = sorted(tmpDict,key=tmpDict.get,reverse=True)
+            if(self.vectorizeState):
+                sortedPrefixes = self.prefixBW.groupPrefixes(maxGroup)
+            else:
+                tmpDict = defaultdict(float)
+                for prefix in self.groups[maxGroup]['prefixes']:
+                    tmpDict[prefix] = self.prefixBW[prefix]
+                sortedPrefixes = sorted(tmpDict,key=tmpDict.get,reverse=True)
+            if(self.flowModBudget > 0):
+                #--- with a budget, try the moves that improve the balance most per flow-mod first
+                maxLoad = self.groups[maxGroup]['load']
+                minLoad = self.groups[minGroup]['load']
+                sortedPrefixes.sort(key=lambda p: self._moveGain(maxLoad, minLoad, self.prefixBW[p] / totalBW,
+                                                                 weights[maxGroup], weights[minGroup]) / max(1, self.getActionCost("move", p)),
+                                    reverse=True)
 
     
             moved = False
             for prefix in sortedPrefixes:
                 estPrefixLoad = self.prefixBW[prefix] / totalBW
-                estNewGroupLoad = estPrefixLoad + self.groups[minGroup]['load']
-                if(estNewGroupLoad <= 1 and estNewGroupLoad < (self.groups[maxGroup]['load'] - estPrefixLoad)):
+                estNewGroupLoad = estPrefixLoad / weights[minGroup] + self.groups[minGroup]['load']
+                estOldGroupLoad = self.groups[maxGroup]['load'] - estPrefixLoad / weights[maxGroup]
+                if(estNewGroupLoad <= 1 / weights[minGroup] and estNewGroupLoad < estOldGroupLoad):
+                    if(not self._permitAction("move", prefix)):
+                        continue
                     self.moveGroupPrefix(maxGroup, minGroup, prefix)
                     sortedPrefixes.remove(prefix)
                     self.logger.info("Moved Prefix %s from group %s to group %s",str(prefix), str(maxGroup), str(minGroup))
-                    self.groups[maxGroup]['load'] = self.groups[maxGroup]['load'] - estPrefixLoad
-                    self.groups[minGroup]['load'] = self.groups[minGroup]['load'] + estPrefixLoad
+                    self.groups[maxGroup]['load'] = estOldGroupLoad
+                    self.groups[minGroup]['load'] = estNewGroupLoad
                     moved = True
                 else:
                     self.logger.debug("Could not move prefix %s from group %s to group %s because new load %f vs %f and prefix load=%f",
@@ -958,6 +1956,111 @@ class SimpleBalancer:
         self.logger.warn("below sensorLoadMinThreshold") 
  
 
+  def _planAssignment(self, groups, prefixes, slack, weights=None):
+    """plans which group every prefix should be on, largest prefixes first
+
+    prefixes is a list of (prefix, bw, group) tuples. A prefix stays on its
+    current group while that group is within slack of its fair share, otherwise
+    it goes to the group with the least bandwidth assigned so far for its
+    capacity weight. Prefixes bigger than every fair share stay where they are
+    and are returned to be split.
+    """
+    if(weights is None):
+        weights = dict((group, 1.0) for group in groups)
+    totalBW = 0.0
+    for prefix, bw, group in prefixes:
+        totalBW += bw
+    limits = {}
+    for group in groups:
+        limits[group] = totalBW * weights[group] / len(groups) + slack
+
+    assigned = {}
+    for group in groups:
+        assigned[group] = 0.0
+
+    plan = {}
+    oversized = []
+    for prefix, bw, group in sorted(prefixes, key=lambda p: p[1], reverse=True):
+        if(bw > max(limits.values())):
+            target = group
+            oversized.append(prefix)
+        elif(assigned[group] + bw <= limits[group]):
+            target = group
+        else:
+            target = min(groups, key=lambda g: ((assigned[g] + bw) / weights[g], g != group))
+        assigned[target] += bw
+        plan[prefix] = target
+
+    return plan, oversized
+
+  def balanceGlobal(self):
+    """Balance by network traffic, planning the prefixes of every active group at once"""
+
+    self._calcGroupBW()
+
+    groups = sorted([group for group in self.groups if self.getGroupStatus(group)])
+    if(len(groups) < 2):
+        return
+
+    totalBW = 0
+    for group in groups:
+        totalBW += self.groups[group]['bandwidth']
+
+    if(totalBW <= 0):
+        self.logger.error("Total Bandwidth: 0bps, not balancing")
+        return
+
+    weights = self._capacityWeights(groups)
+    for group in groups:
+        self.groups[group]['load'] = self.groups[group]['bandwidth'] / totalBW / weights[group]
+
+    maxGroup = max(groups, key=lambda g: self.groups[g]['load'])
+    minGroup = min(groups, key=lambda g: self.groups[g]['load'])
+    loadDelta = self.groups[maxGroup]['load'] - self.groups[minGroup]['load']
+    self.logger.debug("load delta = "+str(loadDelta)+" max " + str(maxGroup) + " min " + str(minGroup))
+
+    if(self.groups[maxGroup]['load'] < self.sensorLoadMinThreshold):
+        self.logger.warn("below sensorLoadMinThreshold")
+        return
+
+    if(not self._deltaExceeded(loadDelta)):
+        self.logger.warn("below load Delta Threshold")
+        return
+
+    prefixes = []
+    for group in groups:
+        for prefix in self.groups[group]['prefixes']:
+            prefixes.append((prefix, self.prefixBW[prefix], group))
+
+    #--- allow each group half the delta threshold over its fair share before moving anything
+    plan, oversized = self._planAssignment(groups, prefixes, totalBW * self.sensorLoadDeltaThreshold / 2, weights)
+
+    moves = [(prefix, bw, group) for prefix, bw, group in prefixes if plan[prefix] != group]
+    if(self.flowModBudget > 0):
+        #--- most bandwidth shifted per flow-mod first, whatever does not fit waits for the next cycle
+        moves.sort(key=lambda m: m[1] / max(1, self.getActionCost("move", m[0])), reverse=True)
+
+    moved = 0
+    for prefix, bw, group in moves:
+        if(not self._permitAction("move", prefix)):
+            continue
+        self.moveGroupPrefix(group, plan[prefix], prefix)
+        moved += 1
+
+    split = 0
+    for prefix in oversized:
+        if(self.splitSensorPrefix(plan[prefix], prefix, check=True)):
+            split += 1
+
+    if(moved == 0 and split == 0):
+        self.merge()
+
+    for group in groups:
+        self.groups[group]['load'] = self.groups[group]['bandwidth'] / totalBW / weights[group]
+
+    self.logger.info("Global balance moved %d prefixes and split %d", moved, split)
+    return moved + split
+
   def balance(self):
       """evaluate sensor load and come up with better balance if possible"""
       """multistep process, spread across time, considers sensor with min and max load"""
@@ -966,6 +2069,9 @@ class SimpleBalancer:
       
       maxLoad         = 0    
       maxSensor       = ""
+
+      #--- the flow-mod budget is per balance cycle
+      self.flowModsUsed = 0
       
       #both sensor load and bandwidth are disabled
       #just balance by total hosts
@@ -974,6 +2080,8 @@ class SimpleBalancer:
 
       #balance by network traffic
       if(self.ignoreSensorLoad):
+          if(self.balanceMode == "global"):
+              return self.balanceGlobal()
           return self.balanceByNetBytes([])
 
       prefixBW = self.prefixBW
@@ -985,7 +2093,10 @@ class SimpleBalancer:
               # don't include disabled sensors
               if(not self.getGroupStatus(group)): continue
 
-              load = self.getGroupLoad(group)
+              load = self.getGroupLoadEstimate(group)
+              if(load is None):
+                  self.logger.debug("no current load for group %s, leaving it out", str(group))
+                  continue
               
               if(load > maxLoad):
                   maxLoad = load
@@ -1002,37 +2113,33 @@ class SimpleBalancer:
           self.logger.debug("load delta = "+str(loadDelta))
 
           if(self.ignoreSensorLoad > 0 or maxLoad >= self.sensorLoadMinThreshold ):
-              if(loadDelta >= self.sensorLoadDeltaThreshold):
+              if(self._deltaExceeded(loadDelta)):
                   #-- a sensor is above balance threshold and the delta is large enough to consider balancing
                   #--- get the prefix with largest esitmated load from maxSensor
                   candidatePrefix = self.getLargestPrefix(maxSensor)
 
                   if(candidatePrefix == None):
-                      self.logger.error( "sensor "+maxSensor+" has no prefixes but claimes to have highest load?")
+                      self.logger.error( "sensor "+str(maxSensor)+" has no prefixes but claimes to have highest load?")
                       return 0;
 
                   estPreLoad = self.getEstLoad(maxSensor,candidatePrefix)
+                  #--- the same traffic is a bigger share of a smaller group
+                  weights = self._capacityWeights([maxSensor, minSensor])
+                  estPreLoad = estPreLoad * weights[maxSensor] / weights[minSensor]
                   estNewSensorLoad = estPreLoad+minLoad;
 
                   #--- check if it will fit on minSensor and if the new sensor will have less load than max sensor 
                   if(estPreLoad <  (1 - minLoad) and estNewSensorLoad < maxLoad):
                       #--- if it will fit, move it to minsensor
-                      self.moveGroupPrefix(maxSensor,minSensor,candidatePrefix)
+                      if(self._permitAction("move", candidatePrefix)):
+                          self.moveGroupPrefix(maxSensor,minSensor,candidatePrefix)
 
                   else:
                   #--- will not fit, split, then leave on original sensor and retry later after
                   #--- better statistics are gathered 
                       self.logger.debug("-- need to split candidate and try again later after load measures");
-                      try:
-                          subnets = self.splitPrefix(candidatePrefix);
-                          for prefix in subnets:
-                              self.addGroupPrefix(maxSensor,prefix)
-                              
-                          self.delGroupPrefix(maxSensor,candidatePrefix)
-                      except MaxPrefixlenError as e:
-                          self.logger.warn( "at max prefix length limit" )
-                      except MaxFlowCountError:
-                          self.logger.warn("Max Flow Count is reached")
+                      #--- the subnets overlap the candidate, so it has to come out before they go in
+                      self.splitSensorPrefix(maxSensor, candidatePrefix)
               else:
                   self.logger.warn("below load Delta Threshold")
 
@@ -0,0 +1,93 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times a balance cycle with the dict and the array backed balancer state
+
+run from the python directory:  python bench/CycleBench.py [--sizes 1000,10000,100000]
+"""
+import sys
+sys.path.append(".")
+import time
+import random
+import logging
+import argparse
+from collections import defaultdict
+from SimpleBalancer import SimpleBalancer
+from Prefix import Prefix
+import PrefixTable
+
+GROUPS = 8
+
+
+def build(size, vectorize):
+  """returns a balancer holding size /26 prefixes spread unevenly over the groups"""
+  logger = logging.getLogger("bench")
+  logger.setLevel(logging.CRITICAL)
+  balancer = SimpleBalancer(ignoreSensorLoad = 1,
+                            ignorePrefixBW = 0,
+                            maxPrefixes = size * 4,
+                            debugAggregates = 1,
+                            vectorizeState = vectorize,
+                            logger = logger)
+  for group_id in range(1, GROUPS + 1):
+    sensors = defaultdict(list)
+    sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "bench"}
+    balancer.addSensorGroup({"group_id": group_id, "bw": "10GE", "admin_status": "active",
+                             "description": "bench", "sensors": sensors})
+  #--- the /26s are subnets of one configured /8 and share its priority block
+  balancer._setPrefixPriority(Prefix.fromNetwork("10.0.0.0/8"),
+                              {'priority': balancer._allocatePriority(), 'total': 100})
+  rand = random.Random(size)
+  base = Prefix.fromNetwork("10.0.0.0/8").network
+  for i in xrange(size):
+    prefix = Prefix(4, base + (i << 6), 26)
+    #--- half of everything starts on the first group
+    group = 1 if i % 2 == 0 else rand.randint(1, GROUPS)
+    balancer.addGroupPrefix(group, prefix, 0)
+    balancer.setPrefixBW(prefix, rand.paretovariate(1.2) * 1000, 0)
+  return balancer
+
+def timeCycles(balancer, cycles):
+  """returns the mean seconds of an aggregate check and of a balance cycle"""
+  start = time.time()
+  for i in range(cycles):
+    balancer._checkGroupAggregates()
+  check = (time.time() - start) / cycles
+  start = time.time()
+  for i in range(cycles):
+    balancer.balance()
+  cycle = (time.time() - start) / cycles
+  return check, cycle
+
+def main():
+  parser = argparse.ArgumentParser(description = "balance cycle benchmark")
+  parser.add_argument("--sizes", default = "1000,10000,100000")
+  parser.add_argument("--cycles", type = int, default = 5)
+  args = parser.parse_args()
+
+  if(PrefixTable.numpy is None):
+    print "numpy not found, the array backed state uses the pure python fallback"
+  print "%10s %10s %12s %12s %12s" % ("prefixes", "state", "setup s", "check ms", "cycle ms")
+  for size in [int(s) for s in args.sizes.split(",")]:
+    for vectorize in [0, 1]:
+      start = time.time()
+      balancer = build(size, vectorize)
+      setup = time.time() - start
+      check, cycle = timeCycles(balancer, args.cycles)
+      print "%10d %10s %12.2f %12.3f %12.3f" % (size, "arrays" if vectorize else "dict",
+                                                setup, check * 1000, cycle * 1000)
+
+if __name__ == '__main__':
+  main()
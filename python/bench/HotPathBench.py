@@ -0,0 +1,338 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmarks of the controller's per event hot paths
+
+Times SciPass, Ryu and SimpleBalancer entry points against stand in
+datapath, parser and ofproto objects, so no switch is needed. The Ryu
+benchmarks are skipped when ryu can not be imported.
+
+run from the python directory:
+  python bench/HotPathBench.py --output results.json
+  python bench/HotPathBench.py --baseline results.json --tolerance .25
+"""
+import sys
+sys.path.append(".")
+import os
+import json
+import time
+import logging
+import argparse
+import platform
+from collections import defaultdict
+from SciPass import SciPass
+from SimpleBalancer import SimpleBalancer
+from Prefix import Prefix
+
+try:
+  import Ryu
+except ImportError as e:
+  Ryu = None
+  RYU_ERROR = str(e)
+
+DPID = "%016x" % 1
+
+
+class FakeDatapath:
+  def __init__(self, ofproto, parser):
+    self.id             = 1
+    self.is_active      = True
+    self.ofproto        = ofproto
+    self.ofproto_parser = parser
+
+  def send_msg(self, msg):
+    pass
+
+
+class FakeOFProto:
+  """the constants the flow builders read from ofproto"""
+  def __init__(self, version):
+    self.OFP_VERSION          = version
+    self.OFPFC_ADD            = 0
+    self.OFPFC_DELETE         = 3
+    self.OFPFC_DELETE_STRICT  = 4
+    self.OFPFF_SEND_FLOW_REM  = 1
+    self.OFPIT_APPLY_ACTIONS  = 4
+    self.OFP_NO_BUFFER        = 0xffffffff
+    self.OFPP_ANY             = 0xffffffff
+    self.OFPP_NONE            = 0xffff
+    self.OFPG_ANY             = 0xffffffff
+
+
+class FakeParser:
+  """builds plain tuples instead of OpenFlow messages"""
+  def OFPMatch(self, **kwargs):
+    return kwargs
+
+  def OFPActionOutput(self, port, max_len = 0):
+    return ("output", port)
+
+  def OFPInstructionActions(self, kind, actions):
+    return (kind, actions)
+
+  def OFPFlowMod(self, **kwargs):
+    return kwargs
+
+
+class FakeMatch(object):
+  """an OF 1.3 match as processStat reads it"""
+  def __init__(self, **fields):
+    self._fields2 = fields.items()
+    self.fields   = fields
+
+  def __contains__(self, key):
+    return key in self.fields
+
+  def __getitem__(self, key):
+    return self.fields[key]
+
+
+class FakeStat:
+  def __init__(self, match, priority, byte_count, packet_count):
+    self.match        = match
+    self.priority     = priority
+    self.byte_count   = byte_count
+    self.packet_count = packet_count
+    self.duration_sec = 5
+
+
+def quietLogger():
+  logger = logging.getLogger("bench")
+  logger.setLevel(logging.CRITICAL)
+  return logger
+
+def newApi(config):
+  """returns a SciPass with its switch joined and flow-mods discarded"""
+  api = SciPass(logger = quietLogger(), config = config)
+  api.registerForwardingStateChangeHandler(lambda **kwargs: None)
+  api.switchJoined(FakeDatapath(None, None))
+  return api
+
+def newRyu(api):
+  """returns a Ryu app around api without starting its threads or REST server"""
+  app = Ryu.Ryu.__new__(Ryu.Ryu)
+  app.logger        = quietLogger()
+  app.api           = api
+  app.datapaths     = {}
+  app.prefix_bytes  = defaultdict(lambda: defaultdict(dict))
+  app.lastStatsTime = {}
+  return app
+
+def ofStats(count):
+  """count OF 1.3 per prefix counters, half tx and half rx"""
+  stats = []
+  base = Prefix.fromNetwork("10.0.0.0/8").network
+  for i in xrange(count / 2):
+    net = Prefix(4, base + (i << 8), 24)
+    addr = (str(net).split("/")[0], "255.255.255.0")
+    stats.append(FakeStat(FakeMatch(eth_type = 0x800, ipv4_src = addr), 500, 1000 * i, 10 * i))
+    stats.append(FakeStat(FakeMatch(eth_type = 0x800, ipv4_dst = addr), 500, 2000 * i, 20 * i))
+  return stats
+
+def flowHeader(i):
+  return {"nw_src": "10.0.20.%d/32" % (i % 250 + 1), "nw_dst": "156.56.6.1/32",
+          "tp_src": 1024 + i, "tp_dst": 80}
+
+
+#--- each benchmark sets up and returns (number of operations, function timed once per run)
+def benchGoodFlow(args):
+  api = newApi(args.config)
+  def setup():
+    api.whiteList.clear()
+  def run():
+    for i in xrange(args.flows):
+      api.good_flow(flowHeader(i))
+  return args.flows, run, setup
+
+def benchBadFlow(args):
+  api = newApi(args.config)
+  def setup():
+    api.blackList.clear()
+  def run():
+    for i in xrange(args.flows):
+      api.bad_flow(flowHeader(i))
+  return args.flows, run, setup
+
+def benchTimeoutFlows(args):
+  api = newApi(args.config)
+  for i in xrange(args.flows):
+    api.pushTimeouts({"timeout": time.time() + 3600, "dpid": DPID, "domain": "R&E",
+                      "idle_timeout": 3600, "pkt_count": 0, "header": flowHeader(i),
+                      "actions": [], "priority": 65535, "command": "ADD"}, None)
+  #--- every flow is still passing packets, so nothing times out and the full scan is timed
+  flows = [{"match": flowHeader(i), "packet_count": i + 1, "priority": 65535} for i in xrange(args.flows)]
+  def run():
+    api.TimeoutFlows(DPID, flows)
+  return 1, run
+
+def benchRemoveFlow(args):
+  api = newApi(args.config)
+  def setup():
+    api.whiteList.clear()
+    api.config[DPID]["R&E"]['flows'].clear()
+    for i in xrange(args.flows):
+      header = flowHeader(i)
+      api.whiteList.add(DPID, "R&E", header, 65535, {"header": header, "priority": 65535})
+      api.pushFlows(DPID, "R&E", header, [], 65535)
+  def run():
+    for i in xrange(args.flows - 1, -1, -1):
+      api.remove_flow(DPID, "R&E", flowHeader(i), 65535)
+  return args.flows, run, setup
+
+def benchProcessStat(args):
+  app = newRyu(newApi(args.config))
+  stats = ofStats(args.stats)
+  def run():
+    for stat in stats:
+      app.processStat(stat)
+  return len(stats), run
+
+def benchFlowMod(version, args):
+  app = newRyu(newApi(args.config))
+  dp = FakeDatapath(FakeOFProto(version), FakeParser())
+  if(version == Ryu.ofproto_v1_3.OFP_VERSION):
+    build = app.OF13_flow
+  else:
+    build = app.OF10_flow
+  actions = [{"type": "output", "port": "2"}]
+  headers = [{"nw_src": Prefix.fromNetwork("10.0.20.%d/32" % (i % 250 + 1)).toNetwork(),
+              "nw_dst": Prefix.fromNetwork("156.56.6.0/24").toNetwork(), "tp_src": 1024 + i}
+             for i in xrange(args.flows)]
+  def setup():
+    app.api.config[DPID]["R&E"]['flows'].clear()
+    app.api.idleTimeouts.clear()
+  def run():
+    for header in headers:
+      build(dp, domain = "R&E", header = dict(header), actions = actions, command = "ADD",
+            idle_timeout = 90, hard_timeout = 0, priority = 500)
+  return args.flows, run, setup
+
+def benchFlowStats13(args):
+  app = newRyu(newApi(args.config))
+  dp = FakeDatapath(FakeOFProto(Ryu.ofproto_v1_3.OFP_VERSION), FakeParser())
+  stats = ofStats(args.stats)
+  #--- a first reply so the timed ones compute rates
+  app.process_flow_stats_of13(stats, dp)
+  def run():
+    for stat in stats:
+      stat.byte_count += 1000
+      stat.packet_count += 10
+    app.lastStatsTime[dp.id] -= 5
+    app.process_flow_stats_of13(stats, dp)
+  return 1, run
+
+def benchAddGroupPrefix(args):
+  state = {}
+  def setup():
+    balancer = SimpleBalancer(maxPrefixes = args.prefixes * 2, logger = quietLogger())
+    for group_id in range(1, 9):
+      balancer.addSensorGroup({"group_id": group_id, "bw": "10GE", "admin_status": "active",
+                               "description": "bench", "sensors": {}})
+    #--- the /26s are subnets of one configured /8 and share its priority block
+    balancer._setPrefixPriority(Prefix.fromNetwork("10.0.0.0/8"),
+                                {'priority': balancer._allocatePriority(), 'total': 100})
+    state['balancer'] = balancer
+  base = Prefix.fromNetwork("10.0.0.0/8").network
+  prefixes = [Prefix(4, base + (i << 6), 26) for i in xrange(args.prefixes)]
+  def run():
+    balancer = state['balancer']
+    for i, prefix in enumerate(prefixes):
+      balancer.addGroupPrefix(i % 8 + 1, prefix, 0)
+  return args.prefixes, run, setup
+
+BENCHMARKS = [("scipass.good_flow", benchGoodFlow, False),
+              ("scipass.bad_flow", benchBadFlow, False),
+              ("scipass.TimeoutFlows", benchTimeoutFlows, False),
+              ("scipass.remove_flow", benchRemoveFlow, False),
+              ("ryu.processStat", benchProcessStat, True),
+              ("ryu.OF13_flow", lambda args: benchFlowMod(Ryu.ofproto_v1_3.OFP_VERSION, args), True),
+              ("ryu.OF10_flow", lambda args: benchFlowMod(Ryu.ofproto_v1_0.OFP_VERSION, args), True),
+              ("ryu.process_flow_stats_of13", benchFlowStats13, True),
+              ("balancer.addGroupPrefix", benchAddGroupPrefix, False)]
+
+
+def runBenchmark(bench, args):
+  """returns the best of args.repeat runs as {ops, seconds, us_per_op}"""
+  res = bench(args)
+  ops, run = res[0], res[1]
+  setup = res[2] if len(res) > 2 else None
+  best = None
+  for i in range(args.repeat):
+    if(setup is not None):
+      setup()
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    if(best is None or elapsed < best):
+      best = elapsed
+  return {"ops": ops, "seconds": best, "us_per_op": best * 1e6 / ops}
+
+def compare(results, baseline, tolerance):
+  """prints each benchmark against the baseline, returns the names that regressed"""
+  regressed = []
+  print "%-30s %14s %14s %8s" % ("benchmark", "baseline us", "current us", "ratio")
+  for name in sorted(results["results"]):
+    if(not baseline["results"].has_key(name)):
+      continue
+    old = baseline["results"][name]["us_per_op"]
+    new = results["results"][name]["us_per_op"]
+    ratio = new / old if old > 0 else 0
+    flag = ""
+    if(ratio > 1 + tolerance):
+      regressed.append(name)
+      flag = " REGRESSED"
+    print "%-30s %14.2f %14.2f %8.2f%s" % (name, old, new, ratio, flag)
+  return regressed
+
+def main():
+  parser = argparse.ArgumentParser(description = "controller hot path microbenchmarks")
+  parser.add_argument("--config", default = os.path.join(os.getcwd(), "t/etc/SciPass.xml"))
+  parser.add_argument("--flows", type = int, default = 1000, help = "flows for the good/bad/timeout/remove paths")
+  parser.add_argument("--stats", type = int, default = 10000, help = "entries in a flow stats reply")
+  parser.add_argument("--prefixes", type = int, default = 10000, help = "prefixes added to the balancer")
+  parser.add_argument("--repeat", type = int, default = 3)
+  parser.add_argument("--only", help = "comma separated benchmark names")
+  parser.add_argument("--output", help = "write the results to this json file")
+  parser.add_argument("--baseline", help = "compare against a json file written by --output")
+  parser.add_argument("--tolerance", type = float, default = .25, help = "allowed slowdown before failing")
+  args = parser.parse_args()
+
+  only = args.only.split(",") if args.only else None
+  results = {"python": platform.python_version(),
+             "time": time.time(),
+             "params": {"flows": args.flows, "stats": args.stats, "prefixes": args.prefixes},
+             "results": {},
+             "skipped": {}}
+  for name, bench, needsRyu in BENCHMARKS:
+    if(only is not None and name not in only):
+      continue
+    if(needsRyu and Ryu is None):
+      results["skipped"][name] = "ryu not importable: " + RYU_ERROR
+      continue
+    results["results"][name] = runBenchmark(bench, args)
+
+  if(args.output):
+    with open(args.output, "w") as out:
+      json.dump(results, out, indent = 2, sort_keys = True)
+  if(args.baseline):
+    with open(args.baseline) as data:
+      baseline = json.load(data)
+    if(compare(results, baseline, args.tolerance)):
+      sys.exit(1)
+  elif(not args.output):
+    print json.dumps(results, indent = 2, sort_keys = True)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,221 @@
+# Copyright (C) 2014 The Trustees of Indiana University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline balancer simulator
+
+Builds the balancer of one SciPass.xml domain, drives it with a synthetic
+traffic matrix and reports how quickly the groups converge, the max/min load
+gap over time, the flow-mods spent and the most rules installed at once.
+No switch is needed and nothing is written to /var/run.
+
+run from the python directory:
+  python bench/Simulator.py --config t/etc/SciPass_balancer_only.xml --matrix zipf
+"""
+import sys
+sys.path.append(".")
+import json
+import math
+import random
+import bisect
+import logging
+import argparse
+from SciPass import SciPass
+from Prefix import Prefix
+
+MATRICES = ["uniform", "zipf", "elephant", "diurnal"]
+
+
+class FlowModCounter:
+  """stands in for the switch, counting the flow-mods and rules the balancer asks for"""
+  def __init__(self, balancer):
+    self.balancer  = balancer
+    self.flowMods  = 0
+    self.rules     = 0
+    self.highWater = 0
+    self.prefixes  = 0
+
+  def add(self, group, prefix, priority):
+    count = self.balancer.getPrefixFlowMods(prefix)
+    self.flowMods += count
+    self.rules += count
+    self.prefixes += 1
+    self.highWater = max(self.highWater, self.rules)
+
+  def delete(self, group, prefix, priority):
+    count = self.balancer.getPrefixFlowMods(prefix)
+    self.flowMods += count
+    self.rules -= count
+    self.prefixes -= 1
+
+  def move(self, oldGroup, newGroup, prefix, priority):
+    #--- a move deletes and re-adds every rule of the prefix
+    self.flowMods += 2 * self.balancer.getPrefixFlowMods(prefix)
+
+
+class TrafficMatrix:
+  """per host rates inside the domain's LAN prefixes, summed per balancer prefix"""
+  def __init__(self, kind, prefixes, hosts, rate, period, seed):
+    self.kind   = kind
+    self.period = period
+    rand = random.Random(seed)
+    hostList = []
+    for index, prefix in enumerate(prefixes):
+      for i in xrange(max(1, hosts / len(prefixes))):
+        address = prefix.network + rand.randint(0, min(prefix.numhosts, 1 << 32) - 1)
+        #--- hosts of the same LAN prefix peak together in the diurnal matrix
+        hostList.append((prefix.version, address, index / float(len(prefixes))))
+    count = len(hostList)
+    if(kind == "zipf"):
+      ranks = range(1, count + 1)
+      rand.shuffle(ranks)
+      weights = [1.0 / (rank ** 1.1) for rank in ranks]
+    elif(kind == "elephant"):
+      #--- 2% of the hosts carry 80% of the traffic
+      elephants = max(1, count / 50)
+      weights = [1.0] * count
+      for i in rand.sample(xrange(count), elephants):
+        weights[i] = 4.0 * (count - elephants) / elephants
+    else:
+      weights = [1.0] * count
+    total = sum(weights)
+    self.hosts = {}
+    for (version, address, phase), weight in zip(hostList, weights):
+      self.hosts.setdefault(version, []).append((address, rate * weight / total, phase))
+    for version in self.hosts:
+      self.hosts[version].sort()
+
+  def rates(self, cycle):
+    """returns {version: (sorted addresses, cumulative rates)} for a cycle"""
+    res = {}
+    for version, hosts in self.hosts.items():
+      addresses = []
+      cumulative = [0.0]
+      for address, rate, phase in hosts:
+        if(self.kind == "diurnal"):
+          rate = rate * (1 + .8 * math.sin(2 * math.pi * (cycle / float(self.period) + phase)))
+        addresses.append(address)
+        cumulative.append(cumulative[-1] + rate)
+      res[version] = (addresses, cumulative)
+    return res
+
+  def prefixRate(self, rates, prefix):
+    """bits per second of the hosts inside prefix"""
+    if(not rates.has_key(prefix.version)):
+      return 0.0
+    addresses, cumulative = rates[prefix.version]
+    start = bisect.bisect_left(addresses, prefix.network)
+    end = bisect.bisect_right(addresses, prefix.broadcast)
+    return cumulative[end] - cumulative[start]
+
+
+def simulate(api, dpid, domainName, matrix, cycles, interval):
+  """runs the balancer for cycles stats intervals and returns the results"""
+  domain = api.config[dpid][domainName]
+  balancer = api.createBalancer(domain)
+  counter = FlowModCounter(balancer)
+  balancer.registerAddPrefixHandler(counter.add)
+  balancer.registerDelPrefixHandler(counter.delete)
+  balancer.registerMovePrefixHandler(counter.move)
+  balancer.registerFlowModCostHandler(lambda prefix: api.getPrefixFlowModCount(dpid = dpid,
+                                                                               domain_name = domainName,
+                                                                               prefix = prefix))
+  for group in domain['sensor_groups'].values():
+    balancer.addSensorGroup(group)
+  for port in domain['ports']['lan']:
+    for prefix in port['prefixes']:
+      balancer.addPrefix(prefix['prefix'])
+  balancer.pushToSwitch()
+
+  results = {"gaps": [], "flow_mods": [], "rules": [], "prefixes": []}
+  for cycle in xrange(cycles):
+    rates = matrix.rates(cycle)
+    prefixes = list(balancer.getPrefixes().keys()) + list(balancer.measurementParents.keys())
+    for prefix in prefixes:
+      byteRate = matrix.prefixRate(rates, prefix) / 8
+      balancer.setPrefixBW(prefix, byteRate / 2, byteRate / 2, interval = interval,
+                           packets = int(byteRate * interval / 1000))
+    groups = [group for group in balancer.groups if balancer.getGroupStatus(group)]
+    total = sum([balancer.getGroupBW(group) for group in groups])
+    shares = [balancer.getGroupBW(group) / total if total > 0 else 0.0 for group in groups]
+    if(not balancer.ignoreSensorLoad):
+      #--- no sensors to ask, so a group's load is its share of the traffic
+      for group, share in zip(groups, shares):
+        balancer.setSensorLoad(group, share)
+    results["gaps"].append(max(shares) - min(shares) if shares else 0.0)
+
+    before = counter.flowMods
+    balancer.balance()
+    results["flow_mods"].append(counter.flowMods - before)
+    results["rules"].append(counter.rules)
+    results["prefixes"].append(counter.prefixes)
+
+  #--- converged once the gap stays within the delta threshold for the rest of the run
+  converged = None
+  for cycle in xrange(cycles - 1, -1, -1):
+    if(results["gaps"][cycle] > balancer.sensorLoadDeltaThreshold):
+      break
+    converged = cycle
+  results["converged_cycle"] = converged
+  results["converged_seconds"] = None if converged is None else converged * interval
+  results["max_gap"] = max(results["gaps"]) if results["gaps"] else 0.0
+  results["final_gap"] = results["gaps"][-1] if results["gaps"] else 0.0
+  results["total_flow_mods"] = counter.flowMods
+  results["tcam_high_water"] = counter.highWater
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description = "offline SciPass balancer simulator")
+  parser.add_argument("--config", default = "/etc/SciPass/SciPass.xml")
+  parser.add_argument("--dpid", help = "switch dpid, defaults to the first in the config")
+  parser.add_argument("--domain", help = "domain name, defaults to the first of the switch")
+  parser.add_argument("--matrix", choices = MATRICES + ["all"], default = "all")
+  parser.add_argument("--cycles", type = int, default = 60)
+  parser.add_argument("--interval", type = float, default = 15, help = "seconds per stats interval")
+  parser.add_argument("--hosts", type = int, default = 2000)
+  parser.add_argument("--rate", type = float, default = 10e9, help = "total bits per second")
+  parser.add_argument("--period", type = int, default = 40, help = "cycles per day in the diurnal matrix")
+  parser.add_argument("--seed", type = int, default = 1)
+  parser.add_argument("--json", action = "store_true", help = "print the full results as json")
+  args = parser.parse_args()
+
+  logger = logging.getLogger("simulator")
+  logger.setLevel(logging.CRITICAL)
+  api = SciPass(logger = logger, config = args.config)
+  dpid = args.dpid or sorted(api.config.keys())[0]
+  domainName = args.domain or sorted(api.config[dpid].keys())[0]
+  lanPrefixes = set()
+  for port in api.config[dpid][domainName]['ports']['lan']:
+    for prefix in port['prefixes']:
+      lanPrefixes.add(Prefix.fromNetwork(prefix['prefix']))
+  lanPrefixes = sorted(lanPrefixes)
+
+  kinds = MATRICES if args.matrix == "all" else [args.matrix]
+  report = {}
+  for kind in kinds:
+    matrix = TrafficMatrix(kind, lanPrefixes, args.hosts, args.rate, args.period, args.seed)
+    report[kind] = simulate(api, dpid, domainName, matrix, args.cycles, args.interval)
+
+  if(args.json):
+    print json.dumps(report, indent = 2, sort_keys = True)
+    return
+  print "%-10s %10s %10s %10s %12s %10s" % ("matrix", "converged", "max gap", "final gap", "flow-mods", "tcam max")
+  for kind in kinds:
+    res = report[kind]
+    converged = "never" if res["converged_seconds"] is None else "%ds" % res["converged_seconds"]
+    print "%-10s %10s %10.3f %10.3f %12d %10d" % (kind, converged, res["max_gap"], res["final_gap"],
+                                                  res["total_flow_mods"], res["tcam_high_water"])
+
+if __name__ == '__main__':
+  main()
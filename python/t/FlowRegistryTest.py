@@ -0,0 +1,66 @@
+import sys
+sys.path.append(".")
+import unittest
+import logging
+import ipaddr
+from FlowRegistry import FlowRegistry
+from FlowRegistry import matchKey
+from FlowRegistry import flowKey
+
+logging.basicConfig()
+
+
+class TestFlowRegistry(unittest.TestCase):
+
+    def test_match_key(self):
+        #--- the same match as SciPass, the flow builders and a flow removed message write it
+        header = {'nw_src': ipaddr.IPv4Network("10.0.20.2/32"), 'tp_dst': 80, 'phys_port': 2}
+        self.assertTrue(matchKey(header) == matchKey({'nw_src': "10.0.20.2/32", 'tp_dst': "80", 'phys_port': 2}))
+        self.assertTrue(matchKey(header) == matchKey({'nw_src': "10.0.20.2", 'tp_dst': 80, 'phys_port': 2}))
+        self.assertTrue(matchKey({'nw_dst': ("10.0.20.0", "255.255.255.0")}) == matchKey({'nw_dst': "10.0.20.0/24"}))
+        #--- and as the OF 1.3 flow builder renames it
+        self.assertTrue(matchKey(header) == matchKey({'ipv4_src': "10.0.20.2/32", 'tp_dst': 80, 'in_port': 2}))
+        self.assertTrue(matchKey(header) != matchKey({'nw_src': "10.0.20.2/32", 'tp_dst': 80}))
+        hash(matchKey(header))
+
+    def test_add_remove(self):
+        registry = FlowRegistry()
+        match = {'nw_src': "10.0.20.2/32", 'phys_port': 2}
+        key = registry.add("1", "R&E", match, 500, {'name': "a"})
+        registry.add("2", "R&E", match, 500, {'name': "b"})
+        registry.add("1", "R&E", match, 600, {'name': "c"})
+        #--- the same key again replaces the flow in place
+        self.assertTrue(registry.add("1", "R&E", match, "500", {'name': "d"}) == key)
+        self.assertTrue(key == flowKey("1", "R&E", {'nw_src': ipaddr.IPv4Network("10.0.20.2/32"), 'phys_port': "2"}, 500))
+        self.assertTrue(registry.hasKey(key))
+        self.assertTrue(len(registry) == 3)
+        self.assertTrue([flow['name'] for flow in registry] == ["d", "b", "c"])
+        self.assertTrue(("1", "R&E", match, 600) in registry)
+        self.assertTrue(registry.get("2", "R&E", match, 500)['name'] == "b")
+        self.assertTrue(registry.remove(match, 500, dpid="2") == [{'name': "b"}])
+        self.assertTrue(registry.remove(match, 500, dpid="2") == [])
+        #--- no dpid or domain removes the match from every switch
+        registry.add("2", "R&E", match, 500, {'name': "b"})
+        self.assertTrue(len(registry.remove(match, 500)) == 2)
+        self.assertTrue(registry.values() == [{'name': "c"}])
+        self.assertTrue(len(registry.byMatch) == 1)
+        #--- by key, the match index goes with the last flow
+        key = flowKey("1", "R&E", match, 600)
+        self.assertTrue(registry.removeKey(key) == {'name': "c"})
+        self.assertTrue(registry.removeKey(key) is None)
+        self.assertTrue(len(registry) == 0 and len(registry.byMatch) == 0)
+
+    def test_remove_newest(self):
+        registry = FlowRegistry()
+        match = {'nw_src': "10.0.20.2/32", 'phys_port': 2}
+        registry.add("1", "R&E", match, 500, {'name': "a"})
+        registry.add("1", "R&E", match, 600, {'name': "b"})
+        registry.add("2", "R&E", match, 600, {'name': "c"})
+        self.assertTrue(registry.removeNewest(2) == [{'name': "c"}, {'name': "b"}])
+        self.assertTrue(registry.values() == [{'name': "a"}])
+        self.assertTrue(len(registry.byMatch) == 1)
+        self.assertTrue(registry.removeNewest(0) == [])
+
+def suite():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFlowRegistry)
+    return suite
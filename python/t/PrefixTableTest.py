@@ -0,0 +1,54 @@
+import sys
+sys.path.append(".")
+import unittest
+import logging
+import ipaddr
+from Prefix import Prefix
+from PrefixTable import PrefixTable
+
+logging.basicConfig()
+
+
+class TestPrefixTable(unittest.TestCase):
+
+    def test_dict_view(self):
+        table = PrefixTable(2)
+        nets = Prefix.fromNetwork("10.0.0.0/22").Subnet(new_prefix=24)
+        for i, net in enumerate(nets):
+            table[net] = i * 100
+        #--- the arrays grow past their initial size
+        self.assertTrue(len(table) == 4)
+        self.assertTrue(table[nets[3]] == 300)
+        self.assertTrue(table.has_key(nets[1]))
+        self.assertTrue(ipaddr.IPv4Network("10.0.2.0/24") in table)
+        self.assertTrue(sorted(table.keys()) == nets)
+        self.assertTrue(dict(table.items())[nets[2]] == 200)
+        del table[nets[1]]
+        self.assertTrue(nets[1] not in table)
+        self.assertTrue(table.get(nets[1]) is None)
+        #--- a missing prefix reads as 0 and is added, like a defaultdict
+        self.assertTrue(table[nets[1]] == 0)
+        self.assertTrue(len(table) == 4)
+        #--- freed slots are reused
+        self.assertTrue(len(table.prefixes) == 4)
+
+    def test_group_columns(self):
+        table = PrefixTable()
+        nets = Prefix.fromNetwork("10.0.0.0/22").Subnet(new_prefix=24)
+        for i, net in enumerate(nets):
+            table[net] = (i + 1) * 100
+            table.setGroup(net, i % 2)
+        table.setPacketRate(nets[0], 50)
+        self.assertTrue(table.getPacketRate(nets[0]) == 50)
+        self.assertTrue(table.groupTotals() == {0: 400, 1: 600})
+        self.assertTrue(table.groupTotals('hosts') == {0: 512, 1: 512})
+        self.assertTrue(table.groupPrefixes(1) == [nets[3], nets[1]])
+        table.setGroup(nets[3], None)
+        del table[nets[2]]
+        self.assertTrue(table.groupTotals() == {0: 100, 1: 200})
+        self.assertTrue(table.groupPrefixes(0) == [nets[0]])
+        self.assertTrue(table.groupPrefixes(5) == [])
+
+def suite():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPrefixTable)
+    return suite
@@ -0,0 +1,68 @@
+import sys
+sys.path.append(".")
+import ipaddr
+import copy
+import random
+import unittest
+import logging
+from Prefix import Prefix
+
+logging.basicConfig()
+
+
+class TestPrefix(unittest.TestCase):
+
+    def test_ipaddr_compat(self):
+        for net in [ipaddr.IPv4Network("10.0.0.0/8"), ipaddr.IPv4Network("192.168.1.128/25"),
+                    ipaddr.IPv4Network("0.0.0.0/0"), ipaddr.IPv6Network("2001:0DB8::/48"),
+                    ipaddr.IPv6Network("2001:db8:0:8000::/49"), ipaddr.IPv6Network("::/0"),
+                    ipaddr.IPv6Network("fe80:0:0:1::/64"), ipaddr.IPv6Network("2001:0:0:1::/64")]:
+            prefix = Prefix.fromNetwork(net)
+            self.assertTrue(str(prefix) == str(net))
+            self.assertTrue(hash(prefix) == hash(net))
+            self.assertTrue(prefix == net)
+            self.assertTrue(prefix.numhosts == net.numhosts)
+            self.assertTrue(prefix.toNetwork() == net)
+            self.assertTrue(Prefix.fromNetwork(str(net)) == prefix)
+
+    def test_random_str(self):
+        random.seed(1)
+        for i in range(500):
+            words = [random.choice([0, 0, 0, random.randint(1, 0xffff)]) for x in range(8)]
+            net = ipaddr.IPv6Network(":".join(["%x" % w for w in words]) + "/128")
+            self.assertTrue(str(Prefix.fromNetwork(net)) == str(net))
+
+    def test_dict_lookup(self):
+        bw = {}
+        bw[Prefix.fromNetwork(ipaddr.IPv4Network("10.0.0.0/24"))] = 5
+        self.assertTrue(bw[ipaddr.IPv4Network("10.0.0.0/24")] == 5)
+        self.assertFalse(bw.has_key(ipaddr.IPv4Network("10.0.0.0/25")))
+
+    def test_split_and_contains(self):
+        prefix = Prefix.fromNetwork("10.0.0.0/24")
+        subnets = prefix.Subnet()
+        self.assertTrue(subnets == [Prefix.fromNetwork("10.0.0.0/25"), Prefix.fromNetwork("10.0.0.128/25")])
+        self.assertTrue(subnets[1].Supernet() == prefix)
+        self.assertTrue(len(prefix.subnet(prefixlen_diff=3)) == 8)
+        self.assertTrue(prefix.Contains(subnets[1]))
+        self.assertTrue(prefix.Contains(ipaddr.IPv4Network("10.0.0.64/26")))
+        self.assertFalse(subnets[0].Contains(prefix))
+        self.assertFalse(prefix.Contains(Prefix.fromNetwork("2001:db8::/48")))
+        self.assertTrue(subnets[0].overlaps(prefix))
+        self.assertFalse(subnets[0].overlaps(subnets[1]))
+        self.assertRaises(ValueError, Prefix.fromNetwork("10.0.0.1/32").Subnet)
+        #unaligned input is stored as its network
+        self.assertTrue(str(Prefix(4, int(ipaddr.IPv4Address("10.0.0.5")), 24)) == "10.0.0.0/24")
+        self.assertTrue(copy.deepcopy(prefix) is prefix)
+
+    def test_many_ipv6(self):
+        base = Prefix.fromNetwork("2001:db8::/32")
+        prefixes = {}
+        for i in xrange(100000):
+            prefixes[Prefix(6, base.network + (i << 64), 64)] = i
+        self.assertTrue(len(prefixes) == 100000)
+        self.assertTrue(prefixes[ipaddr.IPv6Network("2001:db8:0:1::/64")] == 1)
+
+def suite():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPrefix)
+    return suite
@@ -0,0 +1,92 @@
+import sys
+sys.path.append(".")
+import ipaddr
+import unittest
+import logging
+from PrefixTrie import PrefixTrie
+
+logging.basicConfig()
+
+
+class TestPrefixTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = PrefixTrie()
+
+    def test_insert_get_delete(self):
+        net = ipaddr.IPv4Network("10.0.0.0/24")
+        net2 = ipaddr.IPv4Network("10.0.1.0/24")
+        self.trie.insert(net, 1)
+        self.trie.insert(net2, 2)
+        self.assertTrue(len(self.trie) == 2)
+        self.assertTrue(self.trie.get(net) == 1)
+        self.assertTrue(self.trie.get(net2) == 2)
+        self.assertTrue(self.trie.get(ipaddr.IPv4Network("10.0.0.0/23")) == None)
+        self.assertTrue(net in self.trie)
+        #replacing keeps the count
+        self.trie.insert(net, 3)
+        self.assertTrue(len(self.trie) == 2)
+        self.assertTrue(self.trie.get(net) == 3)
+        self.assertTrue(self.trie.delete(net) == 1)
+        self.assertTrue(self.trie.delete(net) == 0)
+        self.assertTrue(len(self.trie) == 1)
+        self.assertTrue(self.trie.get(net) == None)
+        self.assertTrue(self.trie.get(net2) == 2)
+
+    def test_longest_match(self):
+        self.trie.insert(ipaddr.IPv4Network("10.0.0.0/8"), "a")
+        self.trie.insert(ipaddr.IPv4Network("10.1.0.0/16"), "b")
+        self.trie.insert(ipaddr.IPv4Network("10.1.2.0/24"), "c")
+        match = self.trie.longestMatch(ipaddr.IPv4Network("10.1.2.128/25"))
+        self.assertTrue(match[1] == "c")
+        match = self.trie.longestMatch(ipaddr.IPv4Network("10.1.3.0/24"))
+        self.assertTrue(match[1] == "b")
+        match = self.trie.longestMatch(ipaddr.IPv4Network("10.2.0.0/16"))
+        self.assertTrue(match[1] == "a")
+        self.assertTrue(self.trie.longestMatch(ipaddr.IPv4Network("11.0.0.0/8")) == None)
+        matches = self.trie.matches(ipaddr.IPv4Network("10.1.2.0/24"))
+        self.assertTrue([m[1] for m in matches] == ["a", "b", "c"])
+
+    def test_overlaps(self):
+        self.trie.insert(ipaddr.IPv4Network("10.0.0.0/25"))
+        self.assertTrue(self.trie.overlaps(ipaddr.IPv4Network("10.0.0.0/24")))
+        self.assertTrue(self.trie.overlaps(ipaddr.IPv4Network("10.0.0.64/26")))
+        self.assertFalse(self.trie.overlaps(ipaddr.IPv4Network("10.0.0.128/25")))
+        self.assertTrue(self.trie.overlaps(ipaddr.IPv4Network("0.0.0.0/0")))
+        self.assertFalse(self.trie.overlaps(ipaddr.IPv6Network("::/0")))
+        covered = self.trie.covered(ipaddr.IPv4Network("10.0.0.0/16"))
+        self.assertTrue(len(covered) == 1)
+
+    def test_ipv6(self):
+        net = ipaddr.IPv6Network("2001:db8::/48")
+        net2 = ipaddr.IPv6Network("2001:db8:0:8000::/49")
+        self.trie.insert(net, 1)
+        self.trie.insert(net2, 2)
+        self.assertTrue(self.trie.longestMatch(ipaddr.IPv6Network("2001:db8:0:8000::/64"))[1] == 2)
+        self.assertTrue(self.trie.longestMatch(ipaddr.IPv6Network("2001:db8::/64"))[1] == 1)
+        self.assertTrue(self.trie.longestMatch(ipaddr.IPv4Network("10.0.0.0/8")) == None)
+        self.trie.delete(net)
+        self.assertTrue(self.trie.longestMatch(ipaddr.IPv6Network("2001:db8::/64")) == None)
+        self.assertTrue(self.trie.keys() == [net2])
+
+    def test_many(self):
+        net = ipaddr.IPv4Network("10.0.0.0/16")
+        subnets = list(net.subnet(new_prefix=24))
+        for i, subnet in enumerate(subnets):
+            self.trie.insert(subnet, i)
+        self.assertTrue(len(self.trie) == 256)
+        for i, subnet in enumerate(subnets):
+            self.assertTrue(self.trie.get(subnet) == i)
+        for subnet in subnets[::2]:
+            self.trie.delete(subnet)
+        self.assertTrue(len(self.trie) == 128)
+        self.assertTrue(len(self.trie.covered(net)) == 128)
+        for i, subnet in enumerate(subnets):
+            if(i % 2):
+                self.assertTrue(self.trie.get(subnet) == i)
+            else:
+                self.assertFalse(self.trie.overlaps(subnet))
+
+def suite():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPrefixTrie)
+    return suite
@@ -0,0 +1,57 @@
+import sys
+sys.path.append(".")
+import unittest
+import logging
+from PriorityAllocator import PriorityAllocator
+
+logging.basicConfig()
+
+
+class TestPriorityAllocator(unittest.TestCase):
+
+    def test_allocate_release(self):
+        allocator = PriorityAllocator(base=500, limit=1000, blockSize=100)
+        starts = [allocator.allocate() for i in range(5)]
+        self.assertTrue(starts == [500, 600, 700, 800, 900])
+        #--- the space is full
+        self.assertTrue(allocator.allocate() is None)
+        self.assertTrue(allocator.blockOf(750) == 700)
+        self.assertTrue(allocator.blockOf(499) is None)
+        self.assertTrue(allocator.blocksIn(650, 100) == [600, 700])
+        allocator.release(600)
+        allocator.release(700)
+        #--- neighbouring holes are merged
+        self.assertTrue(allocator.free == [[600, 200]])
+        self.assertTrue(allocator.allocate(150) == 600)
+        self.assertTrue(allocator.free == [[750, 50]])
+        #--- releasing the last block lowers the high water mark
+        allocator.release(900)
+        self.assertTrue(allocator.top == 900)
+        allocator.release(800)
+        self.assertTrue(allocator.top == 750)
+        self.assertTrue(allocator.free == [])
+
+    def test_compaction(self):
+        allocator = PriorityAllocator(base=500, limit=2000, blockSize=100)
+        for i in range(6):
+            allocator.allocate()
+        allocator.release(500)
+        allocator.release(700)
+        res = allocator.utilisation()
+        self.assertTrue(res['allocated'] == 400)
+        self.assertTrue(res['fragments'] == 2)
+        self.assertTrue(res['high_water'] == 1100)
+        #--- only the two highest blocks move, into the two holes
+        plan = allocator.compactionPlan()
+        self.assertTrue(plan == [(1000, 500), (900, 700)])
+        self.assertTrue(allocator.compactionPlan(pinned=set([1000])) == [])
+        for old, new in plan:
+            allocator.move(old, new)
+        self.assertTrue(sorted(allocator.blocks.keys()) == [500, 600, 700, 800])
+        self.assertTrue(allocator.free == [])
+        self.assertTrue(allocator.top == 900)
+        self.assertTrue(allocator.utilisation()['utilisation'] == 400 / 1500.0)
+
+def suite():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPriorityAllocator)
+    return suite
@@ -0,0 +1,57 @@
+import sys
+sys.path.append(".")
+import unittest
+import logging
+from RateHistory import RateHistory
+
+logging.basicConfig()
+
+
+class TestRateHistory(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        history = RateHistory(3)
+        self.assertTrue(len(history) == 0)
+        self.assertTrue(history.latest() == 0)
+        for i in range(1, 6):
+            history.add(i * 5, 5, i * 1000, i * 10)
+        #--- only the last 3 intervals are kept, oldest first
+        self.assertTrue(len(history) == 3)
+        self.assertTrue([s['timestamp'] for s in history.getSamples()] == [15, 20, 25])
+        self.assertTrue(history.rates() == [3000 * 8 / 5.0, 4000 * 8 / 5.0, 5000 * 8 / 5.0])
+        self.assertTrue(history.packetRates() == [6.0, 8.0, 10.0])
+        self.assertTrue(history.latest() == 8000)
+        #--- a zero length interval counts as no traffic
+        history.add(30, 0, 1000, 10)
+        self.assertTrue(history.latest() == 0)
+
+    def test_estimators(self):
+        history = RateHistory(8)
+        for value in [100, 100, 100, 1000, 100]:
+            history.add(0, 1, value / 8.0)
+        #--- a single burst only moves the average part of the way
+        self.assertTrue(history.ewma(.5) == 325)
+        self.assertTrue(history.percentile(50) == 100)
+        self.assertTrue(history.percentile(95) == 1000)
+        self.assertTrue(history.percentile(0) == 100)
+        self.assertTrue(RateHistory(4).ewma(.5) == 0)
+
+    def test_forecast(self):
+        history = RateHistory(8)
+        self.assertTrue(history.forecast(.5, .5, .5) == 0)
+        for value in [100, 200, 300, 400]:
+            history.add(0, 1, value / 8.0)
+        #--- a steady ramp is carried on to the next interval
+        self.assertTrue(history.forecast(1, 1, 0) == 500)
+        #--- not enough samples for a season of 4 yet, so the same as no season
+        self.assertTrue(history.forecast(1, 1, 0, 4) == 500)
+        #--- a repeating low/high cycle predicts the low that comes next, not the average
+        values = [100, 500] * 4
+        self.assertTrue(history.forecast(.5, .5, .5, 2, values) == 100)
+        self.assertTrue(history.forecast(.5, .5, .5, 2, values[:-1]) == 500)
+        #--- never predicts negative traffic
+        self.assertTrue(history.forecast(1, 1, 0, 0, [400, 100]) == 0)
+
+def suite():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRateHistory)
+    return suite
@@ -6,6 +6,7 @@ from mock import Mock
 import logging
 import ipaddr
 import os
+import time
 from SciPass import SciPass
 import libxml2
 import xmlrunner
@@ -211,6 +212,65 @@ class TestFunctionality(unittest.TestCase):
         self.api.updatePrefixBW("%016x" % datapath.id, ipaddr.IPv6Network("2001:0DB8::/48"), 500,500)
         self.assertTrue(self.api.getBalancer("%016x" % datapath.id, "R&E").getPrefixBW(ipaddr.IPv6Network("2001:0DB8::/48")), 1000)
 
+    def test_prefix_history(self):
+        datapath = Mock(id=1)
+        self.api.switchJoined(datapath)
+        dpid = "%016x" % datapath.id
+        self.api.getBalancer(dpid, "R&E").rateHistorySize = 8
+        self.api.updatePrefixBW(dpid, ipaddr.IPv4Network("10.0.19.0/24"), 500, 500, interval=5, packets=20)
+        self.api.updatePrefixBW(dpid, ipaddr.IPv4Network("10.0.17.0/24"), 500, 500, interval=5, packets=20)
+        history = self.api.getPrefixHistory(dpid, "R&E", "10.0.19.0/24")
+        self.assertTrue(history.keys() == ["10.0.19.0/24"])
+        self.assertTrue(history["10.0.19.0/24"]['rate'] == 8000)
+        self.assertTrue(history["10.0.19.0/24"]['samples'][0]['bytes'] == 5000)
+        self.assertTrue(history["10.0.19.0/24"]['samples'][0]['packets'] == 20)
+        self.assertTrue(len(self.api.getPrefixHistory(dpid, "R&E")) == 2)
+
+    def test_create_balancer(self):
+        dpid = "%016x" % 1
+        domain = self.api.config[dpid]["R&E"]
+        #--- a second balancer built from the same domain config, with nothing registered
+        balancer = self.api.createBalancer(domain)
+        self.assertTrue(balancer is not self.api.getBalancer(dpid, "R&E"))
+        self.assertTrue(balancer.getConfig() == self.api.getBalancer(dpid, "R&E").getConfig())
+        self.assertTrue(balancer.addPrefixHandlers == [])
+        #--- the priority limit defaults to the whole 16 bit space
+        self.assertTrue(domain['priority_limit'] == 65535)
+        self.assertTrue(balancer.priorityAllocator.limit == 65535)
+
+    def test_domain_utilisation(self):
+        dpid = "%016x" % 1
+        utilisation = self.api.getDomainUtilisation(dpid, "R&E")
+        self.assertTrue(len(utilisation) > 0)
+        for group in utilisation:
+            self.assertTrue(utilisation[group]['capacity'] == 10e9)
+            self.assertTrue(utilisation[group]['utilisation'] == 0)
+        self.assertTrue(self.api.getDomainUtilisation(dpid, "missing") == None)
+
+    def test_set_sensor_loads(self):
+        res = self.api.setSensorLoads([{"sensor_id": "Bro_1", "load": .5, "timestamp": 100},
+                                       {"sensor_id": "SNORT_2", "load": "0.25"},
+                                       {"sensor_id": "nope", "load": .1}])
+        self.assertTrue(res['success'] == 0)
+        self.assertTrue(res['updated'] == 2)
+        self.assertTrue(res['failed'] == ["nope"])
+        balancer = self.api.getBalancer("%016x" % 1, "R&E")
+        self.assertTrue(balancer.getSensorLoad()["Bro_1"] == .5)
+        self.assertTrue(self.api.getSensorLoad("Bro_1")['timestamp'] == 100)
+        self.assertTrue(self.api.getSensorLoad("SNORT_2")['load'] == .25)
+        self.assertTrue(self.api.setSensorLoad("Bro_1", .7)['success'] == 1)
+        self.assertTrue(balancer.getGroupLoad("group1") == .7)
+
+    def test_prefix_flow_mod_count(self):
+        datapath = Mock(id=1)
+        self.api.switchJoined(datapath)
+        dpid = "%016x" % datapath.id
+        #--- one src and one dst rule on the lan port routing the prefix
+        self.assertTrue(self.api.getPrefixFlowModCount(dpid, "R&E", ipaddr.IPv4Network("10.0.19.0/25")) == 2)
+        self.assertTrue(self.api.getPrefixFlowModCount(dpid, "R&E", ipaddr.IPv4Network("10.0.21.0/24")) == 0)
+        balancer = self.api.getBalancer(dpid, "R&E")
+        self.assertTrue(balancer.getActionCost("move", ipaddr.IPv4Network("10.0.19.0/24")) == 4)
+
     def test_good_flow(self):
         flows = []
         def flowSent(dpid = None, domain=None, header = None, actions = None,command = None, priority = None, idle_timeout = None, hard_timeout = None):
@@ -275,6 +335,167 @@ class TestFunctionality(unittest.TestCase):
         self.assertEqual(flow['command'],"ADD")
         self.assertEqual(flow['dpid'],"%016x" % datapath.id)
 
+    def test_flow_batch(self):
+        flows = []
+        self.api.registerForwardingStateChangeHandler(lambda **kwargs: flows.append(kwargs))
+        datapath = Mock(id=1)
+        self.api.switchJoined(datapath)
+        del flows[:]
+        res = self.api.good_flows([{"nw_src": "10.0.20.2/32", "nw_dst":"156.56.6.1/32", "tp_src":1, "tp_dst":2},
+                                   {"nw_src": "not an address", "nw_dst":"156.56.6.1/32"},
+                                   {"nw_src": "10.0.17.2/32", "nw_dst":"156.56.6.1/32", "tp_src":"x"},
+                                   {"nw_src": "10.0.19.2/32", "nw_dst":"156.56.6.1/32", "tp_src":3, "tp_dst":4}])
+        #--- the bad messages fail on their own without installing anything
+        self.assertTrue(res['success'] == 0)
+        self.assertTrue(res['failed'] == [1, 2])
+        self.assertTrue([result['success'] for result in res['results']] == [1, 0, 0, 1])
+        self.assertTrue(len(flows) == 4)
+        self.assertTrue(len(self.api.get_good_flows()) == 4)
+        res = self.api.bad_flows([{"nw_src": "10.0.20.2/32", "nw_dst":"156.56.6.1/32", "tp_src":1, "tp_dst":2}])
+        self.assertTrue(res['success'] == 1)
+        self.assertTrue(len(flows) == 6)
+        #--- a message that raises after queuing its flows takes them back out
+        def failing(obj):
+            self.api.good_flow(obj)
+            raise ValueError("switch went away")
+        res = self.api._flowBatch(failing, [{"nw_src": "10.0.21.2/32", "nw_dst":"156.56.6.1/32", "tp_src":5, "tp_dst":6}])
+        self.assertTrue(res['failed'] == [0])
+        self.assertTrue(len(flows) == 6)
+        self.assertTrue(len(self.api.get_good_flows()) == 4)
+        #--- held back flow-mods go out a switch at a time in the order they were made
+        del flows[:]
+        self.api._firePendingFlowMods([{'dpid': "1", 'priority': 1}, {'dpid': "2", 'priority': 2}, {'dpid': "1", 'priority': 3}])
+        self.assertTrue([flow['priority'] for flow in flows] == [1, 3, 2])
+
+    def test_signal_coalescing(self):
+        flows = []
+        self.api.registerForwardingStateChangeHandler(lambda **kwargs: flows.append(kwargs))
+        datapath = Mock(id=1)
+        self.api.switchJoined(datapath)
+        dpid = "%016x" % datapath.id
+        del flows[:]
+        signal = {"nw_src": "10.0.20.2/32", "nw_dst":"156.56.6.1/32", "tp_src":1, "tp_dst":2}
+        self.assertTrue(self.api.good_flow(signal)['success'] == 1)
+        self.assertTrue(len(flows) == 2)
+        #--- the switch side timeouts, with the header renamed the way the OF 1.3 builder leaves it
+        for flow in flows:
+            header = dict(flow['header'])
+            header['in_port'] = header.pop('phys_port')
+            self.api.pushTimeouts({'timeout': 0, 'dpid': dpid, 'domain': "R&E", 'idle_timeout': 90,
+                                   'pkt_count': 0, 'header': header, 'actions': [], 'priority': 65535}, None)
+        #--- the same 5-tuple again only refreshes the timeouts
+        res = self.api.good_flow(dict(signal, nw_src="10.0.20.2"))
+        self.assertTrue(res['success'] == 1 and res['coalesced'] == 1)
+        self.assertTrue(len(flows) == 2)
+        self.assertTrue(len(self.api.get_good_flows()) == 2)
+        for idle in self.api.idleTimeouts.values():
+            self.assertTrue(idle['timeout'] > 0)
+        counters = self.api.getSignalCounters()
+        self.assertTrue(counters['good_flow'] == {'new': 1, 'coalesced': 1})
+        self.assertTrue(counters['tracked'] == 1)
+        #--- once one of its flows is gone the signal installs them again
+        self.api.remove_flow(header={'nw_src': "10.0.20.2/32", 'nw_dst': "156.56.6.1/32",
+                                     'tp_src': 1, 'tp_dst': 2, 'phys_port': 2}, priority=65535)
+        self.assertTrue(self.api.good_flow(signal)['success'] == 1)
+        self.assertTrue(len(flows) == 4)
+        self.assertTrue(self.api.getSignalCounters()['good_flow'] == {'new': 2, 'coalesced': 1})
+        #--- bad flows are counted on their own
+        self.api.bad_flow(signal)
+        self.api.bad_flow(signal)
+        self.assertTrue(len(flows) == 6)
+        self.assertTrue(self.api.getSignalCounters()['bad_flow'] == {'new': 1, 'coalesced': 1})
+
+    def test_whitelist_aggregation(self):
+        flows = []
+        self.api.registerForwardingStateChangeHandler(lambda **kwargs: flows.append(kwargs))
+        datapath = Mock(id=1)
+        self.api.switchJoined(datapath)
+        dpid = "%016x" % datapath.id
+        self.api.config[dpid]["R&E"]['whitelist_aggregate_threshold'] = 3
+        del flows[:]
+        for port in range(4):
+            self.api.good_flow({"nw_src": "10.0.20.2/32", "nw_dst": "156.56.6.1/32", "tp_src": 5000 + port, "tp_dst": 2811})
+        self.assertTrue(len(self.api.get_good_flows()) == 8)
+        for flow in flows:
+            self.api.pushTimeouts({'timeout': time.time() + 90, 'dpid': dpid, 'domain': "R&E", 'idle_timeout': 90,
+                                   'pkt_count': 0, 'header': flow['header'], 'actions': [], 'priority': 65535}, None)
+        self.assertTrue(len(self.api.idleTimeouts) == 8)
+        #--- over the threshold the streams become one wildcard rule at the same priority
+        del flows[:]
+        self.api.TimeoutFlows(dpid, [])
+        self.assertTrue([flow['command'] for flow in flows] == ["ADD"] * 2 + ["DELETE_STRICT"] * 8)
+        #--- and the flows it replaced take their idle timeouts with them
+        self.assertTrue(len(self.api.idleTimeouts) == 0)
+        good = self.api.get_good_flows()
+        self.assertTrue(len(good) == 2)
+        for flow in good:
+            self.assertTrue(not flow['header'].has_key('tp_src') and flow['priority'] == 65535)
+        aggregates = self.api.getWhitelistAggregates()
+        self.assertTrue(aggregates['aggregates'] == 1 and aggregates['entries'] == 2)
+        self.assertTrue(aggregates['tcam_saved'] == 6)
+        #--- another stream of the pair rides on the wildcard rule
+        del flows[:]
+        res = self.api.good_flow({"nw_src": "10.0.20.2/32", "nw_dst": "156.56.6.1/32", "tp_src": 6000, "tp_dst": 2811})
+        self.assertTrue(res['success'] == 1)
+        self.assertTrue(flows == [])
+        self.assertTrue(self.api.getWhitelistAggregates()['tcam_saved'] == 8)
+        #--- once the streams go quiet the ones left get their own flows back
+        members = self.api.aggregates.values()[0]['members']
+        for member in members.values()[:-1]:
+            member['seen'] = 0
+        self.api.TimeoutFlows(dpid, [])
+        self.assertTrue([flow['command'] for flow in flows] == ["ADD"] * 2 + ["DELETE_STRICT"] * 2)
+        good = self.api.get_good_flows()
+        self.assertTrue(len(good) == 2)
+        for flow in good:
+            self.assertTrue(6000 in (flow['header'].get('tp_src'), flow['header'].get('tp_dst')))
+        aggregates = self.api.getWhitelistAggregates()
+        self.assertTrue(aggregates['aggregates'] == 0 and aggregates['tcam_saved'] == 0)
+        self.assertTrue(aggregates['aggregated'] == 1 and aggregates['deaggregated'] == 1)
+
+    def test_port_index(self):
+        #--- an address finds the lan ports whose prefixes hold it, in config order
+        entries = self.api._portsContaining(ipaddr.IPv4Network("10.0.20.2/32"), 'lan')
+        self.assertTrue([(entry[4]['port_id'], str(entry[5]['prefix'])) for entry in entries] == [('2', "10.0.20.0/24")])
+        self.assertTrue(self.api._portsContaining(ipaddr.IPv4Network("10.0.20.2/32"), 'wan') == [])
+        self.assertTrue(len(self.api._portsContaining(ipaddr.IPv6Network("2001:db8::1/128"), 'lan')) == 1)
+        matches = self.api._lanMatches(ipaddr.IPv4Network("10.0.17.5/32"), ipaddr.IPv4Network("10.0.20.2/32"))
+        self.assertTrue(len(matches) == 1)
+        dpid, domain, lan_matches = matches[0]
+        self.assertTrue(domain == "R&E")
+        self.assertTrue([(port['port_id'], src, dst) for port, prefix, src, dst in lan_matches] == [('1', True, False), ('2', False, True)])
+        #--- a signal for addresses outside every lan installs nothing
+        flows = []
+        self.api.registerForwardingStateChangeHandler(lambda **kwargs: flows.append(kwargs))
+        self.assertTrue(self.api.good_flow({"nw_src": "192.168.0.1/32", "nw_dst": "192.168.0.2/32"})['success'] == 1)
+        self.assertTrue(self.api.bad_flow({"nw_src": "192.168.0.1/32", "nw_dst": "192.168.0.2/32"})['success'] == 1)
+        self.assertTrue(flows == [])
+
+    def test_remove_flow(self):
+        datapath = Mock(id=1)
+        self.api.switchJoined(datapath)
+        dpid = "%016x" % datapath.id
+        self.api.good_flow({"nw_src": "10.0.20.2/32", "nw_dst":"156.56.6.1/32", "tp_src":1, "tp_dst":2})
+        self.assertTrue(len(self.api.get_good_flows()) == 2)
+        #--- a flow removed message names no switch and reports the match as the switch has it
+        self.api.remove_flow(header={'nw_src': "10.0.20.2", 'nw_dst': ("156.56.6.1", "255.255.255.255"),
+                                     'tp_src': 1, 'tp_dst': 2, 'phys_port': 2}, priority=65535)
+        flows = self.api.get_good_flows()
+        self.assertTrue(len(flows) == 1)
+        self.assertTrue(flows[0]['header']['phys_port'] == 10)
+        self.api.remove_flow(header={'nw_src': "156.56.6.1/32", 'nw_dst': "10.0.20.2/32",
+                                     'tp_src': 2, 'tp_dst': 1, 'phys_port': 10}, priority="65535")
+        self.assertTrue(self.api.get_good_flows() is None)
+        #--- installed flows are counted once however often they are pushed
+        header = {'nw_src': ipaddr.IPv4Network("10.0.20.2/32"), 'phys_port': 2}
+        count = self.api.flowCount
+        self.api.pushFlows(dpid, "R&E", header, [], 500)
+        self.api.pushFlows(dpid, "R&E", header, [], 500)
+        self.assertTrue(self.api.flowCount == count + 1)
+        self.assertTrue(self.api.getDomainFlows(dpid, "R&E")[-1]['header'] == {'nw_src': "10.0.20.2/32", 'phys_port': 2})
+        self.api.remove_flow(dpid, "R&E", header, 500)
+        self.assertTrue(self.api.flowCount == count)
+
     def test_block_unknown_prefix(self):
         pass
     
@@ -8,7 +8,8 @@ import logging
 import os
 import json
 import time
-from SimpleBalancer import SimpleBalancer,MaxPrefixlenError
+from SimpleBalancer import SimpleBalancer,MaxPrefixlenError,DuplicatePrefixError,MaxFlowCountError
+from Prefix import Prefix
 from SciPass import SciPass
 from collections import defaultdict
 from mock import Mock
@@ -88,6 +89,37 @@ class TestSensorMods(unittest.TestCase):
         res = self.balancer.setSensorLoad(1,2)
         self.assertTrue(res == 0)
 
+    def test_sensor_load_timeout(self):
+        self.balancer = SimpleBalancer(ignorePrefixBW = 0, sensorLoadTimeout = 30)
+        for group_id in (1, 2):
+            sensors = defaultdict(list)
+            sensors[group_id] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": "10GE",
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+        #--- nothing reported yet
+        self.assertTrue(self.balancer.getGroupLoad(1) == None)
+        now = time.time()
+        self.assertTrue(self.balancer.setSensorLoad(1, .9, now) == 1)
+        self.assertTrue(self.balancer.setSensorLoad(2, .2, now - 60) == 1)
+        self.assertTrue(self.balancer.getGroupLoad(1) == .9)
+        self.assertTrue(self.balancer.getGroupLoad(2) == None)
+        self.assertTrue(self.balancer.getSensorLoadDetails(2)['stale'])
+        #--- an older sample does not replace a newer one
+        self.assertTrue(self.balancer.setSensorLoad(1, .1, now - 10) == 0)
+        self.assertTrue(self.balancer.getGroupLoad(1) == .9)
+        #--- the group's bandwidth utilisation counts when the sensors under report
+        net = ipaddr.IPv4Network("10.0.0.0/24")
+        self.balancer.addGroupPrefix(2, net, 0)
+        self.balancer.setPrefixBW(net, 500000000, 500000000)
+        self.assertTrue(self.balancer.getGroupLoadEstimate(2) == .8)
+        self.assertTrue(self.balancer.setSensorLoad(2, .3, now) == 1)
+        self.assertTrue(self.balancer.getGroupLoadEstimate(2) == .8)
+        self.assertTrue(self.balancer.getGroupLoadEstimate(1) == .9)
+
     def test_set_sensor_status(self):
         sensors = defaultdict(list)
         sensors[1] = {"sensor_id": 1, "of_port_id": 1, "description": "sensor foo"}
@@ -108,6 +140,28 @@ class TestSensorMods(unittest.TestCase):
         status = self.balancer.getSensorStatus(3)
         self.assertTrue(status == -1)
 
+    def test_unload_group(self):
+        for group_id in (1, 2, 3):
+            sensors = defaultdict(list)
+            sensors[group_id] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": "10GE",
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+        nets = [ipaddr.IPv4Network("10.0.%d.0/24" % i) for i in range(2)]
+        for net in nets:
+            self.balancer.addGroupPrefix(1, net, 0)
+        self.balancer.setSensorLoad(2, .5)
+        self.balancer.setSensorLoad(3, .1)
+        self.assertTrue(self.balancer.setSensorStatus(3, 0) == 1)
+        #--- a group going down hands its prefixes to the least loaded group still up
+        self.assertTrue(self.balancer.setSensorStatus(1, 0) == 1)
+        self.assertTrue(len(self.balancer.getSensorGroup(1)['prefixes']) == 0)
+        for net in nets:
+            self.assertTrue(self.balancer.getPrefixGroup(net) == 2)
+
 
 class TestPrefix(unittest.TestCase):
 
@@ -233,13 +287,14 @@ class TestPrefix(unittest.TestCase):
         self.assertTrue(self.prefix == net)
         self.assertTrue(self.priority == 500)
 
+        #--- the block the deleted prefix used is free again
         net = ipaddr.IPv6Network("2001:0DB8::/48")
         res = self.balancer.addGroupPrefix(1,net,100)
         self.assertTrue(res == 1)
         self.assertTrue(self.handler_fired == 1)
         self.assertTrue(self.sensor == 1)
         self.assertTrue(self.prefix == net)
-        self.assertTrue(self.priority == 600)
+        self.assertTrue(self.priority == 500)
         #cleam them out
         self.handler = 0
         self.sensor = None
@@ -251,7 +306,7 @@ class TestPrefix(unittest.TestCase):
         self.assertTrue(self.handler_fired == 1)
         self.assertTrue(self.sensor == 1)
         self.assertTrue(self.prefix == net)
-        self.assertTrue(self.priority == 600)
+        self.assertTrue(self.priority == 500)
 
         
     def test_move_sensor_prefix(self):
@@ -343,7 +398,154 @@ class TestPrefix(unittest.TestCase):
         self.assertTrue(prefixBW[newnet2] == 8 * 5000000.0)
         self.assertTrue(prefixBW[newnet3] == 8 * 5000000.0)
         self.assertTrue(prefixBW[newnet4] == 8 * 5000000.0)
-        
+
+    def test_rate_history(self):
+        self.balancer.rateHistorySize = 4
+        self.balancer.rateEstimator = "ewma"
+        self.balancer.rateAlpha = .5
+        net = Prefix.fromNetwork("10.0.0.0/24")
+        self.balancer.addGroupPrefix(1,net,0)
+        for rate in [1000, 1000, 1000, 10000]:
+            self.balancer.setPrefixBW(net,rate,0,interval=5,packets=10)
+        #--- one burst does not make the prefix look 10 times busier
+        self.assertTrue(self.balancer.getPrefixBW(net) == 8 * 5500)
+        self.assertTrue(self.balancer.getGroupBW(1) == 8 * 5500)
+        history = self.balancer.getPrefixHistory(net)
+        self.assertTrue(len(history) == 4)
+        self.assertTrue(history.getSamples()[-1]['bytes'] == 50000)
+        self.assertTrue(history.packetRates()[-1] == 2)
+        self.balancer.rateEstimator = "percentile"
+        self.balancer.ratePercentile = 50
+        self.balancer.setPrefixBW(net,1000,0)
+        self.assertTrue(self.balancer.getPrefixBW(net) == 8 * 1000)
+        self.balancer.delGroupPrefix(1,net)
+        self.assertTrue(self.balancer.getPrefixHistory(net) is None)
+
+    def test_compact_priorities(self):
+        events = []
+        self.balancer.registerAddPrefixHandler(lambda group, prefix, priority: events.append(("add", str(prefix), priority)))
+        self.balancer.registerDelPrefixHandler(lambda group, prefix, priority: events.append(("del", str(prefix), priority)))
+        nets = [Prefix.fromNetwork("10.%d.0.0/24" % i) for i in range(4)]
+        for net in nets:
+            self.balancer.addGroupPrefix(1,net,0)
+        self.assertTrue(self.balancer.getPrefixPriority(nets[3])['priority'] == 800)
+        self.balancer.splitSensorPrefix(1,nets[3])
+        self.balancer.delGroupPrefix(1,nets[1])
+        res = self.balancer.getPriorityUtilisation()
+        self.assertTrue(res['allocated'] == 300)
+        self.assertTrue(res['fragments'] == 1)
+        del events[:]
+        #--- a switch out of room leaves the block and its rules where they were
+        def full(group, prefix, priority):
+            if(priority == 650):
+                raise MaxFlowCountError("full")
+        self.balancer.registerAddPrefixHandler(full)
+        self.assertTrue(self.balancer.compactPriorities() == 0)
+        self.assertTrue(events == [("add", "10.3.0.0/25", 600), ("add", "10.3.0.128/25", 650),
+                                   ("del", "10.3.0.0/25", 600)])
+        self.assertTrue(self.balancer.getPrefixPriority(Prefix.fromNetwork("10.3.0.128/25"))['priority'] == 850)
+        self.assertTrue(self.balancer.getPriorityUtilisation()['fragments'] == 1)
+        self.balancer.addPrefixHandlers.remove(full)
+        del events[:]
+        #--- only the highest block moves down, each rule is added before the old one goes
+        self.assertTrue(self.balancer.compactPriorities() == 2)
+        self.assertTrue(events == [("add", "10.3.0.0/25", 600), ("add", "10.3.0.128/25", 650),
+                                   ("del", "10.3.0.0/25", 800), ("del", "10.3.0.128/25", 850)])
+        self.assertTrue(self.balancer.getPrefixPriority(nets[2])['priority'] == 700)
+        self.assertTrue(self.balancer.getPriorityUtilisation()['high_water'] == 800)
+        self.assertTrue(self.balancer.getPriorityUtilisation()['fragments'] == 0)
+        #--- a new top level prefix takes the next free block
+        self.balancer.addGroupPrefix(2,nets[1],0)
+        self.assertTrue(self.balancer.getPrefixPriority(nets[1])['priority'] == 800)
+        self.assertTrue(self.balancer.compactPriorities() == 0)
+
+    def test_rate_forecast(self):
+        self.balancer.rateHistorySize = 8
+        self.balancer.rateEstimator = "forecast"
+        self.balancer.rateAlpha = 1
+        self.balancer.rateBeta = 1
+        net = Prefix.fromNetwork("10.0.0.0/24")
+        self.balancer.addGroupPrefix(1,net,0)
+        for rate in [1000, 2000, 3000]:
+            self.balancer.setPrefixBW(net,rate,0)
+        #--- a growing prefix is balanced on what it is expected to carry next
+        self.assertTrue(self.balancer.getPrefixBW(net) == 8 * 4000)
+        self.assertTrue(self.balancer.getGroupBW(1) == 8 * 4000)
+
+    def test_measure_before_split(self):
+        self.balancer.measureSplits = 1
+        added = []
+        deleted = []
+        self.balancer.registerAddPrefixHandler(lambda group, prefix, priority: added.append((group, prefix, priority)))
+        self.balancer.registerDelPrefixHandler(lambda group, prefix, priority: deleted.append((group, prefix, priority)))
+        net = Prefix.fromNetwork("10.0.0.0/24")
+        halves = net.Subnet()
+        self.balancer.addGroupPrefix(1,net,0)
+        self.balancer.addGroupPrefix(2,Prefix.fromNetwork("10.1.0.0/24"),0)
+        self.balancer.setPrefixBW(Prefix.fromNetwork("10.1.0.0/24"),250,250)
+        self.balancer.setPrefixBW(net,1000,1000)
+        priority = self.balancer.getPrefixPriority(net)['priority']
+        del added[:]
+
+        #--- the first call only installs counting rules just above the prefix
+        res = self.balancer.splitSensorPrefix(1,net)
+        self.assertTrue(res == 0)
+        self.assertTrue(added == [(1, halves[0].toNetwork(), priority + 1), (1, halves[1].toNetwork(), priority + 1)])
+        self.assertTrue(self.balancer.getPrefixGroup(net) == 1)
+        #--- the prefix's own rule stops counting, its bandwidth comes from the halves
+        self.balancer.setPrefixBW(net,0,0)
+        self.assertTrue(self.balancer.getPrefixBW(net) == 16000)
+        self.balancer.setPrefixBW(halves[0],100,100)
+        res = self.balancer.splitSensorPrefix(1,net)
+        self.assertTrue(res == 0)
+        self.balancer.setPrefixBW(halves[1],900,900)
+        self.assertTrue(self.balancer.getPrefixBW(net) == 16000)
+
+        #--- now it splits with the measured numbers and moves the half that helps balance
+        res = self.balancer.splitSensorPrefix(1,net)
+        self.assertTrue(res == 1)
+        self.assertTrue((1, halves[0].toNetwork(), priority + 1) in deleted)
+        self.assertTrue((1, halves[1].toNetwork(), priority + 1) in deleted)
+        self.assertTrue(self.balancer.getPrefixBW(halves[0]) == 1600)
+        self.assertTrue(self.balancer.getPrefixBW(halves[1]) == 14400)
+        self.assertTrue(self.balancer.getPrefixGroup(halves[0]) == 2)
+        self.assertTrue(self.balancer.getPrefixGroup(halves[1]) == 1)
+        self.assertTrue(self.balancer.measurements == {})
+
+    def test_merge_subtrees(self):
+        self.balancer.mergeMode = "subtree"
+        net = Prefix.fromNetwork("10.0.0.0/24")
+        res = self.balancer.addGroupPrefix(1,net,0)
+        self.assertTrue(res == 1)
+        priority = self.balancer.getPrefixPriority(net)['priority']
+        #--- split down to 4 /26s spread over both groups
+        self.balancer.splitSensorPrefix(1,net)
+        for half in net.Subnet():
+            self.balancer.splitSensorPrefix(1,half)
+        quarters = net.Subnet(new_prefix=26)
+        self.balancer.moveGroupPrefix(1,2,quarters[1])
+        self.balancer.moveGroupPrefix(1,2,quarters[2])
+        for quarter in quarters:
+            self.balancer.setPrefixBW(quarter,1000,1000)
+        #--- a busy /26 keeps its half of the tree split
+        self.balancer.setPrefixBW(quarters[3],500000000,500000000)
+        res = self.balancer.merge()
+        self.assertTrue(res == 1)
+        self.assertTrue(self.balancer.getPrefixGroup(net.Subnet()[0]) is not None)
+        self.assertTrue(self.balancer.getPrefixGroup(quarters[0]) is None)
+        self.assertTrue(self.balancer.getPrefixGroup(quarters[2]) == 2)
+        self.assertTrue(self.balancer.getPrefixBW(net.Subnet()[0]) == 2 * 16000)
+        #--- once it quiets down the whole /24 comes back in one pass
+        self.balancer.setPrefixBW(quarters[3],1000,1000)
+        res = self.balancer.merge()
+        self.assertTrue(res == 1)
+        self.assertTrue(list(self.balancer.prefix_list) == [net])
+        self.assertTrue(self.balancer.getPrefixPriority(net)['priority'] == priority)
+        self.assertTrue(self.balancer.getPrefixPriority(net)['total'] == 100)
+        #--- never past the least specific prefix length
+        res = self.balancer.merge()
+        self.assertTrue(res == 0)
+
     def test_split_prefix(self):
         net = ipaddr.IPv4Network("10.0.0.0/11")
         res = self.balancer.splitPrefix(net)
@@ -372,6 +574,72 @@ class TestPrefix(unittest.TestCase):
         pp.pprint(sensor)
         self.assertTrue(sensor == None)
 
+    def test_add_overlapping_prefix(self):
+        net = ipaddr.IPv4Network("10.0.0.0/24")
+        res = self.balancer.addGroupPrefix(1,net,0)
+        self.assertTrue(res == 1)
+        self.assertRaises(DuplicatePrefixError, self.balancer.addGroupPrefix, 1, ipaddr.IPv4Network("10.0.0.0/25"), 0)
+        self.assertRaises(DuplicatePrefixError, self.balancer.addGroupPrefix, 1, ipaddr.IPv4Network("10.0.0.0/23"), 0)
+        res = self.balancer.addGroupPrefix(1,ipaddr.IPv4Network("10.0.1.0/24"),0)
+        self.assertTrue(res == 1)
+        self.assertTrue(self.balancer.getPrefixGroup(ipaddr.IPv4Network("10.0.1.0/24")) == 1)
+        self.assertTrue(self.balancer.getPrefixPriority(ipaddr.IPv4Network("10.0.0.128/25"))['priority'] == 500)
+        res = self.balancer.delGroupPrefix(1,net)
+        self.assertTrue(res == 1)
+        self.assertTrue(self.balancer.getPrefixGroup(net) == None)
+        res = self.balancer.addGroupPrefix(2,ipaddr.IPv4Network("10.0.0.0/25"),0)
+        self.assertTrue(res == 1)
+        self.assertTrue(self.balancer.getPrefixGroup(ipaddr.IPv4Network("10.0.0.0/25")) == 2)
+
+    def test_move_prefix_index(self):
+        net = ipaddr.IPv4Network("10.0.0.0/24")
+        res = self.balancer.addGroupPrefix(1,net,0)
+        self.assertTrue(res == 1)
+        res = self.balancer.moveGroupPrefix(1,2,net)
+        self.assertTrue(res == 1)
+        self.assertTrue(self.balancer.getPrefixGroup(net) == 2)
+        #the new group now rejects overlaps, the old group no longer does
+        self.assertRaises(DuplicatePrefixError, self.balancer.addGroupPrefix, 2, ipaddr.IPv4Network("10.0.0.0/25"), 0)
+        self.assertFalse(self.balancer.groupIndex[1].overlaps(net))
+        #split children are indexed against the group they land in
+        res = self.balancer.splitSensorPrefix(2,net)
+        self.assertTrue(res == 1)
+        self.assertTrue(self.balancer.getPrefixGroup(net) == None)
+        self.assertTrue(self.balancer.getPrefixGroup(ipaddr.IPv4Network("10.0.0.0/25")) == 2)
+        self.assertTrue(self.balancer.getPrefixGroup(ipaddr.IPv4Network("10.0.0.128/25")) == 2)
+        self.assertTrue(len(self.balancer.groupIndex[2]) == 2)
+
+    def test_group_aggregates(self):
+        self.balancer.debugAggregates = 1
+        net = ipaddr.IPv4Network("10.0.0.0/24")
+        net2 = ipaddr.IPv4Network("10.0.1.0/24")
+        net3 = ipaddr.IPv6Network("2001:0DB8::/48")
+        self.balancer.addGroupPrefix(1,net,0)
+        self.balancer.addGroupPrefix(1,net2,0)
+        self.balancer.addGroupPrefix(2,net3,0)
+        self.balancer.setPrefixBW(net,1000,1000)
+        self.balancer.setPrefixBW(net2,500,500)
+        self.balancer.setPrefixBW(net3,250,250)
+        group = self.balancer.getSensorGroup(1)
+        self.assertTrue(self.balancer.getGroupBW(1) == 8 * 3000)
+        self.assertTrue(group['hosts'] == 512)
+        self.assertTrue(group['prefixCount'] == 2)
+        self.balancer.moveGroupPrefix(1,2,net2)
+        self.assertTrue(self.balancer.getGroupBW(1) == 8 * 2000)
+        self.assertTrue(self.balancer.getGroupBW(2) == 8 * 1500)
+        self.assertTrue(group['hosts'] == 256)
+        self.balancer.splitSensorPrefix(1,net)
+        self.assertTrue(group['prefixCount'] == 2)
+        self.assertTrue(self.balancer.getGroupBW(1) == 8 * 2000)
+        self.balancer.delGroupPrefix(2,net3)
+        self.assertTrue(self.balancer.getGroupBW(2) == 8 * 1000)
+        self.assertTrue(self.balancer.getSensorGroup(2)['prefixCount'] == 1)
+        self.assertTrue(self.balancer._checkGroupAggregates() == 0)
+        #drift is reported and repaired
+        group['bandwidth'] = 0
+        self.assertTrue(self.balancer._checkGroupAggregates() == 1)
+        self.assertTrue(self.balancer.getGroupBW(1) == 8 * 2000)
+
     def test_get_largest_prefix(self):
         net = ipaddr.IPv4Network("10.220.0.0/12")
         res = self.balancer.addGroupPrefix(1,net,0)
@@ -426,6 +694,29 @@ class TestBalance(unittest.TestCase):
         self.assertTrue(percentTotal == 0.5)
         
 
+    def test_balance_sensor_split(self):
+        self.balancer = SimpleBalancer(ignoreSensorLoad = 0)
+        for group_id in (1, 2):
+            sensors = defaultdict(list)
+            sensors[group_id] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": "10GE",
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+        net = Prefix.fromNetwork("10.0.0.0/24")
+        self.assertTrue(self.balancer.addGroupPrefix(1,net,0) == 1)
+        self.assertTrue(self.balancer.addGroupPrefix(2,Prefix.fromNetwork("10.0.1.0/24"),0) == 1)
+        self.balancer.setPrefixBW(net,5000000,5000000)
+        self.balancer.setSensorLoad(1,.95)
+        self.balancer.setSensorLoad(2,.6)
+        #--- the hot prefix does not fit on the other group, so it is split in place
+        self.balancer.balance()
+        self.assertTrue(sorted([str(prefix) for prefix in self.balancer.getSensorGroup(1)['prefixes']]) ==
+                        ["10.0.0.0/25", "10.0.0.128/25"])
+        self.assertTrue(self.balancer.getPrefixPriority(Prefix.fromNetwork("10.0.0.128/25"))['priority'] == 550)
+
     def test_balance_by_ip(self):
         self.balancer = SimpleBalancer()
         self.balancer = SimpleBalancer()
@@ -494,6 +785,326 @@ class TestBalance(unittest.TestCase):
         self.assertTrue(res == 1)
         self.balancer.balanceByNetBytes([] )
 
+    def test_balance_global(self):
+        self.balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                        ignorePrefixBW = 0,
+                                        sensorConfigurableThresh = 1,
+                                        balanceMode = "global")
+        for group_id in range(1,5):
+            sensors = defaultdict(list)
+            sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": "10GE",
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+        #--- everything starts on group 1
+        for net in Prefix.fromNetwork("10.0.0.0/21").Subnet(new_prefix=24):
+            res = self.balancer.addGroupPrefix(1,net,0)
+            self.assertTrue(res == 1)
+            self.balancer.setPrefixBW(net,5000000,5000000)
+        #--- and one prefix carries as much as all the others together
+        self.balancer.setPrefixBW(Prefix.fromNetwork("10.0.7.0/24"),35000000,35000000)
+
+        moves = []
+        self.balancer.registerMovePrefixHandler(lambda old, new, prefix, priority: moves.append(prefix))
+        self.balancer.balance()
+        #--- a single cycle moves every other prefix off group 1 and splits the heavy one in place
+        self.assertTrue(len(moves) == 7)
+        for group_id in range(2,5):
+            self.assertTrue(len(self.balancer.getSensorGroup(group_id)['prefixes']) > 0)
+        self.assertTrue(list(self.balancer.getSensorGroup(1)['prefixes']) == Prefix.fromNetwork("10.0.7.0/24").Subnet())
+        #--- the next cycle moves one of the halves away
+        self.balancer.balance()
+        half_a = self.balancer.getPrefixGroup(Prefix.fromNetwork("10.0.7.0/25"))
+        half_b = self.balancer.getPrefixGroup(Prefix.fromNetwork("10.0.7.128/25"))
+        self.assertTrue(half_a != half_b)
+        total = 0
+        for group_id in range(1,5):
+            total += self.balancer.getGroupBW(group_id)
+        for group_id in range(1,5):
+            self.assertTrue(self.balancer.getGroupBW(group_id) / total < .3)
+
+    def test_split_by_ratio(self):
+        self.balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                        ignorePrefixBW = 0,
+                                        mostSpecificPrefixLen = 29,
+                                        splitMode = "ratio")
+        for group_id in range(1,5):
+            sensors = defaultdict(list)
+            sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": "10GE",
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+            net = Prefix(4, Prefix.fromNetwork("10.0.0.0/24").network + (group_id << 8), 24)
+            res = self.balancer.addGroupPrefix(group_id,net,0)
+            self.assertTrue(res == 1)
+            self.balancer.setPrefixBW(net,500000,500000)
+        #--- carries 8 times what each other prefix does, so 8/3 of a fair share
+        hot = Prefix.fromNetwork("10.0.0.0/24")
+        res = self.balancer.addGroupPrefix(1,hot,0)
+        self.assertTrue(res == 1)
+        self.balancer.setPrefixBW(hot,4000000,4000000)
+
+        res = self.balancer.splitSensorPrefix(1,hot)
+        self.assertTrue(res == 1)
+        #--- split into 4 in one step and spread over every group
+        self.assertTrue(self.balancer.getPrefixGroup(hot) is None)
+        groups = []
+        for prefix in hot.Subnet(new_prefix=26):
+            groups.append(self.balancer.getPrefixGroup(prefix))
+            self.assertTrue(self.balancer.getPrefixBW(prefix) == 64000000 / 4)
+        self.assertTrue(sorted(groups) == [1,2,3,4])
+
+        #--- never deeper than the most specific prefix length
+        small = Prefix.fromNetwork("10.0.9.0/28")
+        res = self.balancer.addGroupPrefix(1,small,0)
+        self.balancer.setPrefixBW(small,40000000,40000000)
+        res = self.balancer.splitSensorPrefix(1,small)
+        self.assertTrue(res == 1)
+        self.assertTrue(self.balancer.getPrefixGroup(Prefix.fromNetwork("10.0.9.0/29")) is not None)
+        self.assertTrue(self.balancer.getPrefixGroup(Prefix.fromNetwork("10.0.9.8/29")) is not None)
+
+    def test_flow_mod_budget(self):
+        #--- room for a single move per cycle
+        self.balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                        ignorePrefixBW = 0,
+                                        flowModBudget = 4)
+        for group_id in range(1,3):
+            sensors = defaultdict(list)
+            sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": "10GE",
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+        for net in Prefix.fromNetwork("10.0.0.0/21").Subnet(new_prefix=24):
+            res = self.balancer.addGroupPrefix(1,net,0)
+            self.assertTrue(res == 1)
+            self.balancer.setPrefixBW(net,5000000,5000000)
+        self.assertTrue(self.balancer.getActionCost("move", Prefix.fromNetwork("10.0.0.0/24")) == 4)
+        self.assertTrue(self.balancer.getActionCost("split", Prefix.fromNetwork("10.0.0.0/24"),
+                                                    Prefix.fromNetwork("10.0.0.0/24").Subnet()) == 6)
+
+        moves = []
+        self.balancer.registerMovePrefixHandler(lambda old, new, prefix, priority: moves.append(prefix))
+        #--- without the budget this cycle would move 3 prefixes
+        self.balancer.balance()
+        self.assertTrue(len(moves) == 1)
+        self.assertTrue(self.balancer.getConfig()['flowModsUsed'] == 4)
+        #--- the budget is per cycle
+        self.balancer.balance()
+        self.assertTrue(len(moves) == 2)
+        self.assertTrue(len(self.balancer.getSensorGroup(2)['prefixes']) == 2)
+
+        #--- a costlier rule set leaves no room for a move at all
+        self.balancer.registerFlowModCostHandler(lambda prefix: 4)
+        self.balancer.moveGroupPrefix(2,1,Prefix.fromNetwork("10.0.0.0/24"))
+        self.balancer.balance()
+        self.assertTrue(len(moves) == 3)
+
+    def test_packet_rate_weighting(self):
+        #--- a small packet scan barely shows in bytes but costs the sensor per packet
+        moved = []
+        for ppsWeight in [0, 8000]:
+            balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                       ignorePrefixBW = 0,
+                                       ppsWeight = ppsWeight)
+            for group_id in (1, 2):
+                sensors = defaultdict(list)
+                sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+                balancer.addSensorGroup({"group_id": group_id,
+                                         "bw": "10GE",
+                                         "admin_status":"active",
+                                         "description": "some descr",
+                                         "sensors": sensors})
+            bulk = ipaddr.IPv4Network("10.0.0.0/24")
+            scan = ipaddr.IPv4Network("10.0.1.0/24")
+            other = ipaddr.IPv4Network("10.0.2.0/24")
+            balancer.addGroupPrefix(1,bulk,0)
+            balancer.addGroupPrefix(1,scan,0)
+            balancer.addGroupPrefix(2,other,0)
+            #--- 1Gbps of full size packets and 10Mbps of 64 byte packets, over a 10 second interval
+            balancer.setPrefixBW(bulk,62500000,62500000,interval=10,packets=800000)
+            balancer.setPrefixBW(scan,625000,625000,interval=10,packets=10000000)
+            balancer.setPrefixBW(other,62500000,62500000,interval=10,packets=800000)
+            self.assertTrue(balancer.getPrefixPacketRate(scan) == 1000000)
+            self.assertTrue(balancer.getGroupPacketRate(1) == 1080000)
+            balancer.registerMovePrefixHandler(lambda old, new, prefix, priority: moved.append((ppsWeight, str(prefix), new)))
+            balancer.balance()
+            self.assertTrue(balancer.getConfig()['ppsWeight'] == ppsWeight)
+        self.assertTrue(moved == [(8000, "10.0.0.0/24", 2)])
+
+    def test_action_cooldown(self):
+        for kwargs, reason in [({"actionCooldown": 60}, "cooldown"), ({"minDwellTime": 60}, "dwell")]:
+            balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                       ignorePrefixBW = 0,
+                                       **kwargs)
+            for group_id in (1, 2):
+                sensors = defaultdict(list)
+                sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+                balancer.addSensorGroup({"group_id": group_id,
+                                         "bw": "10GE",
+                                         "admin_status":"active",
+                                         "description": "some descr",
+                                         "sensors": sensors})
+            nets = [ipaddr.IPv4Network("10.0.0.0/24"), ipaddr.IPv4Network("10.0.1.0/24"), ipaddr.IPv4Network("10.0.2.0/24")]
+            balancer.addGroupPrefix(1,nets[0],0)
+            balancer.addGroupPrefix(1,nets[1],0)
+            balancer.addGroupPrefix(2,nets[2],0)
+            for net, bw in zip(nets, [1000000, 3000000, 1200000]):
+                balancer.setPrefixBW(net,bw,bw)
+            balancer.balance()
+            self.assertTrue(balancer.getPrefixGroup(nets[0]) == 2)
+            #--- the traffic shifts and would send it straight back
+            balancer.setPrefixBW(nets[1],1000,1000)
+            balancer.balance()
+            self.assertTrue(balancer.getPrefixGroup(nets[0]) == 2)
+            self.assertTrue(balancer.getSuppressedActions()[reason]["move"] == 1)
+            self.assertTrue(balancer.getConfig()['suppressedActions'][reason]["move"] == 1)
+            #--- once it has waited long enough it can go
+            balancer.actionHistory[Prefix.fromNetwork(nets[0])]['time'] -= 61
+            balancer.actionHistory[Prefix.fromNetwork(nets[0])]['arrived'] -= 61
+            balancer.balance()
+            self.assertTrue(balancer.getPrefixGroup(nets[0]) == 1)
+
+    def test_load_hysteresis(self):
+        balancer = SimpleBalancer(sensorLoadDeltaThresh = .05, loadHysteresis = .02)
+        self.assertFalse(balancer._deltaExceeded(.06))
+        self.assertTrue(balancer.getSuppressedActions()["hysteresis"]["balance"] == 1)
+        self.assertTrue(balancer._deltaExceeded(.08))
+        #--- keeps balancing inside the band until the delta drops below it
+        self.assertTrue(balancer._deltaExceeded(.04))
+        self.assertFalse(balancer._deltaExceeded(.02))
+        self.assertFalse(balancer._deltaExceeded(.04))
+        self.assertTrue(balancer.getSuppressedActions()["hysteresis"]["balance"] == 1)
+
+    def test_distribute_by_history(self):
+        state = {"switch": {"0000000000000001": {"domain": {"IUPUI": {"mode": {"Balancer": {
+                    "prefixes": ["10.0.0.0/25", "10.0.0.128/25", "10.0.1.0/24"],
+                    "prefix_bw": {"10.0.0.0/25": 6e9, "10.0.0.128/25": 1e9, "10.0.1.0/24": 1e9}}}}}}}}
+        balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                   ignorePrefixBW = 0,
+                                   state = state)
+        for group_id in (1, 2):
+            sensors = defaultdict(list)
+            sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            balancer.addSensorGroup({"group_id": group_id,
+                                     "bw": "10GE",
+                                     "admin_status":"active",
+                                     "description": "some descr",
+                                     "sensors": sensors})
+        balancer.addPrefix(ipaddr.IPv4Network("10.0.0.0/24"))
+        balancer.addPrefix(ipaddr.IPv4Network("10.0.1.0/24"))
+        balancer.pushToSwitch(dpid = "0000000000000001", domain_name = "IUPUI", mode = "Balancer")
+        #--- the hot /25 is split in two and everything packed to 4Gbps a group
+        prefixes = sorted([str(prefix) for prefix in balancer.getPrefixes().keys()])
+        self.assertTrue(prefixes == ["10.0.0.0/26", "10.0.0.128/25", "10.0.0.64/26", "10.0.1.0/24"])
+        self.assertTrue(balancer.getGroupBW(1) == 4e9)
+        self.assertTrue(balancer.getGroupBW(2) == 4e9)
+        self.assertTrue(balancer.getPrefixBW(ipaddr.IPv4Network("10.0.0.0/26")) == 3e9)
+        self.assertTrue(Prefix.fromNetwork("10.0.0.0/24") not in balancer.prefix_list)
+        #--- and the previous state is not pushed over it
+        balancer.pushPrevState(dpid = "0000000000000001", domain_name = "IUPUI", mode = "Balancer")
+        self.assertTrue(balancer.getGroupBW(1) == 4e9)
+
+    def test_distribute_by_history_shares_block(self):
+        #--- a /16 saved as 1024 /26s comes back in the one block of the /16
+        subnets = [str(net) for net in Prefix.fromNetwork("10.0.0.0/16").Subnet(new_prefix=26)]
+        state = {"switch": {"0000000000000001": {"domain": {"IUPUI": {"mode": {"Balancer": {
+                    "prefixes": subnets,
+                    "prefix_bw": dict((net, 1e6) for net in subnets)}}}}}}}
+        balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                   ignorePrefixBW = 0,
+                                   maxPrefixes = 2000,
+                                   state = state)
+        for group_id in (1, 2):
+            sensors = defaultdict(list)
+            sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            balancer.addSensorGroup({"group_id": group_id,
+                                     "bw": "10GE",
+                                     "admin_status":"active",
+                                     "description": "some descr",
+                                     "sensors": sensors})
+        balancer.addPrefix(ipaddr.IPv4Network("10.0.0.0/16"))
+        balancer.pushToSwitch(dpid = "0000000000000001", domain_name = "IUPUI", mode = "Balancer")
+        self.assertTrue(len(balancer.getPrefixes()) == 1024)
+        priorities = set([balancer.getPrefixPriority(prefix)['priority'] for prefix in balancer.getPrefixes()])
+        self.assertTrue(min(priorities) == 500)
+        self.assertTrue(max(priorities) < 600)
+        self.assertTrue(balancer.getPriorityUtilisation()['blocks'] == 1)
+
+    def test_vectorized_state(self):
+        #--- the array backed state makes the same decisions as the dicts
+        results = []
+        for vectorize in [0, 1]:
+            balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                       ignorePrefixBW = 0,
+                                       debugAggregates = 1,
+                                       vectorizeState = vectorize)
+            for group_id in range(1,4):
+                sensors = defaultdict(list)
+                sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+                balancer.addSensorGroup({"group_id": group_id,
+                                         "bw": "10GE",
+                                         "admin_status":"active",
+                                         "description": "some descr",
+                                         "sensors": sensors})
+            for i, net in enumerate(Prefix.fromNetwork("10.0.0.0/21").Subnet(new_prefix=24)):
+                balancer.addGroupPrefix(1,net,0)
+                balancer.setPrefixBW(net,(i + 1) * 100000,(i + 1) * 100000,interval=10,packets=1000)
+            moves = []
+            balancer.registerMovePrefixHandler(lambda old, new, prefix, priority: moves.append((old, new, str(prefix))))
+            for i in range(3):
+                balancer.balance()
+            self.assertTrue(balancer._checkGroupAggregates() == 0)
+            results.append((moves, [sorted(balancer.getSensorGroup(g)['prefixes']) for g in range(1,4)],
+                            [balancer.getGroupBW(g) for g in range(1,4)]))
+        self.assertTrue(len(results[0][0]) > 0)
+        self.assertTrue(results[0] == results[1])
+        self.assertTrue(balancer.getConfig()['vectorizeState'] == 1)
+        self.assertTrue(balancer.getPrefixes().getPacketRate(Prefix.fromNetwork("10.0.0.0/24")) == 100)
+
+    def test_capacity_weighted(self):
+        self.balancer = SimpleBalancer( ignoreSensorLoad = 1,
+                                        ignorePrefixBW = 0)
+        self.assertTrue(self.balancer._parseCapacity("10GE") == 10e9)
+        self.assertTrue(self.balancer._parseCapacity("40G") == 40e9)
+        self.assertTrue(self.balancer._parseCapacity("100 Mbps") == 100e6)
+        self.assertTrue(self.balancer._parseCapacity("fast") == None)
+        for group_id, bw in [(1, "40G"), (2, "10G")]:
+            sensors = defaultdict(list)
+            sensors[1] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": bw,
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+        #--- the 40G group gets 4 of every 5 prefixes
+        nets = Prefix.fromNetwork("10.0.0.0/22").Subnet(new_prefix=25)[:5]
+        self.balancer.distributePrefixes(nets)
+        self.assertTrue(len(self.balancer.getSensorGroup(1)['prefixes']) == 4)
+        self.assertTrue(len(self.balancer.getSensorGroup(2)['prefixes']) == 1)
+        for net in nets:
+            self.balancer.delGroupPrefix(self.balancer.getPrefixGroup(net), net)
+        #--- start everything on the 10G group and balance towards equal utilisation
+        nets = Prefix.fromNetwork("10.0.0.0/21").Subnet(new_prefix=24)
+        for net in nets:
+            self.balancer.addGroupPrefix(2,net,0)
+            self.balancer.setPrefixBW(net,125000000,125000000)
+        for i in range(10):
+            self.balancer.balance()
+        self.assertTrue(self.balancer.getGroupBW(1) > 3 * self.balancer.getGroupBW(2))
+        self.assertTrue(self.balancer.getGroupUtilisation(1) == self.balancer.getGroupBW(1) / 40e9)
+        self.assertTrue(abs(self.balancer.getGroupUtilisation(1) - self.balancer.getGroupUtilisation(2)) < .05)
+        self.assertTrue(self.balancer.getGroupUtilisation(3) == None)
+
     def test_balance_by_load(self):
         self.balancer = SimpleBalancer( ignoreSensorLoad = 0,
                                         ignorePrefixBW = 0)
@@ -536,6 +1147,50 @@ class TestBalance(unittest.TestCase):
         self.balancer = SimpleBalancer()
         self
 
+class TestScale(unittest.TestCase):
+
+    def test_many_prefixes(self):
+        self.balancer = SimpleBalancer(maxPrefixes = 100000)
+        for group_id in (1, 2):
+            sensors = defaultdict(list)
+            sensors[group_id] = {"sensor_id": group_id, "of_port_id": group_id, "description": "sensor foo"}
+            res = self.balancer.addSensorGroup({"group_id": group_id,
+                                                "bw": "10GE",
+                                                "admin_status":"active",
+                                                "description": "some descr",
+                                                "sensors": sensors})
+            self.assertTrue(res == 1)
+        #--- the /24s are subnets of one configured /8 and share its priority block
+        self.balancer._setPrefixPriority(Prefix.fromNetwork("10.0.0.0/8"),
+                                         {'priority': self.balancer._allocatePriority(), 'total': 100})
+        prefixes = Prefix.fromNetwork("10.0.0.0/8").subnet(new_prefix=24)[:50000]
+        start = time.time()
+        for prefix in prefixes:
+            self.balancer.addGroupPrefix(1, prefix, 0)
+        self.assertTrue(self.balancer.getSensorGroup(1)['prefixCount'] == 50000)
+        for prefix in prefixes[::2]:
+            self.balancer.moveGroupPrefix(1, 2, prefix)
+        self.assertTrue(len(self.balancer.getSensorGroup(2)['prefixes']) == 25000)
+        self.assertTrue(self.balancer.getPrefixGroup(prefixes[0]) == 2)
+        for prefix in prefixes:
+            self.balancer.delGroupPrefix(self.balancer.getPrefixGroup(prefix), prefix)
+        elapsed = time.time() - start
+        self.assertTrue(len(self.balancer.prefix_list) == 0)
+        self.assertTrue(self.balancer.prefixCount == 0)
+        self.assertTrue(elapsed < 60)
+
+    def test_priority_exhausted(self):
+        #--- the default 16 bit space has 650 blocks, the rest are left unplaced
+        self.balancer = SimpleBalancer(maxPrefixes = 1000)
+        sensors = defaultdict(list)
+        sensors[1] = {"sensor_id": 1, "of_port_id": 1, "description": "sensor foo"}
+        self.balancer.addSensorGroup({"group_id": 1, "bw": "10GE", "admin_status":"active",
+                                      "description": "some descr", "sensors": sensors})
+        prefixes = Prefix.fromNetwork("10.0.0.0/8").subnet(new_prefix=24)[:700]
+        self.balancer.distributePrefixes(prefixes)
+        self.assertTrue(self.balancer.getSensorGroup(1)['prefixCount'] == 650)
+        self.assertTrue(self.balancer.getPriorityUtilisation()['high_water'] == 65500)
+
 class TestStateChange(unittest.TestCase):
     
     def setUp(self):
@@ -561,6 +1216,26 @@ class TestStateChange(unittest.TestCase):
         assert(domain[0] == "IUPUI")
         mode = data["switch"]["%016x" % self.datapath.id]["domain"][domain[0]]["mode"].keys()
         assert(mode[0] == "Balancer")
+
+    def test_save_prefix_bw(self):
+        net = ipaddr.IPv4Network("192.168.0.0/24")
+        balancer = self.api.getBalancer("%016x" % self.datapath.id, "IUPUI")
+        balancer.setPrefixBW(net, 1000, 1000)
+        #--- only the timed save is under test, not the ones moving prefixes makes
+        balancer.balance = Mock()
+        #--- the state was saved when the switch joined, so this pass does not save it again
+        self.api.run_balancers()
+        with open(self.state) as data_file:
+            data = json.load(data_file)
+        saved = data[0]["switch"]["%016x" % self.datapath.id]["domain"]["IUPUI"]["mode"]["Balancer"]
+        self.assertTrue(saved["prefix_bw"].get("192.168.0.0/24", 0) == 0)
+        #--- once the save interval has passed it does
+        self.api.stateSaved.clear()
+        self.api.run_balancers()
+        with open(self.state) as data_file:
+            data = json.load(data_file)
+        saved = data[0]["switch"]["%016x" % self.datapath.id]["domain"]["IUPUI"]["mode"]["Balancer"]
+        self.assertTrue(saved["prefix_bw"]["192.168.0.0/24"] == 16000)
                  
     def test_state_restore(self):
         net1 = ipaddr.IPv4Network("192.168.0.0/24")
@@ -591,5 +1266,6 @@ def suite():
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSensorMods))
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestPrefix))
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestBalance))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestScale))
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestStateChange))
     return suite
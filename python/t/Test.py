@@ -10,6 +10,12 @@ import SimpleBalancerTest
 import BalancerOnlyTest
 import InlineTest
 import SimpleBalancerOnlyTest
+import PrefixTrieTest
+import PrefixTest
+import RateHistoryTest
+import PrefixTableTest
+import PriorityAllocatorTest
+import FlowRegistryTest
 
 
 logging.basicConfig()
@@ -20,7 +26,13 @@ if __name__ == '__main__':
     balancer_only_tests = BalancerOnlyTest.suite()
     simple_balancer_only_tests = SimpleBalancerOnlyTest.suite()
     inline_tests = InlineTest.suite()
-    suite = unittest.TestSuite([scipasstests, simplebalancertests, balancer_only_tests, inline_tests, simple_balancer_only_tests])
+    prefix_trie_tests = PrefixTrieTest.suite()
+    prefix_tests = PrefixTest.suite()
+    rate_history_tests = RateHistoryTest.suite()
+    prefix_table_tests = PrefixTableTest.suite()
+    priority_allocator_tests = PriorityAllocatorTest.suite()
+    flow_registry_tests = FlowRegistryTest.suite()
+    suite = unittest.TestSuite([scipasstests, simplebalancertests, balancer_only_tests, inline_tests, simple_balancer_only_tests, prefix_trie_tests, prefix_tests, rate_history_tests, prefix_table_tests, priority_allocator_tests, flow_registry_tests])
 
     xmlrunner.XMLTestRunner(output='test-reports').run(suite)
 